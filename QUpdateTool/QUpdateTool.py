@@ -1,27 +1,79 @@
 import sys
 import os
-import signal
 import platform
 import argparse
 import configparser
 import subprocess
-import psutil
 import threading
+import json
+import atexit
+from urllib.parse import urljoin
 
-from PySide6.QtWidgets import QApplication
-
-from gui import UpdaterWindow
-from threads import DownloadThread
+## Qt, requests and psutil are imported where they are first needed so a headless run never loads Qt
+from progress import ProgressReporter, TqdmSubscriber, JsonLinesSubscriber
+from cache import DownloadCache
+from batch import BatchUpdater, ManifestError
+from utils import to_bool, parse_size, parse_list
+from metrics import Metrics
 
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
 
 class QUpdateTool():
+    app = None
+
     def __init__(self):
-        QUpdateTool.app = QApplication(sys.argv)
-        QUpdateTool.clipboard = QUpdateTool.app.clipboard()
         self.programName = "QUpdateTool"
         self.window = None
+        self.jobs = []
+        self.caches = {}
+        self.chunk_stores = {}
+        self.mirror_scores = {}
+        self.throttle = None
+        self.peers = None
+        self.async_client = None
+        self.process_thread = None
+        self.processes_stopped = True
+        self.metrics = Metrics()
+        self.profiler = None
+        self.thread_profilers = []
+        self.default_options = {"noGUI": False,
+                                "run_installer_as_admin": True,
+                                "run_after_download": True,
+                                "download_segments": 4,
+                                "progress_json": False,
+                                "use_cache": True,
+                                "cache_directory": DownloadCache.default_directory(),
+                                "cache_max_size": "2G",
+                                "expected_sha256": "",
+                                "expected_size": 0,
+                                "max_workers": 4,
+                                "download_engine": "requests",
+                                "current_version": "",
+                                "delta_manifest_url": "",
+                                "delta_base_path": "",
+                                "chunk_index_url": "",
+                                "chunk_store_directory": "",
+                                "chunk_store_max_size": "2G",
+                                "metrics_report": "",
+                                "mirrors": "",
+                                "mirror_stall_speed": "64K",
+                                "max_bandwidth": "0",
+                                "background": False,
+                                "peer_sharing": False,
+                                "peer_port": 47777,
+                                "peer_timeout": 1.0,
+                                "peer_linger": 0,
+                                "install_directory": "",
+                                "post_extract_command": "",
+                                "get_latest": True,
+                                "version_manifest_url": "",
+                                "version_check_ttl": 300,
+                                "prefetch": False,
+                                "apply": False,
+                                "profile": False}
+        self.bool_options = ["noGUI", "run_installer_as_admin", "run_after_download", "progress_json", "use_cache", "profile",
+                             "background", "peer_sharing", "prefetch", "apply", "get_latest"]
         QUpdateTool.qsoftware_logo = os.path.join(__location__, "QSoftware.png")
 
         self.main()
@@ -30,43 +82,93 @@ class QUpdateTool():
     def main(self):
         try:
             self.show_image()
-            debug = "001"
-            args, remaining_argv = self.parse_arguments()
-            debug = "002"
+            with self.metrics.span("parse_arguments"):
+                args, remaining_argv = self.parse_arguments()
             if all([value is None for value in vars(args).values()]):
-                debug = "003"
                 self.no_args = True
                 self.show_intro()
                 sys.exit()
             else:
                 self.check_args(args)
-                debug = "004"
-                self.set_default_args(args)
-                debug = "005"
-                config = self.load_config(args.config)
-                debug = "006"
-                self.merged_args = self.merge_config_and_args(config, args)
-                debug = "007"
-                threading.Thread(target=self.check_running_process())
-                debug = "008"
+                with self.metrics.span("load_config"):
+                    config = self.load_config(args.config)
+                    self.merged_args = self.merge_config_and_args(config, args)
+                    self.jobs = self.build_jobs(config, args)
+                self.start_metrics()
+                if self.jobs:
+                    self.run_batch()
+                ## Nothing to do is the common case of a scheduled check, so it ends before anything is stopped or shown
+                if not self.check_for_update(self.merged_args):
+                    sys.exit(0)
+                if self.merged_args.prefetch:
+                    self.prefetch_update()
+                self.apply_staged_update()
+                self.start_process_check()
                 if not self.merged_args.noGUI:
-                    debug = "009"
-                    self.window = UpdaterWindow(main=QUpdateTool,
-                                                software_name=self.merged_args.software_to_update,
-                                                current_version=self.merged_args.current_version,
-                                                download_location=self.merged_args.temp_download_directory,
-                                                api_endpoint=self.merged_args.download_url)
-                    debug = "010"
-                    self.window.closeEvent.connect(self.handle_download_finish)
-                    debug = "011"
+                    with self.metrics.span("create_window"):
+                        self.create_application()
+                        from gui import UpdaterWindow
+                        self.window = UpdaterWindow(main=QUpdateTool,
+                                                    software_name=self.merged_args.software_to_update,
+                                                    current_version=self.merged_args.current_version,
+                                                    download_location=self.merged_args.temp_download_directory,
+                                                    api_endpoint=self.merged_args.download_url,
+                                                    download_options=self.download_options(self.merged_args))
+                        self.window.closeEvent.connect(self.handle_download_finish)
 
                 else:
-                    debug = "012"
                     self.download_update()
-                    debug = "013"
 
         except Exception as e:
-            print(f"An error occurred (main) {debug}: {str(e)}")
+            print(f"An error occurred (main) during {self.metrics.failed_span(e) or 'startup'}: {str(e)}")
+
+
+    def start_metrics(self):
+        """ The report and profile are written when the process exits, whichever path it takes. """
+        if self.merged_args.profile:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            ## cProfile only sees the thread that enabled it, every thread started from here on gets its own
+            threading.setprofile(self.profile_thread)
+            self.profiler.enable()
+        if self.merged_args.metrics_report or self.profiler:
+            atexit.register(self.write_metrics)
+
+
+    def profile_thread(self, frame, event, arg):
+        """ Profile hook of a new thread, on its first event it hands the thread over to a cProfile profiler. """
+        import cProfile
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        self.thread_profilers.append(profiler)
+        profiler.enable()
+
+
+    def write_metrics(self):
+        directory = self.merged_args.temp_download_directory
+        if self.profiler:
+            import pstats
+            threading.setprofile(None)
+            self.profiler.disable()
+            profile_path = os.path.join(directory or ".", f"QUpdateTool_profile_{int(self.metrics.started)}.prof")
+            try:
+                ## One profile for the whole process, the download, segment and install threads merged into the main one
+                stats = pstats.Stats(self.profiler)
+                for profiler in list(self.thread_profilers):
+                    stats.add(profiler)
+                stats.dump_stats(profile_path)
+                self.metrics.set("profile", profile_path)
+                print(f"Wrote profile to {profile_path}")
+            except OSError as e:
+                print(f"Unable to write profile {profile_path}: {str(e)}")
+        if self.merged_args.metrics_report:
+            self.metrics.write(self.merged_args.metrics_report, directory)
+
+
+    def create_application(self):
+        from PySide6.QtWidgets import QApplication
+        QUpdateTool.app = QApplication(sys.argv)
+        QUpdateTool.clipboard = QUpdateTool.app.clipboard()
 
 
     def show_image(self):
@@ -114,6 +216,116 @@ class QUpdateTool():
 
           --installer_flags_msi             Installer flags for MSI Installers. If not passed this will default NONE.
 
+          --download_segments               Number of parallel range requests used for the download. If the server
+                                            does not support ranges a single stream is used. Default 4.
+
+          --progress_json                   Write download progress as JSON lines to stdout (True/False). Default FALSE.
+
+          --use_cache                       Reuse previously downloaded updates from the local cache (True/False).
+                                            Default TRUE.
+
+          --cache_directory                 Directory of the download cache. Defaults to QUpdateTool/cache in the
+                                            local app data directory.
+
+          --cache_max_size                  Maximum size of the download cache, e.g. 500M or 2G. Default 2G.
+
+          --expected_sha256                 SHA-256 of the update. The installer is only run if the download matches.
+
+          --expected_size                   Size of the update in bytes. The installer is only run if the download matches.
+
+          --manifest                        JSON manifest listing several products to update in one run. Products can
+                                            also be listed as [Updater:<name>] sections of the config file, each one
+                                            overriding the [Updater] section, flags on the command line override
+                                            both. A product installs after the products named in its depends_on.
+                                            Manifest runs are always headless.
+
+          --max_workers                     Number of products downloaded at the same time in manifest mode. Default 4.
+
+          --download_engine                 Download backend: "requests" uses a thread per connection, "asyncio" runs
+                                            every transfer and range segment on one event loop. Default requests.
+
+          --delta_manifest_url              URL of the patch manifest for --current-version. {current_version} in the
+                                            URL is replaced, otherwise ?from=<version> is appended. When a patch is
+                                            published and the installed version is available, only the patch is
+                                            downloaded. Any problem falls back to the full download.
+
+          --delta_base_path                 Installer of the current version to patch, if it is not in the cache.
+
+          --chunk_index_url                 URL of the chunk index of the update. Only the chunks missing from the local
+                                            chunk store are downloaded, payloads shared between products and versions
+                                            are reused. Any problem falls back to the full download.
+
+          --chunk_store_directory           Directory of the chunk store. Defaults to "chunks" in the cache directory.
+
+          --chunk_store_max_size            Maximum size of the chunk store, e.g. 500M or 2G. Default 2G.
+
+          --mirrors                         Comma separated mirrors of download_url, also accepted one per line in
+                                            update.ini. Every mirror is probed at once and the download starts on the
+                                            fastest, a mirror that fails or stalls hands the rest of the download to
+                                            the next one. Mirror scores are kept in the cache directory between runs.
+
+          --mirror_stall_speed              Speed below which a mirror counts as stalled and the download switches
+                                            to another mirror, e.g. 64K. Default 64K, 0 disables switching.
+
+          --max_bandwidth                   Download speed limit in bytes per second for the whole process, e.g. 2M.
+                                            Default 0 (unlimited).
+
+          --background                      Background mode (True/False): lowers the CPU and I/O priority and slows the
+                                            download down when the round trip time to the server grows, so the update
+                                            yields to interactive traffic. Stays below max_bandwidth if set.
+                                            The priority is restored before the installer runs (raising it back
+                                            needs privileges on Linux and macOS).
+                                            Default FALSE.
+
+          --peer_sharing                    Share the download cache with other instances on the LAN (True/False).
+                                            Needs expected_sha256: the update is looked up by hash over UDP multicast
+                                            and fetched from a peer that has it, falling back to the download_url and
+                                            mirrors. The downloaded file is checked against the hash either way.
+                                            Default FALSE.
+
+          --peer_port                       UDP multicast port peers talk on. Default 47777.
+
+          --peer_timeout                    Seconds to wait for peers to answer. Default 1.
+
+          --peer_linger                     Seconds to keep serving peers after the download before exiting. Default 0.
+
+          --install_directory               Directory a .zip or .tar(.gz) update is installed to. The archive is
+                                            extracted into <install_directory>.staging, then swapped in place of
+                                            install_directory by rename once the software has exited. A tar is
+                                            extracted as it downloads, over one stream: no segments and no resume
+                                            of an interrupted download. With use_cache (the default) the tar is
+                                            also written to disk for the cache, only use_cache False skips that
+                                            copy. Without install_directory archives are launched like any other
+                                            download.
+
+          --post_extract_command            Command run in install_directory after an archive update is swapped in.
+
+          --version_manifest_url            URL of a small JSON manifest of the latest release, {"version": "1.2.0"}
+                                            plus optional "download_url", "sha256" and "size" of its installer. When
+                                            get_latest is True and --current-version is not older, the run exits
+                                            before stopping the software or opening a window. The manifest is cached
+                                            in cache_directory with its ETag and revalidated after Cache-Control
+                                            max-age or version_check_ttl seconds.
+
+          --version_check_ttl               Seconds a cached version manifest is trusted without asking the server
+                                            when the response has no max-age. Default 300.
+
+          --prefetch                        Download and verify the update into <temp_download_directory>/staged
+                                            without stopping the running software (True/False). Pair it with
+                                            --background to keep the download out of the user's way. Default FALSE.
+
+          --apply                           Install the staged update: stop the running software and launch the
+                                            staged installer, without downloading (True/False). A normal run also
+                                            installs a staged update if it is still the one requested and still
+                                            matches its hash. Default FALSE.
+
+          --metrics_report                  Timing report of every phase (config, process scan, DNS, TTFB, transfer,
+                                            verify, installer launch) with bytes, retries and throughput. "file" writes
+                                            JSON to temp_download_directory, "stdout" prints it, "both" does both.
+
+          --profile                         Profile the run with cProfile, worker threads included, and write the
+                                            .prof file to temp_download_directory (True/False). Default FALSE.
+
         Example:
             Running Python:
                 python QUpdateTool.py --software_to_update MyApp --calling_pid 12345 --current_version 1.0 --noGUI=True
@@ -126,6 +338,8 @@ class QUpdateTool():
     def load_config(self, config_file):
         try:
             config = configparser.ConfigParser()
+            ## Keys must match the argument names, which are case sensitive (noGUI)
+            config.optionxform = str
             if config_file and os.path.isfile(config_file):
                 config.read(config_file)
             elif "update.ini" in os.listdir(__location__):
@@ -154,6 +368,38 @@ class QUpdateTool():
             parser.add_argument("--run_installer_as_admin", action=argparse.BooleanOptionalAction, help="Run installer as admin (True/False)")
             parser.add_argument("--run_after_download", action=argparse.BooleanOptionalAction, help="Run after download (True/False)")
             parser.add_argument("--installer_flags_msi", type=str, help="Installer flags for MSI")
+            parser.add_argument("--download_segments", type=int, help="Number of parallel range requests used for the download")
+            parser.add_argument("--progress_json", action=argparse.BooleanOptionalAction, help="Write progress as JSON lines to stdout")
+            parser.add_argument("--use_cache", action=argparse.BooleanOptionalAction, help="Reuse previously downloaded updates")
+            parser.add_argument("--cache_directory", type=str, help="Directory of the persistent download cache")
+            parser.add_argument("--cache_max_size", type=str, help="Maximum size of the download cache, e.g. 2G")
+            parser.add_argument("--expected_sha256", type=str, help="SHA-256 the downloaded update must match")
+            parser.add_argument("--expected_size", type=int, help="Size in bytes the downloaded update must match")
+            parser.add_argument("--manifest", type=str, help="JSON manifest of products to update")
+            parser.add_argument("--max_workers", type=int, help="Number of concurrent downloads in manifest mode")
+            parser.add_argument("--download_engine", type=str, choices=["requests", "asyncio"], help="Download backend")
+            parser.add_argument("--delta_manifest_url", type=str, help="URL of the patch manifest for the current version")
+            parser.add_argument("--delta_base_path", type=str, help="Installer of the current version to patch")
+            parser.add_argument("--chunk_index_url", type=str, help="URL of the chunk index of the update")
+            parser.add_argument("--chunk_store_directory", type=str, help="Directory of the chunk store")
+            parser.add_argument("--chunk_store_max_size", type=str, help="Maximum size of the chunk store, e.g. 2G")
+            parser.add_argument("--mirrors", type=str, help="Comma separated mirrors of download_url")
+            parser.add_argument("--mirror_stall_speed", type=str, help="Speed below which a mirror counts as stalled, e.g. 64K")
+            parser.add_argument("--max_bandwidth", type=str, help="Download speed limit in bytes per second, e.g. 2M")
+            parser.add_argument("--background", action=argparse.BooleanOptionalAction, help="Low priority download that yields to other traffic")
+            parser.add_argument("--peer_sharing", action=argparse.BooleanOptionalAction, help="Share the download cache with LAN peers")
+            parser.add_argument("--peer_port", type=int, help="UDP multicast port of LAN peers")
+            parser.add_argument("--peer_timeout", type=float, help="Seconds to wait for LAN peers to answer")
+            parser.add_argument("--peer_linger", type=float, help="Seconds to keep serving LAN peers after the download")
+            parser.add_argument("--install_directory", type=str, help="Directory to install .zip or .tar(.gz) updates to")
+            parser.add_argument("--post_extract_command", type=str, help="Command to run after an archive update is installed")
+            parser.add_argument("--get_latest", action=argparse.BooleanOptionalAction, help="Check the version manifest before updating")
+            parser.add_argument("--version_manifest_url", type=str, help="URL of the version manifest of the latest release")
+            parser.add_argument("--version_check_ttl", type=float, help="Seconds to trust a cached version manifest")
+            parser.add_argument("--prefetch", action=argparse.BooleanOptionalAction, help="Download and stage the update without stopping the software")
+            parser.add_argument("--apply", action=argparse.BooleanOptionalAction, help="Install the staged update")
+            parser.add_argument("--metrics_report", type=str, choices=["file", "stdout", "both"], help="Write a timing report")
+            parser.add_argument("--profile", action=argparse.BooleanOptionalAction, help="Profile the run with cProfile")
 
             return parser.parse_known_args()
 
@@ -164,7 +410,7 @@ class QUpdateTool():
 
     def check_args(self, args):
         ## Required args are download_url and temp_download_directory
-        if not isinstance(args.config, str):
+        if not isinstance(args.config, str) and not isinstance(args.manifest, str):
             ## look for config file and set if needed.
             if not isinstance(args.download_url, str):
                 print('You must pass a URL for the download!')
@@ -173,71 +419,387 @@ class QUpdateTool():
                 print('You must pass a temp directory for the download!')
                 sys.exit(1)
 
-    def set_default_args(self, args):
-        args.noGUI = False if args.noGUI == None else args.noGUI
-        args.run_installer_as_admin = True if args.run_installer_as_admin == None else args.run_installer_as_admin
-        args.run_after_download = True if args.run_after_download == None else args.run_after_download
-
-
-    def merge_config_and_args(self, config, args):
+    def merge_config_and_args(self, config, args, product=None):
+        """ Command line flags win over a product's section, which wins over [Updater], then the defaults. """
         config_args = dict(config.items("Updater")) if "Updater" in config.sections() else {}
+        config_args.update(product or {})
         for key, value in vars(args).items():
             if value is not None:
                 config_args[key] = value
+        for key, value in self.default_options.items():
+            if config_args.get(key) in (None, ""):
+                config_args[key] = value
+        for key in self.bool_options:
+            if key in config_args:
+                config_args[key] = to_bool(config_args[key])
 
         return argparse.Namespace(**config_args)
 
 
-    def check_running_process(self):
-        running_process = {}
-        print(f"Check for running PID {self.merged_args.calling_pid}...")
-        for process in psutil.process_iter(["pid", "name", "status"]):
-            if (process.info["pid"] == self.merged_args.calling_pid or 
-                process.info["name"].lower().replace(".exe", "") == self.merged_args.software_to_update.lower()):
-                running_process = process.info
+    def build_jobs(self, config, args):
+        """ One set of options per product listed as an [Updater:<name>] section or in the JSON manifest. """
+        products = {}
+        for section in config.sections():
+            if section.startswith("Updater:"):
+                products[section.split(":", 1)[1].strip()] = dict(config.items(section))
+        if args.manifest:
+            products.update(self.load_manifest(args.manifest))
 
-        if running_process:
-            pid = running_process["pid"]
-            try:
-                os.kill(pid, signal.SIGTERM)
-            except:
-                print("Ran into issue closing PID {pid}. Please re-run update.")
-                sys.exit(0)
+        jobs = []
+        for name, product in products.items():
+            job = self.merge_config_and_args(config, args, product)
+            job.name = name
+            if "software_to_update" not in product:
+                job.software_to_update = name
+            jobs.append(job)
+        return jobs
 
 
-    def download_update(self):
-        print("Updating via CLI...")
-        self.download_thread = DownloadThread(api_endpoint=self.merged_args.download_url,
-                                              download_location=self.merged_args.temp_download_directory,
-                                              gui=False)
+    def load_manifest(self, manifest_file):
+        """
+        Accepts {"defaults": {...}, "products": [{"name": ..., ...}, ...]} or just the list of products.
+        Returns the products keyed by name with the defaults applied.
+        """
+        try:
+            with open(manifest_file, "r") as file:
+                manifest = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"Unable to load manifest {manifest_file}: {str(e)}")
+            sys.exit(1)
 
+        if isinstance(manifest, list):
+            manifest = {"products": manifest}
+        products = {}
+        for product in manifest.get("products", []):
+            if "name" not in product:
+                print(f"Skipping manifest entry without a name: {product}")
+                continue
+            products[product["name"]] = {**manifest.get("defaults", {}), **product}
+        return products
 
-        self.download_thread.start()
-        self.download_thread.wait()
-        self.handle_download_finish(self.download_thread.download_location, self.download_thread.output_file)
+
+    def create_cache(self, options):
+        if not options.use_cache:
+            return None
+        try:
+            if options.cache_directory not in self.caches:
+                self.caches[options.cache_directory] = DownloadCache(directory=options.cache_directory,
+                                                                     max_size=parse_size(options.cache_max_size))
+            return self.caches[options.cache_directory]
+        except (OSError, ValueError) as e:
+            print(f"Download cache disabled: {str(e)}")
+            return None
+
+
+    def create_chunk_store(self, options):
+        if not options.chunk_index_url:
+            return None
+        directory = options.chunk_store_directory or os.path.join(options.cache_directory, "chunks")
+        try:
+            if directory not in self.chunk_stores:
+                from chunkstore import ChunkStore
+                self.chunk_stores[directory] = ChunkStore(directory=directory,
+                                                          max_size=parse_size(options.chunk_store_max_size))
+            return self.chunk_stores[directory]
+        except (OSError, ValueError) as e:
+            print(f"Chunk store disabled: {str(e)}")
+            return None
+
+
+    def create_mirror_scores(self, options):
+        from mirrors import MirrorScores
+        path = os.path.join(options.cache_directory, "mirrors.json") if parse_list(options.mirrors) else ""
+        if path not in self.mirror_scores:
+            self.mirror_scores[path] = MirrorScores(path=path)
+        return self.mirror_scores[path]
+
+
+    def create_throttle(self, options):
+        """ One bucket per process, so every product and segment shares the same limit. """
+        if self.throttle is None:
+            from throttle import Throttle
+            self.throttle = Throttle(max_bandwidth=parse_size(options.max_bandwidth), background=options.background)
+        return self.throttle
+
+
+    def create_peers(self, options):
+        """ One peer node per process, serving the cache it was started with. """
+        cache = self.create_cache(options)
+        if not options.peer_sharing or not cache:
+            return None
+        if self.peers is None:
+            from peers import PeerNode
+            self.peers = PeerNode(cache, port=int(options.peer_port), timeout=float(options.peer_timeout))
+            if not self.peers.start():
+                self.peers = False
+        return self.peers or None
+
+
+    def linger_for_peers(self):
+        if self.peers:
+            self.peers.linger(float(self.merged_args.peer_linger))
+
+
+    def download_options(self, options):
+        """ Downloader keyword arguments shared by the GUI, CLI and manifest paths. """
+        return {"engine": options.download_engine,
+                "segments": options.download_segments,
+                "cache": self.create_cache(options),
+                "expected_sha256": options.expected_sha256,
+                "expected_size": options.expected_size,
+                "current_version": options.current_version,
+                "delta_manifest_url": options.delta_manifest_url,
+                "delta_base_path": options.delta_base_path,
+                "chunk_store": self.create_chunk_store(options),
+                "chunk_index_url": options.chunk_index_url,
+                "metrics": self.metrics,
+                "mirrors": parse_list(options.mirrors),
+                "mirror_scores": self.create_mirror_scores(options),
+                "stall_speed": parse_size(options.mirror_stall_speed),
+                "throttle": self.create_throttle(options),
+                "peers": self.create_peers(options),
+                "install_directory": options.install_directory}
+
+
+    def create_downloader(self, options, reporter):
+        from engines import create_engine
+        return create_engine(api_endpoint=options.download_url,
+                             download_location=options.temp_download_directory,
+                             reporter=reporter,
+                             **self.download_options(options))
+
+
+    def check_for_update(self, options):
+        """
+        Compare the version manifest with current_version, False if the installed version is already the latest.
+        Without a manifest, or with no answer from it, the update goes ahead as it always has.
+        """
+        if not (options.get_latest and options.version_manifest_url):
+            return True
+        from versions import VersionCheck, is_newer
+        with self.metrics.span("version_check"):
+            manifest = VersionCheck(manifest_url=options.version_manifest_url,
+                                    cache_directory=options.cache_directory,
+                                    ttl=float(options.version_check_ttl)).fetch()
+        if not manifest:
+            return True
+        if options.current_version and not is_newer(manifest["version"], options.current_version):
+            print(f"{options.software_to_update} {options.current_version} is up to date (latest is {manifest['version']}).")
+            return False
+
+        print(f"Version {manifest['version']} is available (installed: {options.current_version or 'unknown'})...")
+        ## The manifest describes this exact release, so its installer and hashes win over generic settings
+        if manifest.get("download_url"):
+            options.download_url = urljoin(options.version_manifest_url, manifest["download_url"])
+        options.expected_sha256 = options.expected_sha256 or manifest.get("sha256", "")
+        options.expected_size = options.expected_size or manifest.get("size", 0)
+        return True
+
+
+    def run_batch(self):
+        up_to_date = {job.name for job in self.jobs if not self.check_for_update(job)}
+        self.jobs = [job for job in self.jobs if job.name not in up_to_date]
+        if not self.jobs:
+            print("Every product is up to date.")
+            sys.exit(0)
+        print(f"Updating {len(self.jobs)} products via manifest...")
+        try:
+            workers = int(self.merged_args.max_workers)
+            self.start_process_check(self.jobs)
+            use_asyncio = self.merged_args.download_engine == "asyncio"
+            if not use_asyncio:
+                from downloader import Downloader
+                Downloader.create_session(pool_size=workers * max(int(job.download_segments) for job in self.jobs))
+            updater = BatchUpdater(jobs=self.jobs,
+                                   max_workers=workers,
+                                   download=self.download_job,
+                                   download_async=self.download_job_async if use_asyncio else None,
+                                   run_installer=self.run_installer,
+                                   up_to_date=up_to_date)
+            success = updater.run()
+        except ManifestError as e:
+            print(f"Manifest error: {str(e)}")
+            success = False
+        self.linger_for_peers()
+        sys.exit(0 if success else 1)
+
+
+    def download_job(self, job, index):
+        downloader = self.create_downloader(job, self.create_job_reporter(job, index))
+        with self.metrics.span("download", product=job.name):
+            downloader.run()
+        return downloader.output_file, downloader.message
+
+
+    async def download_job_async(self, job, index):
+        from async_downloader import AsyncHttpClient
+        ## Created on the batch event loop and shared, so every product reuses the same connections
+        if self.async_client is None:
+            self.async_client = AsyncHttpClient(metrics=self.metrics)
+        job.download_engine = "asyncio"
+        downloader = self.create_downloader(job, self.create_job_reporter(job, index))
+        with self.metrics.span("download", product=job.name):
+            await downloader.download(self.async_client)
+        return downloader.output_file, downloader.message
+
+
+    def create_job_reporter(self, job, index):
+        reporter = ProgressReporter()
+        reporter.subscribe(JsonLinesSubscriber(name=job.name) if job.progress_json else TqdmSubscriber(position=index, desc=job.name))
+        return reporter
+
+
+    def start_process_check(self, jobs=None):
+        """ Stop the running software in the background while the update downloads. """
+        self.processes_stopped = False
+        self.process_thread = threading.Thread(target=self.check_running_process, args=(jobs,), daemon=True)
+        self.process_thread.start()
+
+
+    def check_running_process(self, jobs=None):
+        from processes import ProcessLocator
+        ## One process scan at most, shared by every job in manifest mode
+        locator = ProcessLocator()
+        processes = {}
+        with self.metrics.span("process_scan"):
+            for job in jobs or [self.merged_args]:
+                print(f"Check for running PID {job.calling_pid or job.software_to_update}...")
+                for process in locator.find(pid=job.calling_pid, name=job.software_to_update):
+                    processes[process.pid] = process
+
+        with self.metrics.span("terminate", processes=len(processes)):
+            alive = locator.terminate(list(processes.values()))
+        if alive:
+            print(f"Ran into issue closing PID {', '.join(str(process.pid) for process in alive)}. Please re-run update.")
+        self.processes_stopped = not alive
+
+
+    def wait_for_running_process(self):
+        if self.process_thread:
+            with self.metrics.span("wait_for_process"):
+                self.process_thread.join()
+        return self.processes_stopped
+
+
+    def prefetch_update(self):
+        """ Download and verify into the staging area while the software keeps running, then exit. """
+        from staging import StagedUpdate
+        stage = StagedUpdate(StagedUpdate.default_directory(self.merged_args))
+        os.makedirs(stage.directory, exist_ok=True)
+        stage.clear()
+        print(f"Prefetching the update into {stage.directory}, the running software is left alone...")
+
+        options = argparse.Namespace(**{**vars(self.merged_args), "temp_download_directory": stage.directory})
+        reporter = ProgressReporter()
+        reporter.subscribe(JsonLinesSubscriber() if options.progress_json else TqdmSubscriber())
+        downloader = self.create_downloader(options, reporter)
+        with self.metrics.span("download", engine=options.download_engine, mode="prefetch"):
+            message = downloader.run()
+        print(message)
+        if not downloader.output_file or not os.path.exists(downloader.output_file):
+            sys.exit(1)
+
+        sha256 = downloader.verifier.sha256 or options.expected_sha256.strip().lower()
+        if os.path.isfile(downloader.output_file) and not downloader.verifier.sha256:
+            sha256 = DownloadCache.hash_file(downloader.output_file)
+        stage.save(downloader.output_file, sha256, options)
+        print("Update staged, it is installed on the next run.")
+        sys.exit(0)
+
+
+    def apply_staged_update(self):
+        """ Install a verified staged update, the only downtime left is stopping the software and installing. """
+        from staging import StagedUpdate
+        stage = StagedUpdate(StagedUpdate.default_directory(self.merged_args))
+        record = stage.find(self.merged_args)
+        if not record:
+            if self.merged_args.apply:
+                print("No verified staged update to apply.")
+                sys.exit(1)
+            return
+
+        print(f"Installing the staged update {record['path']}...")
+        self.start_process_check()
+        result = self.run_installer(record["path"])
+        if result == 0:
+            stage.clear()
+        sys.exit(result)
+
+
+    def download_update(self):
+        print("Updating via CLI...")
+        reporter = ProgressReporter()
+        reporter.subscribe(JsonLinesSubscriber() if self.merged_args.progress_json else TqdmSubscriber())
+        self.downloader = self.create_downloader(self.merged_args, reporter)
+        with self.metrics.span("download", engine=self.merged_args.download_engine):
+            self.downloader.run()
+        self.handle_download_finish(self.downloader.download_location, self.downloader.output_file)
 
 
     def handle_download_finish(self, download_location, filename):
         if self.window:
             self.window.close()
 
-        print("Downloaded update successfully!")
-        if download_location and filename:
+        ## An extracted archive update is a staging directory rather than a file
+        if download_location and filename and os.path.exists(os.path.join(download_location, filename)):
+            print("Downloaded update successfully!")
             update_script_path = os.path.join(download_location, filename) 
         else:
+            ## A failed or unverified download clears the filename so nothing gets launched
             print("Ran into issue running downloaded update.")
-            sys.exit(0)
+            sys.exit(1)
 
         if self.merged_args.run_after_download:
-            try:
-                subprocess.Popen([update_script_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-                #subprocess.run(update_script_path, check=True, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                sys.exit(0)
-            except subprocess.CalledProcessError as e:
-                print(f"An error occurred while running the installer: {str(e)}")
-                sys.exit(1)
+            result = self.run_installer(update_script_path)
+            self.linger_for_peers()
+            sys.exit(result)
         else:
             self.open_file_manager(download_location)
+            self.linger_for_peers()
+
+
+    def run_installer(self, update_script_path, wait=False, options=None):
+        ## Never launch the installer while the software it replaces is still exiting
+        if not self.wait_for_running_process():
+            return 1
+        ## The installer would inherit the lowered priority of background mode
+        if self.throttle:
+            self.throttle.restore_priority()
+        options = options or self.merged_args
+        if options.install_directory and os.path.isdir(update_script_path):
+            return self.install_extracted(update_script_path, options)
+        try:
+            with self.metrics.span("installer_launch", installer=os.path.basename(update_script_path)):
+                process = subprocess.Popen([update_script_path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+            #subprocess.run(update_script_path, check=True, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if wait:
+                process.communicate()
+                return process.returncode
+            return 0
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"An error occurred while running the installer: {str(e)}")
+            return 1
+
+
+    def install_extracted(self, staging_directory, options):
+        """ Swap an extracted archive update in place of the install directory, then run the post extract command. """
+        from archives import swap_directory
+        try:
+            with self.metrics.span("install_swap", directory=options.install_directory):
+                swap_directory(staging_directory, options.install_directory)
+            print(f"Installed the update to {options.install_directory}")
+        except OSError as e:
+            print(f"Unable to replace {options.install_directory}: {str(e)}")
+            return 1
+
+        if not options.post_extract_command:
+            return 0
+        try:
+            with self.metrics.span("post_extract", command=options.post_extract_command):
+                return subprocess.run(options.post_extract_command, shell=True, cwd=options.install_directory).returncode
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"An error occurred while running the post extract command: {str(e)}")
+            return 1
 
 
     def open_file_manager(self, directory_path):
@@ -255,7 +817,8 @@ class QUpdateTool():
 if __name__ == "__main__":
     try:
         updater = QUpdateTool()
-        sys.exit(QUpdateTool.app.exec())
+        if QUpdateTool.app:
+            sys.exit(QUpdateTool.app.exec())
 
     except Exception as e:
         print(f"An error occurred (__name__): {str(e)}")
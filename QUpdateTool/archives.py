@@ -0,0 +1,201 @@
+import os
+import queue
+import shutil
+import tarfile
+import zipfile
+import threading
+
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_format(filename):
+    """ "tar" or "zip" for an archive payload, None for an installer. """
+    name = filename.lower()
+    if name.endswith(TAR_SUFFIXES):
+        return "tar"
+    if name.endswith(".zip"):
+        return "zip"
+    return None
+
+
+def staging_directory(install_directory):
+    ## Next to the install directory, so swapping it in is a rename on the same filesystem
+    return f"{os.path.normpath(install_directory)}.staging"
+
+
+def clear_directory(directory):
+    if os.path.isdir(directory):
+        shutil.rmtree(directory)
+
+
+def extract_members(tar, directory):
+    """ Extract the members of an open tar one by one, which also works on a non-seekable stream. """
+    for member in tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extract(member, directory, filter="data")
+            continue
+        ## Older Pythons have no extraction filters, refuse anything that could land outside the directory
+        target = os.path.realpath(os.path.join(directory, member.name))
+        if not target.startswith(os.path.realpath(directory) + os.sep) or not (member.isfile() or member.isdir()):
+            raise ArchiveError(f"Refusing to extract {member.name}")
+        tar.extract(member, directory)
+
+
+def extract_archive(path, directory):
+    """ Extract a downloaded zip or tar file into directory, replacing whatever is there. """
+    clear_directory(directory)
+    try:
+        if archive_format(path) == "zip":
+            with zipfile.ZipFile(path) as archive:
+                archive.extractall(directory)
+        else:
+            with tarfile.open(path, "r:*") as tar:
+                extract_members(tar, directory)
+    except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+        clear_directory(directory)
+        raise ArchiveError(f"Unable to extract {os.path.basename(path)}: {str(e)}")
+    return directory
+
+
+def swap_directory(staging, install_directory):
+    """
+    Put staging in place of install_directory with two renames, the previous version is only deleted
+    once the new one is in place and is renamed back if that fails.
+    """
+    previous = f"{os.path.normpath(install_directory)}.previous"
+    clear_directory(previous)
+    if os.path.exists(install_directory):
+        os.rename(install_directory, previous)
+    try:
+        os.rename(staging, install_directory)
+    except OSError:
+        if os.path.exists(previous):
+            os.rename(previous, install_directory)
+        raise
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+class StreamingExtractor():
+    """
+    Pipeline stage that extracts a tar (optionally gzip, bz2 or xz compressed) while it downloads.
+    The download writes chunks in order with write(), a thread reads them through a bounded queue
+    and extracts every member as soon as it is complete, so the archive itself never touches the disk.
+    Used as the output file of a download: leaving the with block normally waits for the extraction,
+    leaving it with an exception throws the partly extracted directory away.
+    With an archive sink (an OutputSink) the downloaded bytes are also written there, e.g. to be cached.
+    """
+
+    def __init__(self,
+                 directory: str = "",
+                 max_queued: int = 16,
+                 archive=None):
+        self.directory = directory
+        self.archive = archive
+        self.queue = queue.Queue(max_queued)
+        self.buffer = bytearray()
+        self.input_done = False
+        self.aborted = False
+        self.finished = False
+        self.error = None
+        self.thread = None
+
+
+    def start(self):
+        clear_directory(self.directory)
+        os.makedirs(self.directory)
+        self.thread = threading.Thread(target=self.extract, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def extract(self):
+        try:
+            with tarfile.open(fileobj=self, mode="r|*") as tar:
+                extract_members(tar, self.directory)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.finished = True
+
+
+    def read(self, size=-1):
+        """ File interface for tarfile, blocks until the download has written enough. """
+        while not self.input_done and (size < 0 or len(self.buffer) < size):
+            if self.aborted:
+                raise ArchiveError("Extraction aborted")
+            try:
+                data = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if data is None:
+                self.input_done = True
+            else:
+                self.buffer += data
+        size = len(self.buffer) if size < 0 else min(size, len(self.buffer))
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+    def write(self, chunk):
+        ## Copied, the download reuses its buffer for the next read
+        data = bytes(chunk)
+        if self.archive:
+            self.archive.write(data)
+        while True:
+            if self.error:
+                raise ArchiveError(f"Unable to extract the update: {str(self.error)}")
+            if self.finished:
+                ## The end of archive marker has been read, what follows is padding
+                return len(data)
+            try:
+                self.queue.put(data, timeout=0.5)
+                return len(data)
+            except queue.Full:
+                continue
+
+
+    def close(self):
+        """ Wait for the last members to be extracted. """
+        self.write_end()
+        self.thread.join()
+        if self.archive:
+            self.archive.close()
+        if self.error:
+            clear_directory(self.directory)
+            raise ArchiveError(f"Unable to extract the update: {str(self.error)}")
+
+
+    def write_end(self):
+        while not self.finished:
+            try:
+                self.queue.put(None, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+
+    def discard(self):
+        self.aborted = True
+        if self.thread:
+            self.thread.join()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        if self.archive:
+            self.archive.close()
+            if os.path.exists(self.archive.path):
+                os.remove(self.archive.path)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, error_type, error, traceback):
+        if error_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,118 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class ManifestError(Exception):
+    pass
+
+
+class BatchUpdater():
+    """
+    Updates several products in one process. Every download runs on a bounded worker pool,
+    the installers then run one after another so a product always installs after its depends_on.
+    """
+
+    def __init__(self,
+                 jobs: list = None,
+                 max_workers: int = 4,
+                 download=None,
+                 download_async=None,
+                 run_installer=None,
+                 up_to_date: set = None):
+        self.jobs = jobs or []
+        ## Products the version check found current, depending on them is already satisfied
+        self.up_to_date = set(up_to_date or [])
+        self.max_workers = max(1, int(max_workers or 1))
+        self.download = download
+        self.download_async = download_async
+        self.run_installer = run_installer
+        self.results = {}
+
+
+    def install_order(self):
+        """ Topological order of the jobs by depends_on, raises on unknown names or cycles. """
+        jobs = {job.name: job for job in self.jobs}
+        dependencies = {name: self.get_dependencies(job) for name, job in jobs.items()}
+        for name, depends_on in dependencies.items():
+            unknown = [dependency for dependency in depends_on if dependency not in jobs]
+            if unknown:
+                raise ManifestError(f"{name} depends on unknown product(s): {', '.join(unknown)}")
+
+        order = []
+        ready = [name for name in jobs if not dependencies[name]]
+        remaining = {name: set(depends_on) for name, depends_on in dependencies.items() if depends_on}
+        while ready:
+            name = ready.pop(0)
+            order.append(jobs[name])
+            for other, depends_on in list(remaining.items()):
+                depends_on.discard(name)
+                if not depends_on:
+                    del remaining[other]
+                    ready.append(other)
+
+        if remaining:
+            raise ManifestError(f"Circular dependency between: {', '.join(sorted(remaining))}")
+        return order
+
+
+    def get_dependencies(self, job):
+        depends_on = getattr(job, "depends_on", None) or []
+        if isinstance(depends_on, str):
+            depends_on = depends_on.split(",")
+        return [dependency.strip() for dependency in depends_on
+                if dependency.strip() and dependency.strip() not in self.up_to_date]
+
+
+    def run(self):
+        order = self.install_order()
+        print(f"Downloading {len(self.jobs)} update(s) with {self.max_workers} worker(s)...")
+
+        if self.download_async:
+            asyncio.run(self.download_all_async())
+        else:
+            self.download_all()
+
+        failed = set()
+        for job in order:
+            path, message = self.results[job.name]
+            print(f"{job.name}: {message}")
+            blocked = [dependency for dependency in self.get_dependencies(job) if dependency in failed]
+            if not path or not os.path.exists(path):
+                failed.add(job.name)
+            elif blocked:
+                print(f"Skipping {job.name}, its dependencies failed: {', '.join(blocked)}")
+                failed.add(job.name)
+            elif job.run_after_download:
+                print(f"Installing {job.name}...")
+                if self.run_installer(path, wait=True, options=job) != 0:
+                    failed.add(job.name)
+            else:
+                print(f"{job.name} downloaded to {path}")
+
+        return not failed
+
+
+    def download_all(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.download, job, index): job for index, job in enumerate(self.jobs)}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    self.results[job.name] = future.result()
+                except Exception as e:
+                    self.results[job.name] = ("", f"Error downloading file: {str(e)}")
+
+
+    async def download_all_async(self):
+        """ Same bound on concurrent products, but every transfer shares one event loop thread. """
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def download(job, index):
+            async with semaphore:
+                try:
+                    self.results[job.name] = await self.download_async(job, index)
+                except Exception as e:
+                    self.results[job.name] = ("", f"Error downloading file: {str(e)}")
+
+        await asyncio.gather(*[download(job, index) for index, job in enumerate(self.jobs)])
@@ -0,0 +1,84 @@
+"""
+Chunk store fixtures: two products embedding the same runtime, plus a new release of the first.
+
+Generates the installers and their chunk indexes, serves them with the local range server and
+downloads them one after another into a fresh chunk store, reporting the bytes actually transferred:
+
+    python benchmarks/chunk_fixtures.py --output fixtures/chunks --runtime-size 8M
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from chunkstore import ChunkStore, make_index
+from engines import create_engine
+from utils import parse_size
+from range_server import RangeServer
+
+
+def write_fixtures(output, runtime_size, product_size, seed):
+    rng = random.Random(seed)
+    runtime = rng.randbytes(runtime_size)
+    product_a = rng.randbytes(product_size)
+    product_b = rng.randbytes(product_size)
+    ## The new release changes a few KB of its own code and keeps the runtime
+    product_a2 = bytearray(product_a)
+    product_a2[product_size // 2:product_size // 2 + 4096] = rng.randbytes(4096)
+
+    installers = {"ProductA_1.0.exe": product_a + runtime,
+                  "ProductB_1.0.exe": runtime + product_b,
+                  "ProductA_1.1.exe": bytes(product_a2) + runtime}
+    for filename, data in installers.items():
+        path = os.path.join(output, filename)
+        with open(path, "wb") as file:
+            file.write(data)
+        with open(f"{path}.chunks.json", "w") as file:
+            json.dump(make_index(path), file)
+    return list(installers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the bytes saved by the chunk store")
+    parser.add_argument("--output", type=str, default="", help="Directory for the fixtures, a new temporary directory by default")
+    parser.add_argument("--runtime-size", type=str, default="8M", help="Size of the shared runtime payload")
+    parser.add_argument("--product-size", type=str, default="2M", help="Size of each product's own payload")
+    parser.add_argument("--engine", type=str, default="asyncio", choices=["requests", "asyncio"], help="Download backend")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    ## Never into the working tree unless asked to, the fixtures are tens of MB
+    args.output = args.output or tempfile.mkdtemp(prefix="qupdatetool_chunk_fixtures_")
+    print(f"Writing fixtures to {args.output}")
+    os.makedirs(args.output, exist_ok=True)
+    installers = write_fixtures(args.output, parse_size(args.runtime_size), parse_size(args.product_size), args.seed)
+    server = RangeServer(args.output).start()
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        store = ChunkStore(directory=os.path.join(work_directory, "chunks"))
+        print(f"{'installer':<20} {'size':>12} {'transferred':>12} {'saved':>7}")
+        for filename in installers:
+            before = server.bytes_sent
+            engine = create_engine(args.engine,
+                                   api_endpoint=f"{server.url}/{filename}",
+                                   download_location=work_directory,
+                                   chunk_store=store,
+                                   chunk_index_url=f"{server.url}/{filename}.chunks.json")
+            message = engine.run()
+            if not engine.output_file or not os.path.isfile(engine.output_file):
+                print(f"{filename}: {message}")
+                sys.exit(1)
+
+            size = os.path.getsize(engine.output_file)
+            transferred = server.bytes_sent - before
+            print(f"{filename:<20} {size:>12} {transferred:>12} {(1 - transferred / size) * 100:>6.1f}%")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Synthetic base/new installer pairs for the delta update path.
+
+Builds a release, a minor release of it, the patch between them and the patch manifest the
+updater reads, then checks the patch rebuilds the new release and reports the bytes saved:
+
+    python benchmarks/delta_fixtures.py --output fixtures/delta --size 16M
+
+Serve the output directory (python -m http.server) and point --delta_manifest_url at
+http://localhost:8000/manifest.json with --delta_base_path at base.exe to try it end to end.
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from delta import make_patch, apply_patch
+from cache import DownloadCache
+from utils import parse_size
+
+
+def make_release(size, seed):
+    """ Installer-like content: compressed looking noise with repeated resource blocks. """
+    rng = random.Random(seed)
+    resources = [rng.randbytes(64 * 1024) for _ in range(8)]
+    blocks = []
+    while sum(len(block) for block in blocks) < size:
+        blocks.append(rng.choice(resources) if rng.random() < 0.3 else rng.randbytes(64 * 1024))
+    return b"".join(blocks)[:size]
+
+
+def make_minor_release(base, changes, seed):
+    """ Patch a few regions, insert and remove some bytes, the way a rebuilt installer differs. """
+    rng = random.Random(seed)
+    new = bytearray(base)
+    for _ in range(changes):
+        offset = rng.randrange(len(new))
+        action = rng.choice(("replace", "insert", "delete"))
+        length = rng.randint(16, 4096)
+        if action == "replace":
+            new[offset:offset + length] = rng.randbytes(length)
+        elif action == "insert":
+            new[offset:offset] = rng.randbytes(length)
+        else:
+            del new[offset:offset + length]
+    return bytes(new)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate delta update fixtures and report the savings")
+    parser.add_argument("--output", type=str, default="", help="Directory for the fixtures, a new temporary directory by default")
+    parser.add_argument("--size", type=str, default="16M", help="Size of the base release, e.g. 16M")
+    parser.add_argument("--changes", type=int, default=20, help="Number of edited regions in the new release")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    ## Never into the working tree unless asked to, the fixtures are tens of MB
+    args.output = args.output or tempfile.mkdtemp(prefix="qupdatetool_delta_fixtures_")
+    print(f"Writing fixtures to {args.output}")
+    os.makedirs(args.output, exist_ok=True)
+    base_path = os.path.join(args.output, "base.exe")
+    new_path = os.path.join(args.output, "new.exe")
+    patch_path = os.path.join(args.output, "new.exe.patch")
+    rebuilt_path = os.path.join(args.output, "rebuilt.exe")
+
+    base = make_release(parse_size(args.size), args.seed)
+    with open(base_path, "wb") as file:
+        file.write(base)
+    with open(new_path, "wb") as file:
+        file.write(make_minor_release(base, args.changes, args.seed + 1))
+
+    patch_size = make_patch(base_path, new_path, patch_path)
+    with open(patch_path, "rb") as patch, open(rebuilt_path, "wb") as output:
+        apply_patch(base_path, patch, output)
+
+    base_sha256 = DownloadCache.hash_file(base_path)
+    result_sha256 = DownloadCache.hash_file(new_path)
+    if DownloadCache.hash_file(rebuilt_path) != result_sha256:
+        print("Rebuilt file does not match the new release!")
+        sys.exit(1)
+    os.remove(rebuilt_path)
+
+    manifest = {"from": "1.0", "to": "1.1",
+                "patch_url": "new.exe.patch",
+                "base_sha256": base_sha256,
+                "result_sha256": result_sha256,
+                "result_size": os.path.getsize(new_path),
+                "filename": "new.exe"}
+    with open(os.path.join(args.output, "manifest.json"), "w") as file:
+        json.dump(manifest, file, indent=4)
+
+    new_size = os.path.getsize(new_path)
+    print(f"new release  {new_size:>12} bytes")
+    print(f"patch        {patch_size:>12} bytes")
+    print(f"saved        {new_size - patch_size:>12} bytes ({(1 - patch_size / new_size) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
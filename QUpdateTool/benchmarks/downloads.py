@@ -0,0 +1,161 @@
+"""
+Download throughput of QUpdateTool against the local range server.
+
+Every sample downloads a generated file in a fresh interpreter, headless (the engine on the main
+thread, like --noGUI) or through DownloadThread under an offscreen QApplication (like the GUI),
+and reports MB/s, CPU time, peak RSS, time to first byte and the number of progress updates:
+
+    python benchmarks/downloads.py --sizes 1M,100M,2G --modes headless,gui --engine requests --runs 3
+    python benchmarks/downloads.py --sizes 256M --latency 40 --bandwidth 50M --error-rate 0.05 --json results.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+__location__ = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, __location__)
+
+from utils import parse_size
+from range_server import RangeServer, GENERATED_PREFIX, add_server_arguments, server_options
+
+
+def peak_rss():
+    """ Peak resident set size of this process in bytes, None where it can't be read. """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+def run_sample(spec):
+    """ One download in this process, returns its measurements. Runs in the child interpreter. """
+    from progress import ProgressReporter
+
+    class MeasuringReporter(ProgressReporter):
+        first_byte = None
+
+        def publish(self, size):
+            if self.first_byte is None:
+                self.first_byte = time.perf_counter()
+            super(MeasuringReporter, self).publish(size)
+
+    updates = []
+    options = {"engine": spec["engine"], "segments": spec["segments"], "expected_size": spec["size"]}
+
+    with tempfile.TemporaryDirectory() as download_location:
+        reporter = MeasuringReporter()
+        cpu_started = os.times()
+        started = time.perf_counter()
+
+        if spec["mode"] == "gui":
+            from PySide6.QtCore import Qt
+            from PySide6.QtWidgets import QApplication
+            from threads import DownloadThread
+            app = QApplication([])
+            thread = DownloadThread(api_endpoint=spec["url"], download_location=download_location,
+                                    gui=True, reporter=reporter, **options)
+            thread.update_progress.connect(updates.append, Qt.QueuedConnection)
+            thread.finished.connect(lambda message: app.quit())
+            thread.start()
+            app.exec()
+            thread.wait()
+            output_file, message = thread.output_file, thread.message
+        else:
+            from engines import create_engine
+            reporter.subscribe(updates.append)
+            engine = create_engine(api_endpoint=spec["url"], download_location=download_location,
+                                   reporter=reporter, **options)
+            message = engine.run()
+            output_file = engine.output_file
+
+        elapsed = time.perf_counter() - started
+        cpu = os.times()
+        ok = bool(output_file) and os.path.isfile(output_file) and os.path.getsize(output_file) == spec["size"]
+
+    return {"ok": ok,
+            "message": message,
+            "seconds": elapsed,
+            "mb_per_s": spec["size"] / 1024 / 1024 / elapsed if ok else 0,
+            "cpu_seconds": (cpu.user - cpu_started.user) + (cpu.system - cpu_started.system),
+            "peak_rss": peak_rss(),
+            "ttfb_ms": (reporter.first_byte - started) * 1000 if reporter.first_byte else None,
+            "progress_updates": len(updates)}
+
+
+def measure(spec):
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    result = subprocess.run([sys.executable, os.path.realpath(__file__), "--sample", json.dumps(spec)],
+                            cwd=__location__, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    lines = result.stdout.decode(errors="replace").strip().splitlines()
+    if result.returncode != 0 or not lines:
+        raise RuntimeError((result.stderr.decode(errors="replace").strip().splitlines() or ["no output"])[-1])
+    return json.loads(lines[-1])
+
+
+def summarize(samples, key):
+    values = [sample[key] for sample in samples if sample[key] is not None]
+    return statistics.median(values) if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark downloads against a local HTTP server")
+    parser.add_argument("--sizes", type=str, default="1M,100M", help="Comma separated file sizes, 1M up to 2G")
+    parser.add_argument("--modes", type=str, default="headless,gui", help="headless and/or gui (offscreen)")
+    parser.add_argument("--engine", type=str, default="requests", choices=["requests", "asyncio"], help="Download backend")
+    parser.add_argument("--segments", type=int, default=4, help="Parallel range requests")
+    parser.add_argument("--runs", type=int, default=3, help="Samples per size and mode")
+    parser.add_argument("--json", type=str, help="Also write every sample to this file")
+    parser.add_argument("--sample", type=str, help=argparse.SUPPRESS)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if args.sample:
+        print(json.dumps(run_sample(json.loads(args.sample))))
+        return
+
+    server = RangeServer(**server_options(args)).start()
+    results = []
+    print(f"{'size':>6} {'mode':<9} {'MB/s':>8} {'cpu s':>7} {'rss MB':>7} {'ttfb ms':>8} {'updates':>8}")
+    for size in args.sizes.split(","):
+        for mode in args.modes.split(","):
+            spec = {"url": f"{server.url}{GENERATED_PREFIX}{size}", "size": parse_size(size), "mode": mode,
+                    "engine": args.engine, "segments": args.segments}
+            try:
+                samples = [measure(spec) for _ in range(args.runs)]
+            except RuntimeError as e:
+                print(f"{size:>6} {mode:<9} unavailable: {str(e)}")
+                continue
+
+            results += [{**spec, **sample} for sample in samples]
+            failed = [sample for sample in samples if not sample["ok"]]
+            if failed:
+                print(f"{size:>6} {mode:<9} {len(failed)} of {len(samples)} run(s) failed: {failed[0]['message']}")
+                samples = [sample for sample in samples if sample["ok"]] or samples
+            rss = summarize(samples, "peak_rss")
+            ttfb = summarize(samples, "ttfb_ms")
+            print(f"{size:>6} {mode:<9} {summarize(samples, 'mb_per_s'):>8.1f} {summarize(samples, 'cpu_seconds'):>7.2f} "
+                  f"{rss / 1024 / 1024 if rss else 0:>7.1f} {ttfb or 0:>8.1f} {summarize(samples, 'progress_updates'):>8.0f}")
+
+    if server.errors_sent:
+        print(f"Injected {server.errors_sent} error response(s)")
+    server.shutdown()
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Local stand-in for the download server: serves a directory over HTTP with Range, ETag and
+Last-Modified support, and counts the body bytes it sends so fixtures can report what was saved.
+
+Files of any size can also be generated on the fly without touching the disk, /generated/<size>
+(e.g. /generated/512M) returns a deterministic byte pattern, so 2 GB downloads need no 2 GB fixture.
+Latency, a bandwidth cap and injected 5xx/429 responses simulate a slow or flaky origin:
+
+    python benchmarks/range_server.py --directory fixtures --port 8000 --latency 50 --bandwidth 10M --error-rate 0.05
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from utils import parse_size
+
+PATTERN = random.Random(0).randbytes(1024 * 1024)
+GENERATED_PREFIX = "/generated/"
+STARTED = time.time()
+
+
+def generated_bytes(start, length):
+    """ Bytes start..start+length of the generated file, the same for every size and request. """
+    offset = start % len(PATTERN)
+    while length > 0:
+        data = memoryview(PATTERN)[offset:offset + length]
+        yield data
+        length -= len(data)
+        offset = 0
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(RangeRequestHandler, self).log_message(format, *args)
+
+
+    def do_HEAD(self):
+        self.send_file(body=False)
+
+
+    def do_GET(self):
+        self.send_file(body=True)
+
+
+    def parse_range(self, size):
+        """ (start, end) of a single bytes= range, None for the whole file, False if unsatisfiable. """
+        header = self.headers.get("Range", "")
+        if not header.startswith("bytes=") or "," in header:
+            return None
+        start, _, end = header[6:].strip().partition("-")
+        if not start:
+            start, end = max(0, size - int(end)), size - 1
+        else:
+            start, end = int(start), min(int(end) if end else size - 1, size - 1)
+        return (start, end) if start <= end else False
+
+
+    def open_source(self):
+        """ (size, mtime, reader) of the requested file, reader(start, length) yields its bytes. None if missing. """
+        path = self.path.split("?", 1)[0]
+        if path.startswith(GENERATED_PREFIX):
+            try:
+                return parse_size(path[len(GENERATED_PREFIX):]), STARTED, generated_bytes
+            except ValueError:
+                return None
+
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            return None
+
+        def read_file(start, length):
+            with open(path, "rb") as file:
+                file.seek(start)
+                while length > 0:
+                    data = file.read(min(length, 1024 * 64))
+                    if not data:
+                        break
+                    yield data
+                    length -= len(data)
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime, read_file
+
+
+    def send_file(self, body=True):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.should_fail():
+            status = random.choice(self.server.error_statuses)
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        source = self.open_source()
+        if source is None:
+            self.send_error(404)
+            return
+
+        size, mtime, reader = source
+        etag = f'"{size:x}-{int(mtime):x}"'
+        byte_range = self.parse_range(size) if self.server.ranges else None
+        if_range = self.headers.get("If-Range")
+        if byte_range and if_range and if_range != etag:
+            byte_range = None
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        start, end = byte_range or (0, size - 1)
+        self.send_response(206 if byte_range else 200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        if self.server.ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(mtime, usegmt=True))
+        if byte_range:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if body:
+            try:
+                for data in reader(start, end - start + 1):
+                    self.server.throttle(len(data))
+                    self.wfile.write(data)
+                    self.server.count(len(data))
+            except (BrokenPipeError, ConnectionResetError):
+                ## The client gave up on this connection, e.g. to switch mirrors
+                self.close_connection = True
+
+
+class RangeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self,
+                 directory: str = ".",
+                 port: int = 0,
+                 handler=RangeRequestHandler,
+                 verbose: bool = False,
+                 latency: float = 0,
+                 bandwidth: int = 0,
+                 ranges: bool = True,
+                 error_rate: float = 0,
+                 error_statuses: list = None):
+        self.directory = directory
+        self.verbose = verbose
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.ranges = ranges
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses or [503]
+        self.bytes_sent = 0
+        self.errors_sent = 0
+        self.next_send = time.perf_counter()
+        self.lock = threading.Lock()
+        super(RangeServer, self).__init__(("127.0.0.1", port),
+                                          lambda *args: handler(*args, directory=directory))
+
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+    def count(self, size):
+        with self.lock:
+            self.bytes_sent += size
+
+
+    def should_fail(self):
+        if not self.error_rate or random.random() >= self.error_rate:
+            return False
+        with self.lock:
+            self.errors_sent += 1
+        return True
+
+
+    def throttle(self, size):
+        """ Bandwidth cap shared by every connection, in bytes per second. """
+        if not self.bandwidth:
+            return
+        with self.lock:
+            now = time.perf_counter()
+            self.next_send = max(self.next_send, now) + size / self.bandwidth
+            delay = self.next_send - now - size / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+
+    def start(self):
+        """ Serve on a daemon thread, returns self so it can be used as server = RangeServer(...).start(). """
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def add_server_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0, help="Delay before every response, in milliseconds")
+    parser.add_argument("--bandwidth", type=str, default="0", help="Bandwidth cap in bytes per second, e.g. 10M, 0 for none")
+    parser.add_argument("--no-ranges", action="store_true", help="Ignore Range headers and never advertise Accept-Ranges")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with an error status")
+    parser.add_argument("--error-statuses", type=str, default="503,429", help="Comma separated statuses to inject")
+
+
+def server_options(args):
+    return {"latency": args.latency / 1000,
+            "bandwidth": parse_size(args.bandwidth),
+            "ranges": not args.no_ranges,
+            "error_rate": args.error_rate,
+            "error_statuses": [int(status) for status in args.error_statuses.split(",") if status.strip()]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a directory with Range support")
+    parser.add_argument("--directory", type=str, default=".", help="Directory to serve")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = RangeServer(args.directory, args.port, verbose=True, **server_options(args))
+    print(f"Serving {os.path.realpath(args.directory)} and {GENERATED_PREFIX}<size> on {server.url}")
+    server.serve_forever()
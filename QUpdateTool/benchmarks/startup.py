@@ -0,0 +1,55 @@
+"""
+Startup cost of the GUI and headless paths of QUpdateTool.
+
+Every sample runs in a fresh interpreter, the same way a real update is launched:
+
+    python benchmarks/startup.py --runs 10
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+__location__ = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+
+SCENARIOS = {
+    "interpreter": "pass",
+    "headless": "import QUpdateTool, downloader, processes",
+    "gui": ("import QUpdateTool, downloader, processes, gui\n"
+            "from PySide6.QtWidgets import QApplication\n"
+            "app = QApplication([])"),
+}
+
+
+def measure(code, runs):
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", code], cwd=__location__, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.decode(errors="replace").strip().splitlines()[-1])
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare GUI and headless startup time")
+    parser.add_argument("--runs", type=int, default=10, help="Samples per scenario")
+    args = parser.parse_args()
+
+    print(f"{'scenario':<12} {'min ms':>9} {'median ms':>10} {'max ms':>9}")
+    for name, code in SCENARIOS.items():
+        try:
+            samples = measure(code, args.runs)
+        except RuntimeError as e:
+            print(f"{name:<12} unavailable: {str(e)}")
+            continue
+        print(f"{name:<12} {min(samples):>9.1f} {statistics.median(samples):>10.1f} {max(samples):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
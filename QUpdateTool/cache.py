@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+
+class DownloadCache():
+    """
+    Persistent, content addressed store of downloaded files.
+    Blobs are stored by SHA-256, the index maps each URL to the blob and the validators it was served with.
+    The total blob size is bounded, least recently used blobs are evicted first.
+    """
+
+    def __init__(self,
+                 directory: str = "",
+                 max_size: int = 1024 * 1024 * 1024 * 2):
+        self.directory = directory
+        self.blob_directory = os.path.join(directory, "blobs")
+        self.index_path = os.path.join(directory, "index.json")
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.index = {"urls": {}, "blobs": {}}
+
+        os.makedirs(self.blob_directory, exist_ok=True)
+        self.load()
+
+
+    @staticmethod
+    def default_directory():
+        base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+        return os.path.join(base, "QUpdateTool", "cache")
+
+
+    def load(self):
+        try:
+            with open(self.index_path, "r") as file:
+                index = json.load(file)
+            self.index = {"urls": index.get("urls", {}), "blobs": index.get("blobs", {})}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable cache index {self.index_path}: {str(e)}")
+
+
+    def save(self):
+        temp_path = f"{self.index_path}.tmp"
+        try:
+            with open(temp_path, "w") as file:
+                json.dump(self.index, file)
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            print(f"Unable to save cache index {self.index_path}: {str(e)}")
+
+
+    def blob_path(self, sha256):
+        return os.path.join(self.blob_directory, sha256)
+
+
+    def lookup(self, url):
+        """ Index entry for url if its blob is still on disk. """
+        with self.lock:
+            entry = self.index["urls"].get(url)
+            if entry and os.path.isfile(self.blob_path(entry["sha256"])):
+                return dict(entry)
+            return None
+
+
+    def find_by_hash(self, sha256):
+        with self.lock:
+            if sha256 and sha256.lower() in self.index["blobs"] and os.path.isfile(self.blob_path(sha256.lower())):
+                return self.blob_path(sha256.lower())
+            return None
+
+
+    def conditional_headers(self, entry):
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+
+    def add(self, url, file_path, etag="", last_modified="", sha256=None):
+        """ Store a finished download, hashing it first unless the digest is already known. """
+        if sha256 is None:
+            sha256 = self.hash_file(file_path)
+        sha256 = sha256.lower()
+        size = os.path.getsize(file_path)
+
+        with self.lock:
+            if not os.path.isfile(self.blob_path(sha256)):
+                self.link_or_copy(file_path, self.blob_path(sha256))
+            self.index["blobs"][sha256] = {"size": size, "last_access": time.time()}
+            self.index["urls"][url] = {"sha256": sha256,
+                                       "etag": etag,
+                                       "last_modified": last_modified,
+                                       "size": size,
+                                       "filename": os.path.basename(file_path)}
+            self.evict(keep=sha256)
+            self.save()
+        return sha256
+
+
+    def materialize(self, sha256, destination):
+        """ Put a cached blob at destination, hardlinked when the filesystem allows it. """
+        sha256 = sha256.lower()
+        with self.lock:
+            if os.path.exists(destination):
+                os.remove(destination)
+            self.link_or_copy(self.blob_path(sha256), destination)
+            if sha256 in self.index["blobs"]:
+                self.index["blobs"][sha256]["last_access"] = time.time()
+                self.save()
+        return destination
+
+
+    def evict(self, keep=None):
+        blobs = self.index["blobs"]
+        total = sum(blob["size"] for blob in blobs.values())
+        for sha256 in sorted(blobs, key=lambda key: blobs[key]["last_access"]):
+            if total <= self.max_size:
+                break
+            if sha256 == keep:
+                continue
+            total -= blobs[sha256]["size"]
+            self.remove_blob(sha256)
+
+
+    def discard(self, sha256):
+        """ Drop a blob that no longer matches its hash, together with every URL served from it. """
+        with self.lock:
+            self.remove_blob(sha256.lower())
+            self.save()
+
+
+    def remove_blob(self, sha256):
+        self.index["blobs"].pop(sha256, None)
+        if os.path.exists(self.blob_path(sha256)):
+            os.remove(self.blob_path(sha256))
+        self.index["urls"] = {url: entry for url, entry in self.index["urls"].items() if entry["sha256"] != sha256}
+
+
+    @staticmethod
+    def link_or_copy(source, destination):
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copy2(source, destination)
+
+
+    @staticmethod
+    def hash_file(file_path):
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
@@ -0,0 +1,186 @@
+"""
+Content defined chunking and a local store of chunks shared by every product.
+
+The server publishes a chunk index next to each artifact:
+    {"filename": ..., "size": ..., "sha256": ..., "url": <optional, defaults to the download url>,
+     "chunks": [{"offset": ..., "size": ..., "sha256": ...}, ...]}
+Chunk boundaries depend on the content, not on offsets, so a runtime embedded in two installers
+produces the same chunks in both and is only downloaded once.
+
+Generate an index on the build machine with:
+    python chunkstore.py index <file> <index file>
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+
+from verify import VerificationError
+from sink import OutputSink
+
+## Gear table of the rolling hash, derived from SHA-256 so every build produces the same boundaries
+GEAR = [int.from_bytes(hashlib.sha256(bytes([value])).digest()[:8], "big") for value in range(256)]
+HASH_MASK = (1 << 64) - 1
+
+
+def chunk_boundaries(data, min_size=1024 * 16, average_size=1024 * 64, max_size=1024 * 256):
+    """ (offset, size) of every chunk of data, cut where the top bits of a gear hash are zero. """
+    cut_mask = ((average_size - 1) << (64 - (average_size - 1).bit_length())) & HASH_MASK
+    start = 0
+    while start < len(data):
+        end = min(start + max_size, len(data))
+        cut = end
+        rolling = 0
+        for position in range(start + min_size, end):
+            rolling = ((rolling << 1) + GEAR[data[position]]) & HASH_MASK
+            if not rolling & cut_mask:
+                cut = position + 1
+                break
+        yield start, cut - start
+        start = cut
+
+
+def make_index(file_path, url=None):
+    """ Chunk index of a file, meant for build machines, not the client. """
+    with open(file_path, "rb") as file:
+        data = file.read()
+
+    index = {"filename": os.path.basename(file_path),
+             "size": len(data),
+             "sha256": hashlib.sha256(data).hexdigest(),
+             "chunks": [{"offset": offset,
+                         "size": size,
+                         "sha256": hashlib.sha256(data[offset:offset + size]).hexdigest()}
+                        for offset, size in chunk_boundaries(data)]}
+    if url:
+        index["url"] = url
+    return index
+
+
+class ChunkStore():
+    """
+    Chunks stored by SHA-256, shared between products and versions.
+    The total size is bounded, least recently used chunks are evicted first.
+    """
+
+    def __init__(self,
+                 directory: str = "",
+                 max_size: int = 1024 * 1024 * 1024 * 2):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.chunks = {}
+
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+
+    def load(self):
+        try:
+            with open(self.index_path, "r") as file:
+                self.chunks = json.load(file).get("chunks", {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable chunk store index {self.index_path}: {str(e)}")
+
+
+    def save(self):
+        temp_path = f"{self.index_path}.tmp"
+        try:
+            with open(temp_path, "w") as file:
+                json.dump({"chunks": self.chunks}, file)
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            print(f"Unable to save chunk store index {self.index_path}: {str(e)}")
+
+
+    def chunk_path(self, sha256):
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+
+    def has(self, sha256):
+        with self.lock:
+            return sha256 in self.chunks and os.path.isfile(self.chunk_path(sha256))
+
+
+    def missing(self, chunks):
+        return [chunk for chunk in chunks if not self.has(chunk["sha256"])]
+
+
+    def add(self, sha256, data):
+        """ Store one downloaded chunk, it must hash to the name it is stored under. """
+        if hashlib.sha256(data).hexdigest() != sha256:
+            raise VerificationError(f"chunk {sha256[:12]} does not match its hash")
+
+        path = self.chunk_path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.chunks[sha256] = {"size": len(data), "last_access": time.time()}
+
+
+    def read(self, sha256):
+        with open(self.chunk_path(sha256), "rb") as file:
+            return file.read()
+
+
+    def assemble(self, chunks, part_file, size, on_chunk=None):
+        """ Write every chunk at its offset of a preallocated part_file through OutputSink, on_chunk sees them in file order. """
+        with OutputSink(part_file, size) as output:
+            for chunk in sorted(chunks, key=lambda chunk: chunk["offset"]):
+                data = self.read(chunk["sha256"])
+                if len(data) != chunk["size"]:
+                    raise VerificationError(f"chunk {chunk['sha256'][:12]} has {len(data)} bytes, expected {chunk['size']}")
+                output.write_at(chunk["offset"], data)
+                if on_chunk:
+                    on_chunk(data)
+
+
+    def touch(self, chunks):
+        """ Mark the chunks of an artifact as used and evict others until the store fits again. """
+        now = time.time()
+        keep = set()
+        with self.lock:
+            for chunk in chunks:
+                if chunk["sha256"] in self.chunks:
+                    self.chunks[chunk["sha256"]]["last_access"] = now
+                    keep.add(chunk["sha256"])
+            self.evict(keep)
+            self.save()
+
+
+    def flush(self):
+        """ Index the chunks stored so far, e.g. after a failed download, so the next run reuses them and evict() bounds them. """
+        with self.lock:
+            self.evict()
+            self.save()
+
+
+    def evict(self, keep=()):
+        total = sum(chunk["size"] for chunk in self.chunks.values())
+        for sha256 in sorted(self.chunks, key=lambda key: self.chunks[key]["last_access"]):
+            if total <= self.max_size:
+                break
+            if sha256 in keep:
+                continue
+            total -= self.chunks.pop(sha256)["size"]
+            if os.path.exists(self.chunk_path(sha256)):
+                os.remove(self.chunk_path(sha256))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 5) or sys.argv[1] != "index":
+        print("Usage: python chunkstore.py index <file> <index file> [download url]")
+        sys.exit(1)
+
+    index = make_index(sys.argv[2], sys.argv[4] if len(sys.argv) == 5 else None)
+    with open(sys.argv[3], "w") as file:
+        json.dump(index, file)
+    print(f"Wrote {sys.argv[3]} ({len(index['chunks'])} chunks)")
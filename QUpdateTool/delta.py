@@ -0,0 +1,161 @@
+"""
+Binary patches between two releases of an installer.
+
+A patch is a list of operations rebuilding the new file from the old one:
+    COPY   offset, length   bytes taken from the base file
+    INSERT length, data     bytes carried in the patch itself
+so a minor release only ships the bytes that actually changed.
+
+Generate a patch on the build machine with:
+    python delta.py make <base file> <new file> <patch file>
+"""
+import sys
+import struct
+
+from cache import DownloadCache
+
+MAGIC = b"QDELTA1\0"
+OP_END = 0
+OP_COPY = 1
+OP_INSERT = 2
+COPY_FORMAT = ">QI"
+INSERT_FORMAT = ">I"
+MAX_INSERT = 1024 * 1024 * 4
+
+
+class PatchError(Exception):
+    pass
+
+
+def weak_checksum(data):
+    a = sum(data) % 65536
+    b = sum((len(data) - index) * byte for index, byte in enumerate(data)) % 65536
+    return a, b
+
+
+def make_patch(base_path, new_path, patch_path, block_size=4096):
+    """
+    rsync style diff: index every block of the base by a rolling checksum, then slide over the new file
+    one byte at a time looking for blocks that already exist. Meant for build machines, not the client.
+    Returns the size of the patch.
+    """
+    with open(base_path, "rb") as file:
+        base = file.read()
+    with open(new_path, "rb") as file:
+        new = file.read()
+
+    index = {}
+    for offset in range(0, len(base) - block_size + 1, block_size):
+        index.setdefault(weak_checksum(base[offset:offset + block_size]), []).append(offset)
+
+    operations = []
+    literal_start = 0
+    position = 0
+    a = b = None
+    while position + block_size <= len(new):
+        if a is None:
+            a, b = weak_checksum(new[position:position + block_size])
+
+        match = None
+        for offset in index.get((a, b), []):
+            if base[offset:offset + block_size] == new[position:position + block_size]:
+                match = offset
+                break
+
+        if match is not None:
+            if literal_start < position:
+                operations.append((OP_INSERT, literal_start, position - literal_start))
+            ## Grow the match past the block for as long as both files agree
+            length = block_size
+            while (position + length < len(new) and match + length < len(base)
+                   and new[position + length] == base[match + length]):
+                length += 1
+            if operations and operations[-1][0] == OP_COPY and sum(operations[-1][1:]) == match:
+                operations[-1] = (OP_COPY, operations[-1][1], operations[-1][2] + length)
+            else:
+                operations.append((OP_COPY, match, length))
+            position += length
+            literal_start = position
+            a = b = None
+            continue
+
+        ## Roll the checksum one byte forward
+        if position + block_size < len(new):
+            out_byte, in_byte = new[position], new[position + block_size]
+            a = (a - out_byte + in_byte) % 65536
+            b = (b - block_size * out_byte + a) % 65536
+        position += 1
+
+    if literal_start < len(new):
+        operations.append((OP_INSERT, literal_start, len(new) - literal_start))
+
+    with open(patch_path, "wb") as patch:
+        patch.write(MAGIC)
+        for operation, start, length in operations:
+            if operation == OP_COPY:
+                patch.write(bytes([OP_COPY]) + struct.pack(COPY_FORMAT, start, length))
+                continue
+            for offset in range(start, start + length, MAX_INSERT):
+                data = new[offset:min(offset + MAX_INSERT, start + length)]
+                patch.write(bytes([OP_INSERT]) + struct.pack(INSERT_FORMAT, len(data)) + data)
+        patch.write(bytes([OP_END]))
+        return patch.tell()
+
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise PatchError("Patch is truncated")
+    return data
+
+
+def apply_patch(base_path, patch, output, on_chunk=None, block_size=1024 * 1024):
+    """
+    Rebuild the new file by streaming patch (a readable binary stream) against the base file into output.
+    on_chunk is called with every block written, in file order. Returns the number of bytes written.
+    """
+    if read_exactly(patch, len(MAGIC)) != MAGIC:
+        raise PatchError("Not a QUpdateTool patch")
+
+    written = 0
+    with open(base_path, "rb") as base:
+        while True:
+            operation = read_exactly(patch, 1)[0]
+            if operation == OP_END:
+                return written
+
+            if operation == OP_COPY:
+                offset, length = struct.unpack(COPY_FORMAT, read_exactly(patch, struct.calcsize(COPY_FORMAT)))
+                base.seek(offset)
+                while length:
+                    data = base.read(min(length, block_size))
+                    if not data:
+                        raise PatchError("Patch copies past the end of the base file")
+                    output.write(data)
+                    if on_chunk:
+                        on_chunk(data)
+                    written += len(data)
+                    length -= len(data)
+
+            elif operation == OP_INSERT:
+                length = struct.unpack(INSERT_FORMAT, read_exactly(patch, struct.calcsize(INSERT_FORMAT)))[0]
+                data = read_exactly(patch, length)
+                output.write(data)
+                if on_chunk:
+                    on_chunk(data)
+                written += len(data)
+
+            else:
+                raise PatchError(f"Unknown patch operation {operation}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 5 or sys.argv[1] != "make":
+        print("Usage: python delta.py make <base file> <new file> <patch file>")
+        sys.exit(1)
+
+    base_path, new_path, patch_path = sys.argv[2:]
+    size = make_patch(base_path, new_path, patch_path)
+    print(f"Wrote {patch_path} ({size} bytes)")
+    print(f"base_sha256   = {DownloadCache.hash_file(base_path)}")
+    print(f"result_sha256 = {DownloadCache.hash_file(new_path)}")
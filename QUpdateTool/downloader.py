@@ -0,0 +1,356 @@
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+from requests.packages.urllib3.exceptions import HTTPError as TransportError
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+
+from engines import DownloadEngine, SegmentError, DownloadCancelled
+from streaming import StreamEngine
+from mirrors import MirrorError
+
+
+class Downloader(DownloadEngine):
+    """
+    requests backend, one blocking connection per stream with segments on a thread pool.
+    DownloadThread runs it on a QThread for the GUI, the CLI and manifest mode call run() directly.
+    """
+
+    name = "requests"
+    session = None
+    probe_session = None
+    ## (connect, read) seconds, requests has no session wide timeout so it goes on every call
+    timeout = (5, 15)
+    failover_errors = (requests.RequestException, TransportError, OSError, MirrorError)
+
+    def __init__(self, **options):
+        super(Downloader, self).__init__(**options)
+        self.abort = threading.Event()
+        self.cancelled = threading.Event()
+
+        if Downloader.session is None:
+            Downloader.create_session(pool_size=self.segments)
+
+
+    @classmethod
+    def create_session(cls, pool_size=10):
+        """ One session, and so one connection pool, shared by every download in the process. """
+        cls.session = requests.Session()
+        ## Few, quick retries on the same host, failing over to the next mirror is the better retry
+        retry_strategy = Retry(
+            total=2,
+            status_forcelist=[429, 500, 502, 503, 504],
+            backoff_factor=0.5,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(max_retries=retry_strategy,
+                              pool_connections=10,
+                              pool_maxsize=max(10, pool_size))
+        cls.session.mount("https://", adapter)
+        cls.session.mount("http://", adapter)
+        ## Probes are raced against each other, a retry would only delay the answer of a mirror that lost anyway
+        cls.probe_session = requests.Session()
+        cls.probe_session.mount("https://", HTTPAdapter(max_retries=0))
+        cls.probe_session.mount("http://", HTTPAdapter(max_retries=0))
+
+
+    def cancel(self):
+        """
+        Safe from any thread: every stream stops at its next read and run() unwinds with the .part
+        and its journal kept, so the segment workers are done by the time run() returns.
+        """
+        self.cancelled.set()
+        self.abort.set()
+
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise DownloadCancelled("Update cancelled by user")
+
+
+    def run(self):
+        print(f"Downloading from {self.api_endpoint}")
+        try:
+            self.resolve_host(self.api_endpoint)
+            cached = self.lookup_cache()
+            probe = self.probe(cached)
+            self.throttle.watch(self.source)
+            message = self.use_cache(probe, cached)
+            peer_probe = self.probe_peers() if message is None and self.use_peers() else None
+            if message is None and not peer_probe and self.use_delta():
+                message = self.download_delta()
+                self.check_cancelled()
+            if message is None and not peer_probe and self.use_chunks():
+                message = self.download_chunks()
+                self.check_cancelled()
+            probe = peer_probe or probe
+            if message is None and self.can_download_ranges(probe):
+                self.verifier.check_size(probe["total_size"])
+                try:
+                    message = self.download_ranges(probe)
+                except SegmentError as e:
+                    self.check_cancelled()
+                    self.ranges_failed(e)
+                    message = self.download_single()
+            elif message is None:
+                message = self.download_single()
+            self.extract_download()
+
+        except Exception as e:
+            message = self.handle_error(e)
+
+        self.settle_probes()
+        self.mirror_scores.save()
+        self.message = message
+        return message
+
+
+    def probe(self, cached=None):
+        """
+        Ask the server for size, validators and range support without downloading the body.
+        With a cache entry the request is conditional, so an unchanged file comes back as a 304.
+        With mirrors every one is probed at once and the fastest to answer well is used.
+        """
+        headers = self.cache.conditional_headers(cached) if cached else {}
+        executor = ThreadPoolExecutor(max_workers=len(self.mirrors))
+        self.pending_probes = {executor.submit(self.probe_mirror, mirror, headers): mirror for mirror in self.mirrors}
+        try:
+            for future in as_completed(self.pending_probes):
+                if future.result()[2]:
+                    break
+            results = [future.result() for future in self.pending_probes if future.done()]
+        finally:
+            ## A slow mirror doesn't hold up the download, its probe finishes in the background only to be scored
+            executor.shutdown(wait=False)
+        return self.pick_mirror(results)
+
+
+    def probe_mirror(self, mirror, headers, record=True):
+        try:
+            response = Downloader.probe_session.head(mirror, headers=headers, allow_redirects=True,
+                                                     timeout=(self.probe_timeout, self.probe_timeout))
+        except requests.RequestException as e:
+            print(f"Unable to probe {mirror}: {str(e)}")
+            result = mirror, 0, None
+        else:
+            self.record_response(response)
+            result = mirror, response.elapsed.total_seconds(), self.probe_result(response.url, response.status_code, response.headers)
+        if record:
+            self.record_probe(result)
+        return result
+
+
+    def probe_peers(self):
+        peers = self.peers.find(self.verifier.expected_sha256)
+        if not peers:
+            return self.pick_peer([])
+        with ThreadPoolExecutor(max_workers=len(peers)) as executor:
+            return self.pick_peer(list(executor.map(lambda peer: self.probe_mirror(peer, {}, record=False), peers)))
+
+
+    def record_response(self, response):
+        """ Time to the response headers (including the connect of a new connection) and urllib3 retries. """
+        self.metrics.add_span("ttfb", response.elapsed.total_seconds(),
+                              method=response.request.method, status=response.status_code)
+        retries = getattr(response.raw, "retries", None)
+        if retries and retries.history:
+            self.metrics.count("retries", len(retries.history))
+
+
+    def throttled(self, on_chunk):
+        """
+        Blocking the stream's own thread is how the requests backend keeps to the bandwidth limit,
+        reads go with read_size=self.throttle.read_size so a single read never exceeds the burst.
+        """
+        def on_throttled_chunk(chunk):
+            on_chunk(chunk)
+            self.throttle.wait(len(chunk))
+        return on_throttled_chunk
+
+
+    def download_delta(self):
+        patch_path = None
+        try:
+            response = Downloader.session.get(self.delta_manifest_location(), timeout=self.timeout)
+            self.record_response(response)
+            if response.status_code != 200:
+                return self.plan_delta(None, response.url)
+            plan = self.plan_delta(response.json(), response.url)
+            if plan is None:
+                return None
+
+            patch_path = self.delta_patch_path(plan)
+            with Downloader.session.get(plan["patch_url"], stream=True, timeout=self.timeout) as patch:
+                self.record_response(patch)
+                if patch.status_code != 200:
+                    raise requests.HTTPError(f"patch returned status code {patch.status_code}")
+                on_chunk = self.patch_receiver(int(patch.headers.get("content-length", 0)))
+                try:
+                    with self.metrics.span("transfer", kind="patch"), open(patch_path, "wb", buffering=0) as file:
+                        patch.raw.decode_content = True
+                        StreamEngine().copy(patch.raw, file, on_chunk=self.throttled(on_chunk), abort=self.cancelled,
+                                            read_size=self.throttle.read_size)
+                finally:
+                    self.progress.close()
+                self.check_cancelled()
+            return self.apply_delta(plan, patch_path)
+
+        except Exception as e:
+            self.remove_patch(patch_path)
+            return self.delta_failed(e)
+
+
+    def download_chunks(self):
+        try:
+            response = Downloader.session.get(self.chunk_index_url, timeout=self.timeout)
+            self.record_response(response)
+            index = response.json() if response.status_code == 200 else None
+            plan = self.plan_chunks(index, response.url)
+            if plan is None:
+                return None
+
+            url, ranges = plan
+            with self.metrics.span("transfer", kind="chunks", ranges=len(ranges)), \
+                 ThreadPoolExecutor(max_workers=max(1, min(self.segments, len(ranges)))) as executor:
+                for future in as_completed([executor.submit(self.download_chunk_range, url, *chunk_range)
+                                            for chunk_range in ranges]):
+                    future.result()
+            return self.assemble_chunks(index)
+
+        except Exception as e:
+            self.chunk_store.flush()
+            return self.chunks_failed(e)
+
+
+    def download_chunk_range(self, url, start, end, chunks):
+        with Downloader.session.get(url, headers={"Range": f"bytes={start}-{end}"}, stream=True, timeout=self.timeout) as response:
+            self.record_response(response)
+            if response.status_code != 206:
+                raise SegmentError(f"chunks {start}-{end} returned status code {response.status_code}")
+            on_data = self.chunk_receiver(chunks)
+            for data in response.iter_content(chunk_size=self.throttle.read_size(1024 * 256)):
+                self.check_cancelled()
+                on_data(data)
+                self.throttle.wait(len(data))
+
+
+    def download_single(self):
+        """ One stream from the start of the file, a failing mirror restarts it on the next one. """
+        sources = self.failover_sources(self.source)
+        for index, source in enumerate(sources):
+            try:
+                return self.download_single_from(source, self.create_monitor(sources))
+            except self.failover_errors as e:
+                self.mirror_failed(source, e, sources[index + 1:])
+                self.verifier.reset()
+                if index == len(sources) - 1:
+                    self.output_file = ""
+                    return f"Error downloading file: {str(e)}"
+
+
+    def download_single_from(self, source, monitor):
+        response = Downloader.session.get(source, stream=True, timeout=self.timeout)
+        self.record_response(response)
+
+        if response.status_code == 200:
+            filename = self.get_filename(response.url, response.headers)
+            total_size = int(response.headers.get("content-length", 0))
+            self.output_file = os.path.join(self.download_location, filename)
+            part_file = f"{self.output_file}.part"
+
+            self.verifier.check_size(total_size)
+
+            handler = self.chunk_handler(0)
+            def on_chunk(chunk):
+                handler(chunk)
+                monitor.update(len(chunk))
+
+            self.progress.start(total_size)
+            output = self.open_output(filename, part_file, total_size)
+            try:
+                with response, self.metrics.span("transfer", kind="single"), output as file:
+                    response.raw.decode_content = True
+                    StreamEngine().copy(response.raw, file, on_chunk=self.throttled(on_chunk), abort=self.cancelled,
+                                        read_size=self.throttle.read_size)
+            finally:
+                self.progress.close()
+            self.check_cancelled()
+            self.mirror_scores.record_transfer(source, monitor.bytes, monitor.elapsed())
+
+            self.remote = {"etag": response.headers.get("etag", ""),
+                           "last_modified": response.headers.get("last-modified", "")}
+            self.complete_output(output, part_file)
+            return "Downloaded update successfully!"
+
+        raise MirrorError(f"status code {response.status_code}")
+
+
+    def download_ranges(self, probe):
+        journal = self.open_journal(probe)
+        sink = self.open_sink(journal)
+        ranges = self.split_ranges(journal.missing_ranges())
+        self.abort.clear()
+        ## A cancel() that landed before the clear still stops the segments
+        if self.cancelled.is_set():
+            self.abort.set()
+        if len(ranges) > 1:
+            print(f"Server supports ranges, downloading in {len(ranges)} segments...")
+
+        self.progress.start(probe["total_size"], initial=journal.completed_bytes())
+        try:
+            with self.metrics.span("transfer", kind="ranges", segments=len(ranges)), \
+                 ThreadPoolExecutor(max_workers=max(1, len(ranges))) as executor:
+                futures = [executor.submit(self.download_segment, probe["url"], start, end, journal, sink)
+                           for start, end in ranges]
+                for future in as_completed(futures):
+                    if future.exception():
+                        self.abort.set()
+                        raise future.exception()
+        finally:
+            ## Data first, so the journal never records bytes that are not on disk yet
+            sink.close()
+            journal.save(force=True)
+            self.progress.close()
+        ## Cancelled segments return early without an error, the .part is incomplete
+        self.check_cancelled()
+
+        self.remote = {"etag": probe["etag"], "last_modified": probe["last_modified"]}
+        self.complete_download(journal.part_file)
+        return "Downloaded update successfully!"
+
+
+    def download_segment(self, url, start, end, journal, sink):
+        """ A failing or stalled mirror hands the rest of the segment to the next one, resuming by Range. """
+        position = start
+        sources = self.failover_sources(url)
+        for index, source in enumerate(sources):
+            monitor = self.create_monitor(sources)
+            try:
+                self.download_range(source, url, position, end, journal, sink, monitor)
+                self.mirror_scores.record_transfer(source, monitor.bytes, monitor.elapsed())
+                return
+            except self.failover_errors as e:
+                position += monitor.bytes
+                if self.abort.is_set():
+                    raise
+                self.mirror_failed(source, e, sources[index + 1:])
+        raise SegmentError(f"segment {start}-{end} failed on every mirror")
+
+
+    def download_range(self, source, url, start, end, journal, sink, monitor):
+        headers = self.range_headers(source, url, start, end, journal)
+        with Downloader.session.get(source, headers=headers, stream=True, timeout=self.timeout) as response:
+            self.record_response(response)
+            self.check_range_response(source, url, response.status_code, response.headers, start, end, journal)
+
+            handler = self.chunk_handler(start, journal)
+            def on_chunk(chunk):
+                handler(chunk)
+                monitor.update(len(chunk))
+
+            ## Straight into the shared map, so bytes recorded in the journal are already with the OS if we get terminated
+            response.raw.decode_content = True
+            StreamEngine().copy(response.raw, sink.writer(start), on_chunk=self.throttled(on_chunk), abort=self.abort,
+                                read_size=self.throttle.read_size)
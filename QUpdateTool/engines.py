@@ -0,0 +1,624 @@
+import os
+import socket
+import importlib
+from urllib.parse import urlparse, urljoin, urlencode, quote
+
+from journal import DownloadJournal
+from progress import ProgressReporter
+from cache import DownloadCache
+from verify import StreamVerifier, VerificationError
+from delta import apply_patch
+from chunkstore import ChunkStore
+from metrics import Metrics
+from mirrors import MirrorScores, MirrorError, ThroughputMonitor, mirror_key
+from throttle import Throttle
+from peers import PeerNode
+from sink import OutputSink, commit_file
+from archives import ArchiveError, StreamingExtractor, archive_format, extract_archive, staging_directory
+
+
+## Backend name -> (module, class), imported only when that backend is asked for
+ENGINES = {
+    "requests": ("downloader", "Downloader"),
+    "asyncio": ("async_downloader", "AsyncDownloader"),
+}
+
+
+def create_engine(engine="requests", **options):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown download engine {engine}, expected one of: {', '.join(ENGINES)}")
+    module_name, class_name = ENGINES[engine]
+    return getattr(importlib.import_module(module_name), class_name)(**options)
+
+
+class SegmentError(Exception):
+    pass
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+class DownloadEngine():
+    """
+    Interface of a download backend plus the steps that don't depend on the transport:
+    cache lookups, the resume journal, range splitting, verification and moving the result into place.
+    A backend implements run(), which downloads and returns the message shown to the user.
+    """
+
+    name = ""
+    min_segment_size = 1024 * 1024
+    ## Whether the writing stream fsyncs the .part every flush_bytes itself, the asyncio backend does it off the loop
+    flush_inline = True
+    ## Seconds a mirror gets to answer the HEAD probe, without retries, one that can't is not worth waiting for
+    probe_timeout = 3
+
+    def __init__(self,
+                 api_endpoint: str = "",
+                 download_location: str = r"",
+                 segments: int = 1,
+                 reporter: ProgressReporter = None,
+                 cache: DownloadCache = None,
+                 expected_sha256: str = "",
+                 expected_size: int = 0,
+                 current_version: str = "",
+                 delta_manifest_url: str = "",
+                 delta_base_path: str = "",
+                 chunk_store: ChunkStore = None,
+                 chunk_index_url: str = "",
+                 metrics: Metrics = None,
+                 mirrors: list = None,
+                 mirror_scores: MirrorScores = None,
+                 stall_speed: int = 0,
+                 throttle: Throttle = None,
+                 peers: PeerNode = None,
+                 install_directory: str = ""):
+        self.api_endpoint = api_endpoint
+        self.download_location = download_location
+        self.segments = max(1, int(segments or 1))
+        self.output_file = ""
+        self.message = ""
+        self.cache = cache
+        self.remote = {"etag": "", "last_modified": ""}
+        self.verifier = StreamVerifier(expected_sha256, expected_size)
+        self.progress = reporter or ProgressReporter()
+        self.current_version = current_version or ""
+        self.delta_manifest_url = delta_manifest_url or ""
+        self.delta_base_path = delta_base_path or ""
+        self.chunk_store = chunk_store
+        self.chunk_index_url = chunk_index_url or ""
+        self.metrics = metrics or Metrics()
+        self.mirrors = list(dict.fromkeys([api_endpoint] + list(mirrors or [])))
+        self.mirror_scores = mirror_scores or MirrorScores()
+        self.stall_speed = stall_speed
+        self.source = api_endpoint
+        self.throttle = throttle or Throttle()
+        self.peers = peers
+        self.install_directory = install_directory or ""
+        ## Mirror probes (future or task -> mirror) still allowed to run after the download started
+        self.pending_probes = {}
+        self.probes_settled = False
+
+
+    def run(self):
+        raise NotImplementedError
+
+
+    def handle_error(self, error):
+        self.output_file = ""
+        if isinstance(error, DownloadCancelled):
+            return "Update cancelled by user"
+        if isinstance(error, VerificationError):
+            return f"Downloaded update failed verification: {str(error)}"
+        if isinstance(error, ArchiveError):
+            return str(error)
+        return f"Error downloading file: {str(error)}"
+
+
+    def resolve_host(self, url):
+        """ Time the DNS lookup on its own, the connection made afterwards is served from the resolver cache. """
+        parsed = urlparse(url)
+        if not parsed.hostname:
+            return
+        with self.metrics.span("dns", host=parsed.hostname):
+            try:
+                socket.getaddrinfo(parsed.hostname, parsed.port or (443 if parsed.scheme == "https" else 80),
+                                   type=socket.SOCK_STREAM)
+            except OSError:
+                pass
+
+
+    def record_probe(self, result):
+        """ Score one finished mirror probe, probes still running when the download starts end up here too. """
+        mirror, latency, probe = result
+        if self.probes_settled:
+            return
+        if probe:
+            self.mirror_scores.record_probe(mirror, latency)
+        else:
+            self.mirror_scores.record_failure(mirror)
+
+
+    def settle_probes(self):
+        """ Called once the download is over, a mirror still probing was slower than all of it and counts as failed. """
+        self.probes_settled = True
+        for pending, mirror in self.pending_probes.items():
+            if not pending.done():
+                ## A task is cancelled, a thread can't be and its late result is ignored
+                pending.cancel()
+                self.mirror_scores.record_failure(mirror)
+        self.pending_probes = {}
+
+
+    def pick_mirror(self, results):
+        """
+        results holds (mirror, latency, probe) for the mirrors that answered by the time the first good probe
+        came in, probe is None if it failed. Of those the mirror expected to finish first wins, using the
+        measured latency and the throughput of past runs.
+        """
+        answered = [result for result in results if result[2]]
+        if not answered:
+            return None
+        size = max(probe.get("total_size", 0) for _, _, probe in answered)
+        mirror, latency, probe = min(answered, key=lambda result: self.mirror_scores.expected_time(result[0], size, result[1]))
+        if len(self.mirrors) > 1:
+            print(f"Using mirror {mirror_key(mirror)} ({latency * 1000:.0f} ms)...")
+        self.source = mirror
+        return probe
+
+
+    def use_peers(self):
+        ## Peers are found by hash, and a file from a peer is only trusted once it matches the published one
+        return bool(self.peers and self.verifier.expected_sha256)
+
+
+    def pick_peer(self, results):
+        """ Fastest LAN peer to answer a probe, None to download from the origin. """
+        answered = [result for result in results if result[2] and not result[2].get("not_modified")]
+        if not answered:
+            print("No LAN peer has the update, downloading from the origin...")
+            return None
+        peer, latency, probe = min(answered, key=lambda result: result[1])
+        print(f"Downloading from LAN peer {mirror_key(peer)}...")
+        self.source = peer
+        return probe
+
+
+    def failover_sources(self, url):
+        """ url first, then every other mirror best first. """
+        others = [mirror for mirror in self.mirror_scores.rank(self.mirrors) if mirror != self.source]
+        return [url] + others
+
+
+    def create_monitor(self, sources):
+        ## Only give up on a slow mirror when there is another one to switch to, and never for our own throttling
+        throttled = self.throttle.rate or self.throttle.background
+        return ThroughputMonitor(self.stall_speed if len(sources) > 1 and not throttled else 0)
+
+
+    def mirror_failed(self, source, error, remaining):
+        self.mirror_scores.record_failure(source)
+        self.metrics.count("mirror_failovers")
+        if remaining:
+            print(f"Download from {mirror_key(source)} failed ({str(error)}), switching to {mirror_key(remaining[0])}...")
+
+
+    def range_headers(self, source, url, start, end, journal):
+        headers = {"Range": f"bytes={start}-{end}"}
+        ## Other mirrors have their own validators, the size check and final hash guard against a different file there
+        if source == url and journal.if_range():
+            headers["If-Range"] = journal.if_range()
+        return headers
+
+
+    def check_range_response(self, source, url, status_code, headers, start, end, journal):
+        if status_code == 200 and source == url:
+            ## The ranges were ignored or If-Range failed because the file changed
+            journal.remove()
+            raise SegmentError(f"segment {start}-{end} returned status code {status_code}")
+        if status_code != 206:
+            raise MirrorError(f"segment {start}-{end} returned status code {status_code}")
+        total_size = headers.get("content-range", "").rpartition("/")[2]
+        if total_size.isdigit() and int(total_size) != journal.total_size:
+            raise MirrorError(f"mirror serves {total_size} bytes, expected {journal.total_size}")
+
+
+    def lookup_cache(self):
+        """ Cache entry for the URL, unless it can't be the file we expect. """
+        cached = self.cache.lookup(self.api_endpoint) if self.cache else None
+        if cached and self.verifier.expected_sha256 and cached["sha256"] != self.verifier.expected_sha256:
+            return None
+        return cached
+
+
+    def use_cache(self, probe, cached):
+        """ Serve the download from the cache if possible, returns the message or None on a miss. """
+        if cached and probe and self.is_cache_hit(probe, cached):
+            return self.use_cached(cached["sha256"], cached["filename"], cached["size"])
+
+        blob = self.cache.find_by_hash(self.verifier.expected_sha256) if self.cache else None
+        if blob:
+            filename = probe.get("filename") if probe else None
+            return self.use_cached(self.verifier.expected_sha256, filename or self.get_url_filename(self.api_endpoint),
+                                   os.path.getsize(blob))
+        return None
+
+
+    def is_cache_hit(self, probe, cached):
+        if probe.get("not_modified"):
+            return True
+        ## Some servers ignore conditional HEAD requests, an identical ETag and size is just as good
+        return bool(probe["etag"]) and probe["etag"] == cached["etag"] and probe["total_size"] == cached["size"]
+
+
+    def use_cached(self, sha256, filename, size):
+        """
+        The cached blob is hashed again before it stands in for the download, one full read of the file:
+        it is hardlinked into the download directory, so a change to either copy since it was stored shows up here.
+        """
+        self.output_file = os.path.join(self.download_location, filename)
+        self.cache.materialize(sha256, self.output_file)
+        verifier = StreamVerifier(sha256, self.verifier.expected_size or size)
+        try:
+            with self.metrics.span("verify", file=filename, source="cache") as span:
+                verifier.finalize(self.output_file)
+                span["read_back"] = verifier.read_back
+        except VerificationError as e:
+            print(f"Cached copy failed verification ({str(e)}), downloading the update again...")
+            os.remove(self.output_file)
+            self.cache.discard(sha256)
+            self.output_file = ""
+            return None
+
+        print("Update is unchanged since it was last downloaded, using the cached copy...")
+        self.progress.start(size, initial=size)
+        self.progress.close()
+        return "Update loaded from the local cache!"
+
+
+    def store_in_cache(self, sha256):
+        if not self.cache:
+            return
+        try:
+            self.cache.add(self.api_endpoint, self.output_file, self.remote["etag"], self.remote["last_modified"], sha256)
+        except OSError as e:
+            print(f"Unable to add the update to the download cache: {str(e)}")
+            return
+        if self.peers:
+            self.peers.announce(sha256)
+
+
+    def probe_result(self, url, status_code, headers):
+        """ Probe dict from the status and (lower-case accessible) headers of a HEAD response. """
+        if status_code == 304:
+            return {"url": url, "not_modified": True}
+        if status_code != 200:
+            return None
+
+        return {"url": url,
+                "filename": self.get_filename(url, headers),
+                "total_size": int(headers.get("content-length", 0)),
+                "etag": headers.get("etag", ""),
+                "last_modified": headers.get("last-modified", ""),
+                "accept_ranges": headers.get("accept-ranges", "").lower() == "bytes"}
+
+
+    def get_filename(self, url, headers):
+        disposition = headers.get("content-disposition", "")
+        if "filename=" in disposition:
+            return disposition.split("filename=")[-1].strip("\"'; ")
+        return self.get_url_filename(url)
+
+
+    def get_url_filename(self, url):
+        return os.path.basename(urlparse(url).path) or "update.exe"
+
+
+    def can_download_ranges(self, probe):
+        ## A tar is extracted as one in-order stream, which beats ranges that would have to land on disk first
+        return bool(probe and probe["accept_ranges"] and probe["total_size"]) and not self.streams_archive(probe["filename"])
+
+
+    def streams_archive(self, filename):
+        return bool(self.install_directory) and archive_format(filename) == "tar"
+
+
+    def open_output(self, filename, part_file, total_size=0):
+        """ Where a single stream writes: the .part file, or the extractor of a tar payload. """
+        if self.streams_archive(filename):
+            print(f"Extracting {filename} into {staging_directory(self.install_directory)} as it downloads...")
+            ## With a cache the archive also goes to the .part file, so later runs and LAN peers can be served from it
+            archive = OutputSink(part_file, self.verifier.expected_size or total_size) if self.cache else None
+            return StreamingExtractor(staging_directory(self.install_directory), archive=archive).start()
+        return OutputSink(part_file, self.verifier.expected_size or total_size, auto_flush=self.flush_inline)
+
+
+    def complete_output(self, output, part_file):
+        if isinstance(output, StreamingExtractor):
+            self.complete_extraction(output)
+        else:
+            self.complete_download(part_file)
+
+
+    def complete_extraction(self, extractor):
+        """ Verify the streamed archive, the extracted files only count as the update if it matches. """
+        try:
+            with self.metrics.span("verify", file=os.path.basename(self.output_file)):
+                sha256 = self.verifier.finalize()
+        except VerificationError:
+            extractor.discard()
+            raise
+        if extractor.archive:
+            commit_file(extractor.archive.path, self.output_file)
+            self.store_in_cache(sha256)
+            ## The cache keeps its own copy, the extracted files are all the install needs
+            os.remove(self.output_file)
+        self.output_file = extractor.directory
+
+
+    def extract_download(self):
+        """
+        With an install directory, a downloaded archive (a zip, or a tar from the cache, a patch or chunks)
+        is extracted into the staging directory right away, so only the swap is left once the software exits.
+        """
+        if not (self.install_directory and self.output_file and os.path.isfile(self.output_file)
+                and archive_format(self.output_file)):
+            return
+        print(f"Extracting {os.path.basename(self.output_file)} into {staging_directory(self.install_directory)}...")
+        with self.metrics.span("extract", archive=os.path.basename(self.output_file)):
+            directory = extract_archive(self.output_file, staging_directory(self.install_directory))
+        ## The cache keeps its own copy, the extracted files are all the install needs
+        os.remove(self.output_file)
+        self.output_file = directory
+
+
+    def open_journal(self, probe):
+        """ Reuse the journal of a previous run if the remote file is unchanged, otherwise start over. """
+        self.output_file = os.path.join(self.download_location, probe["filename"])
+        part_file = f"{self.output_file}.part"
+        journal = DownloadJournal(part_file)
+        validators = (self.api_endpoint, probe["etag"], probe["last_modified"], probe["total_size"])
+
+        if journal.load() and journal.matches(*validators):
+            print(f"Resuming download, {journal.completed_bytes()} of {probe['total_size']} bytes already on disk...")
+        else:
+            journal.reset(*validators)
+        return journal
+
+
+    def ranges_failed(self, error):
+        """ The single stream taking over rewrites the .part from the start, the journal would vouch for zeros. """
+        print(f"Ranged download failed ({str(error)}), falling back to a single stream...")
+        DownloadJournal(f"{self.output_file}.part").remove()
+        self.verifier.reset()
+
+
+    def open_sink(self, journal):
+        """ Preallocated output every segment writes into, a resumed download keeps the bytes already there. """
+        return OutputSink(journal.part_file, journal.total_size, resume=bool(journal.completed), auto_flush=self.flush_inline)
+
+
+    def split_ranges(self, ranges):
+        """ Split the largest missing ranges until every segment worker has one. """
+        ranges = list(ranges)
+        while ranges and len(ranges) < self.segments:
+            largest = max(ranges, key=lambda item: item[1] - item[0])
+            start, end = largest
+            if end - start + 1 < self.min_segment_size * 2:
+                break
+            middle = start + (end - start + 1) // 2
+            ranges.remove(largest)
+            ranges += [(start, middle - 1), (middle, end)]
+        return sorted(ranges)
+
+
+    def chunk_handler(self, position, journal=None):
+        """ Per chunk bookkeeping of one stream starting at position: hash, journal and progress. """
+        def on_chunk(chunk):
+            nonlocal position
+            self.verifier.update(position, chunk)
+            self.metrics.count("bytes_downloaded", len(chunk))
+            if journal:
+                journal.add_range(position, position + len(chunk) - 1)
+            position += len(chunk)
+            self.progress.publish(len(chunk))
+        return on_chunk
+
+
+    def patch_receiver(self, total_size):
+        """ Per chunk bookkeeping of the patch transfer, counted and shown as progress like a full download. """
+        self.progress.start(total_size)
+        def on_chunk(chunk):
+            self.metrics.count("bytes_downloaded", len(chunk))
+            self.progress.publish(len(chunk))
+        return on_chunk
+
+
+    def use_delta(self):
+        return bool(self.delta_manifest_url and self.current_version)
+
+
+    def delta_manifest_location(self):
+        """ {current_version} in the URL is filled in, otherwise it is sent as ?from=<version>. """
+        if "{current_version}" in self.delta_manifest_url:
+            return self.delta_manifest_url.replace("{current_version}", quote(str(self.current_version)))
+        separator = "&" if "?" in self.delta_manifest_url else "?"
+        return f"{self.delta_manifest_url}{separator}{urlencode({'from': self.current_version})}"
+
+
+    def plan_delta(self, manifest, manifest_url):
+        """
+        Check a patch manifest ({"from", "to", "patch_url", "base_sha256", "result_sha256", "result_size", "filename"})
+        against what is available locally. Returns what apply_delta needs, or None to do a full download.
+        """
+        if not manifest or not manifest.get("patch_url"):
+            print("No patch published for this version, downloading the full installer...")
+            return None
+        if str(manifest.get("from", "")) != str(self.current_version):
+            print(f"Patch is for version {manifest.get('from')}, not {self.current_version}, downloading the full installer...")
+            return None
+
+        base_sha256 = str(manifest.get("base_sha256", "")).lower()
+        result_sha256 = str(manifest.get("result_sha256", "")).lower()
+        if not (base_sha256 and result_sha256):
+            print("Patch manifest has no hashes, downloading the full installer...")
+            return None
+        if self.verifier.expected_sha256 and result_sha256 != self.verifier.expected_sha256:
+            print("Patch result does not match expected_sha256, downloading the full installer...")
+            return None
+
+        base = self.cache.find_by_hash(base_sha256) if self.cache else None
+        if not base and os.path.isfile(self.delta_base_path) and DownloadCache.hash_file(self.delta_base_path) == base_sha256:
+            base = self.delta_base_path
+        if not base:
+            print("The installed version is not available locally, downloading the full installer...")
+            return None
+
+        return {"base": base,
+                "patch_url": urljoin(manifest_url, manifest["patch_url"]),
+                "result_sha256": result_sha256,
+                "result_size": int(manifest.get("result_size") or self.verifier.expected_size or 0),
+                "filename": manifest.get("filename") or self.get_url_filename(self.api_endpoint)}
+
+
+    def delta_patch_path(self, plan):
+        return os.path.join(self.download_location, f"{plan['filename']}.patch")
+
+
+    def apply_delta(self, plan, patch_path):
+        """ Rebuild the new release from the base and the downloaded patch, verified against result_sha256. """
+        print(f"Applying patch from {self.current_version}...")
+        self.output_file = os.path.join(self.download_location, plan["filename"])
+        part_file = f"{self.output_file}.part"
+        verifier = StreamVerifier(plan["result_sha256"], plan["result_size"])
+
+        position = 0
+        def on_chunk(chunk):
+            nonlocal position
+            verifier.update(position, chunk)
+            position += len(chunk)
+            self.progress.publish(len(chunk))
+
+        self.progress.start(plan["result_size"])
+        try:
+            with open(patch_path, "rb") as patch, OutputSink(part_file, plan["result_size"]) as output:
+                apply_patch(plan["base"], patch, output, on_chunk=on_chunk)
+        finally:
+            self.progress.close()
+            os.remove(patch_path)
+
+        self.remote = {"etag": "", "last_modified": ""}
+        self.complete_download(part_file, verifier)
+        return "Downloaded update successfully! (patched from the installed version)"
+
+
+    def remove_patch(self, patch_path):
+        """ A partly downloaded patch can't be applied and isn't resumed, so it doesn't stay behind. """
+        if patch_path and os.path.exists(patch_path):
+            os.remove(patch_path)
+
+
+    def delta_failed(self, error):
+        print(f"Delta update failed ({str(error)}), downloading the full installer...")
+        self.output_file = ""
+        return None
+
+
+    def use_chunks(self):
+        return bool(self.chunk_store and self.chunk_index_url)
+
+
+    def plan_chunks(self, index, index_url, max_range_size=1024 * 1024 * 8):
+        """
+        Group the chunks missing from the store into ranges of the artifact, adjacent chunks share a request.
+        Returns (url, ranges) where each range is (start, end, chunks), or None to do a full download.
+        """
+        if not index or "chunks" not in index or not index.get("sha256"):
+            print("No chunk index published, downloading the full installer...")
+            return None
+        if self.verifier.expected_sha256 and index["sha256"].lower() != self.verifier.expected_sha256:
+            print("Chunk index does not match expected_sha256, downloading the full installer...")
+            return None
+
+        ranges = []
+        for chunk in sorted(self.chunk_store.missing(index["chunks"]), key=lambda chunk: chunk["offset"]):
+            start, end, chunks = ranges[-1] if ranges else (0, -1, [])
+            if ranges and chunk["offset"] == end + 1 and end - start + 1 + chunk["size"] <= max_range_size:
+                ranges[-1] = (start, chunk["offset"] + chunk["size"] - 1, chunks + [chunk])
+            else:
+                ranges.append((chunk["offset"], chunk["offset"] + chunk["size"] - 1, [chunk]))
+
+        missing = sum(end - start + 1 for start, end, _ in ranges)
+        print(f"{len(index['chunks'])} chunks, {index['size'] - missing} of {index['size']} bytes already in the chunk store...")
+        self.progress.start(index["size"], initial=index["size"] - missing)
+        return urljoin(index_url, index.get("url") or self.api_endpoint), ranges
+
+
+    def chunk_receiver(self, chunks, store=True):
+        """
+        Callback for the body of one range: cuts it back into chunks and stores each once it is complete.
+        Returns the (sha256, data) completed by each call, with store=False the caller stores them (off the event loop).
+        """
+        pending = list(chunks)
+        buffer = bytearray()
+        def on_data(data):
+            buffer.extend(data)
+            completed = []
+            while pending and len(buffer) >= pending[0]["size"]:
+                chunk = pending.pop(0)
+                completed.append((chunk["sha256"], bytes(buffer[:chunk["size"]])))
+                del buffer[:chunk["size"]]
+            if store:
+                self.store_chunks(completed)
+            self.metrics.count("bytes_downloaded", len(data))
+            self.progress.publish(len(data))
+            return completed
+        return on_data
+
+
+    def store_chunks(self, completed):
+        for sha256, data in completed:
+            self.chunk_store.add(sha256, data)
+
+
+    def assemble_chunks(self, index):
+        """ Build the artifact from the store, verified against the sha256 of the index. """
+        self.progress.close()
+        self.output_file = os.path.join(self.download_location, index.get("filename") or self.get_url_filename(self.api_endpoint))
+        part_file = f"{self.output_file}.part"
+        verifier = StreamVerifier(index["sha256"], index["size"])
+
+        position = 0
+        def on_chunk(chunk):
+            nonlocal position
+            verifier.update(position, chunk)
+            position += len(chunk)
+
+        self.chunk_store.assemble(index["chunks"], part_file, index["size"], on_chunk=on_chunk)
+        self.chunk_store.touch(index["chunks"])
+        self.remote = {"etag": "", "last_modified": ""}
+        self.complete_download(part_file, verifier)
+        return "Downloaded update successfully! (assembled from the chunk store)"
+
+
+    def chunks_failed(self, error):
+        self.progress.close()
+        print(f"Chunked download failed ({str(error)}), downloading the full installer...")
+        self.output_file = ""
+        return None
+
+
+    def complete_download(self, part_file, verifier=None):
+        """ Verify the finished .part file and move it into place, a mismatch deletes it instead. """
+        try:
+            verifier = verifier or self.verifier
+            with self.metrics.span("verify", file=os.path.basename(self.output_file)) as span:
+                sha256 = verifier.finalize(part_file)
+                span["read_back"] = verifier.read_back
+        except VerificationError:
+            os.remove(part_file)
+            DownloadJournal(part_file).remove()
+            raise
+        commit_file(part_file, self.output_file)
+        DownloadJournal(part_file).remove()
+        self.store_in_cache(sha256)
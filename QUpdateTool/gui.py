@@ -1,10 +1,11 @@
 import sys
-import os
 from PySide6.QtWidgets import QApplication, QWidget, QLabel, QProgressBar, QPushButton, QGridLayout, QMessageBox
 from PySide6.QtGui import QPixmap, QIcon
 from PySide6.QtCore import Qt, QTimer, Signal
 
-from threads import DownloadThread
+from threads import DownloadThread, QtEventLoopDriver
+from engines import create_engine
+from progress import ProgressReporter
 
 class UpdaterWindow(QWidget):
     closeEvent = Signal(str, str)
@@ -14,6 +15,7 @@ class UpdaterWindow(QWidget):
                  current_version="{unknown}",
                  download_location=r"",
                  api_endpoint="",
+                 download_options=None,
                  parent=None):
         super(UpdaterWindow, self).__init__(parent)
         self.setWindowTitle("QUpdateTool")
@@ -22,6 +24,10 @@ class UpdaterWindow(QWidget):
         self.current_version = current_version
         self.download_location = download_location
         self.api_endpoint = api_endpoint
+        self.download_options = download_options or {}
+        self.download_thread = None
+        self.event_loop = None
+        self.download_engine = None
         self.download_progress_data = {}
 
         self.close_timer = QTimer()
@@ -58,12 +64,18 @@ class UpdaterWindow(QWidget):
     def download_update(self):
         print("Update via GUI...")
         try:
+            if self.download_options.get("engine") == "asyncio":
+                self.download_update_async()
+                return
+
             self.download_thread = DownloadThread(api_endpoint=self.api_endpoint,
                                                   download_location=self.download_location,
-                                                  gui=True)
+                                                  gui=True,
+                                                  **self.download_options)
+            self.download_engine = self.download_thread
 
-            self.download_thread.update_progress.connect(self.update_download_progress, Qt.DirectConnection)
-            self.download_thread.finished.connect(self.handle_download_finish, Qt.DirectConnection)
+            self.download_thread.update_progress.connect(self.update_download_progress, Qt.QueuedConnection)
+            self.download_thread.finished.connect(self.handle_download_finish, Qt.QueuedConnection)
             self.download_thread.start()
 
         except Exception as e:
@@ -77,6 +89,19 @@ class UpdaterWindow(QWidget):
                 self.download_update()
 
 
+    def download_update_async(self):
+        """ The asyncio engine runs on the GUI thread, its event loop is stepped by the Qt one. """
+        reporter = ProgressReporter()
+        reporter.subscribe(self.update_download_progress)
+        self.download_engine = create_engine(api_endpoint=self.api_endpoint,
+                                             download_location=self.download_location,
+                                             reporter=reporter,
+                                             **self.download_options)
+        self.event_loop = QtEventLoopDriver(parent=self)
+        self.event_loop.finished.connect(self.handle_download_finish)
+        self.event_loop.run(self.download_engine.download())
+
+
     def update_download_progress(self, data):
         self.download_progress_data = data
         self.update_progress_bar()
@@ -86,15 +111,16 @@ class UpdaterWindow(QWidget):
         self.progress_bar.setValue(100)
         self.label.setText(message)
         self.main.app.processEvents()
-        self.closeEvent.emit(self.download_location, self.download_thread.output_file)
+        self.closeEvent.emit(self.download_location, self.download_engine.output_file)
 
 
     def update_progress_bar(self):
         unit = self.download_progress_data["unit"]
         n, total_size = map(lambda key: self.format_size(self.download_progress_data[key], unit), ["n", "total"])
-        percentage = (n / total_size) * 100
-        self.progress_bar.setValue(percentage)
-        self.progress_bar.setFormat(f"{percentage:.1f}% | {n:.2f}{unit}/{total_size:.0f}{unit}")
+        rate = self.format_size(self.download_progress_data.get("rate", 0), unit)
+        percentage = (n / total_size) * 100 if total_size else 0
+        self.progress_bar.setValue(int(percentage))
+        self.progress_bar.setFormat(f"{percentage:.1f}% | {n:.2f}{unit}/{total_size:.0f}{unit} | {rate:.2f}{unit}/s")
 
 
     def format_size(self, bytes, unit):
@@ -109,16 +135,14 @@ class UpdaterWindow(QWidget):
         
 
     def cancel_update(self):
-        self.download_thread.terminate()
+        if self.event_loop:
+            self.event_loop.cancel()
+            return
+        ## Terminating the QThread would leave the segment workers downloading, they stop at their next read instead
+        ## The .part file and its journal are kept so the next run resumes instead of starting over
+        self.download_thread.cancel()
         self.download_thread.wait()
 
-        self.filepath = os.path.join(self.download_location, "update.exe")
-        if os.path.exists(self.filepath):
-            os.remove(self.filepath)
-
-        self.handle_download_finish("Update cancelled by user")
-        self.close_window()
-
 
     def close_window(self):
         self.closeEvent.emit(self.download_location, "update.exe")
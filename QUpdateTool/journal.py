@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import threading
+
+
+class DownloadJournal():
+    """ Sidecar file recording which byte ranges of a .part download are already on disk. """
+
+    save_interval = 1.0
+
+    def __init__(self, part_file: str = ""):
+        self.part_file = part_file
+        self.path = f"{part_file}.json"
+        self.url = ""
+        self.etag = ""
+        self.last_modified = ""
+        self.total_size = 0
+        self.completed = []
+        self.lock = threading.Lock()
+        self.last_save = 0.0
+        self.discarded = False
+
+
+    def load(self):
+        if not (os.path.isfile(self.path) and os.path.isfile(self.part_file)):
+            return False
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+            self.url = data["url"]
+            self.etag = data.get("etag", "")
+            self.last_modified = data.get("last_modified", "")
+            self.total_size = int(data["total_size"])
+            self.completed = [tuple(item) for item in data.get("completed", [])]
+            return True
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable download journal {self.path}: {str(e)}")
+            return False
+
+
+    def matches(self, url, etag, last_modified, total_size):
+        if not (etag or last_modified):
+            ## Without a validator we can't tell whether the file changed upstream
+            return False
+        return (self.url == url and self.etag == etag and
+                self.last_modified == last_modified and self.total_size == total_size)
+
+
+    def reset(self, url, etag, last_modified, total_size):
+        with self.lock:
+            self.url = url
+            self.etag = etag
+            self.last_modified = last_modified
+            self.total_size = total_size
+            self.completed = []
+            self.discarded = False
+        self.save(force=True)
+
+
+    def if_range(self):
+        """ Validator for the If-Range header, weak ETags are not allowed there. """
+        if self.etag and not self.etag.startswith("W/"):
+            return self.etag
+        return self.last_modified
+
+
+    def add_range(self, start, end):
+        with self.lock:
+            ranges = sorted(self.completed + [(start, end)])
+            merged = [ranges[0]]
+            for range_start, range_end in ranges[1:]:
+                last_start, last_end = merged[-1]
+                if range_start <= last_end + 1:
+                    merged[-1] = (last_start, max(last_end, range_end))
+                else:
+                    merged.append((range_start, range_end))
+            self.completed = merged
+        self.save()
+
+
+    def completed_bytes(self):
+        with self.lock:
+            return sum(end - start + 1 for start, end in self.completed)
+
+
+    def missing_ranges(self):
+        with self.lock:
+            missing = []
+            position = 0
+            for start, end in self.completed:
+                if start > position:
+                    missing.append((position, start - 1))
+                position = max(position, end + 1)
+            if position < self.total_size:
+                missing.append((position, self.total_size - 1))
+            return missing
+
+
+    def save(self, force=False):
+        now = time.monotonic()
+        with self.lock:
+            if self.discarded or (not force and now - self.last_save < self.save_interval):
+                return
+            self.last_save = now
+            data = {"url": self.url,
+                    "etag": self.etag,
+                    "last_modified": self.last_modified,
+                    "total_size": self.total_size,
+                    "completed": self.completed}
+            temp_path = f"{self.path}.tmp"
+            try:
+                with open(temp_path, "w") as file:
+                    json.dump(data, file)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                print(f"Unable to save download journal {self.path}: {str(e)}")
+
+
+    def remove(self):
+        """ Delete the journal for good, segments still streaming or a final save(force=True) don't bring it back. """
+        with self.lock:
+            self.discarded = True
+        for path in (self.path, f"{self.path}.tmp"):
+            if os.path.exists(path):
+                os.remove(path)
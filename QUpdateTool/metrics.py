@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Metrics():
+    """
+    Timing spans, counters and values recorded across one update run, written out as a JSON report.
+    Safe to share between the GUI, download and process threads.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self.values = {}
+        self.lock = threading.Lock()
+
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """ Time the block as a span, attributes may be added to the yielded dict while it runs. """
+        start = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            ## The innermost span sees the error first, outer spans it passes through keep that name
+            if getattr(e, "metrics_span", None) is None:
+                try:
+                    e.metrics_span = name
+                except AttributeError:
+                    pass
+            raise
+        finally:
+            self.add_span(name, time.perf_counter() - start, start=start, **attributes)
+
+
+    def add_span(self, name, duration, start=None, **attributes):
+        """ Record a span measured elsewhere, e.g. the elapsed time of a response. """
+        start = time.perf_counter() - duration if start is None else start
+        with self.lock:
+            self.spans.append({"name": name,
+                               "start": round(start - self.origin, 6),
+                               "duration": round(duration, 6),
+                               "thread": threading.current_thread().name,
+                               **attributes})
+
+
+    @staticmethod
+    def failed_span(error):
+        """ Innermost span error was raised in, spans are already closed by the time it reaches the top level handler. """
+        return getattr(error, "metrics_span", None)
+
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+
+    def set(self, name, value):
+        with self.lock:
+            self.values[name] = value
+
+
+    def report(self):
+        with self.lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+            values = dict(self.values)
+
+        phases = {}
+        for span in spans:
+            phase = phases.setdefault(span["name"], {"count": 0, "total": 0.0, "max": 0.0})
+            phase["count"] += 1
+            phase["total"] = round(phase["total"] + span["duration"], 6)
+            phase["max"] = max(phase["max"], span["duration"])
+
+        ## Segments overlap, so throughput is over the wall time covered by the transfer spans
+        transfers = [span for span in spans if span["name"] == "transfer"]
+        if transfers and counters.get("bytes_downloaded"):
+            wall = max(span["start"] + span["duration"] for span in transfers) - min(span["start"] for span in transfers)
+            values["throughput_mb_per_s"] = round(counters["bytes_downloaded"] / 1024 / 1024 / wall, 3) if wall else None
+
+        return {"started": self.started,
+                "duration": round(time.perf_counter() - self.origin, 6),
+                "phases": phases,
+                "counters": counters,
+                "values": values,
+                "spans": spans}
+
+
+    def write(self, destination, directory=""):
+        """ destination is "file" (a report in directory), "stdout" or "both". """
+        report = self.report()
+        if destination in ("stdout", "both"):
+            print(json.dumps({"metrics": report}), file=sys.stdout, flush=True)
+        if destination in ("file", "both"):
+            path = os.path.join(directory or ".", f"QUpdateTool_metrics_{int(self.started)}.json")
+            try:
+                with open(path, "w") as file:
+                    json.dump(report, file, indent=4)
+                print(f"Wrote metrics report to {path}")
+            except OSError as e:
+                print(f"Unable to write metrics report {path}: {str(e)}")
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import threading
+from urllib.parse import urlparse
+
+
+class MirrorError(Exception):
+    pass
+
+
+class MirrorStalled(MirrorError):
+    pass
+
+
+def mirror_key(url):
+    """ Scores belong to the host, not the file, so they carry over to the next release. """
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+class MirrorScores():
+    """
+    Latency and throughput seen from every mirror host, persisted between runs.
+    Both are smoothed, failures push a host to the back until it serves well again.
+    """
+
+    def __init__(self,
+                 path: str = "",
+                 smoothing: float = 0.3,
+                 failure_penalty: float = 5.0):
+        self.path = path
+        self.smoothing = smoothing
+        self.failure_penalty = failure_penalty
+        self.scores = {}
+        self.lock = threading.Lock()
+        self.load()
+
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r") as file:
+                self.scores = json.load(file)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable mirror scores {self.path}: {str(e)}")
+
+
+    def save(self):
+        if not self.path:
+            return
+        temp_path = f"{self.path}.tmp"
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(temp_path, "w") as file:
+                    json.dump(self.scores, file)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                print(f"Unable to save mirror scores {self.path}: {str(e)}")
+
+
+    def smooth(self, previous, value):
+        return value if not previous else self.smoothing * value + (1 - self.smoothing) * previous
+
+
+    def entry(self, url):
+        return self.scores.setdefault(mirror_key(url), {"latency": 0.0, "throughput": 0.0, "failures": 0})
+
+
+    def record_probe(self, url, latency):
+        with self.lock:
+            entry = self.entry(url)
+            entry["latency"] = self.smooth(entry["latency"], latency)
+
+
+    def record_transfer(self, url, size, seconds):
+        ## Short transfers are dominated by latency and would make a fast host look slow
+        if size < 1024 * 256 or seconds <= 0:
+            return
+        with self.lock:
+            entry = self.entry(url)
+            entry["throughput"] = self.smooth(entry["throughput"], size / seconds)
+            entry["failures"] = max(0, entry["failures"] - 1)
+
+
+    def record_failure(self, url):
+        with self.lock:
+            self.entry(url)["failures"] += 1
+
+
+    def expected_time(self, url, size=0, latency=None):
+        """ Estimated seconds to fetch size bytes from url, lower is better. """
+        with self.lock:
+            entry = dict(self.scores.get(mirror_key(url), {"latency": 0.0, "throughput": 0.0, "failures": 0}))
+        latency = entry["latency"] if latency is None else latency
+        transfer = size / entry["throughput"] if size and entry["throughput"] else 0
+        return latency + transfer + entry["failures"] * self.failure_penalty
+
+
+    def rank(self, urls, size=0):
+        """ urls ordered best first, unknown hosts keep their configured order. """
+        return sorted(urls, key=lambda url: self.expected_time(url, size))
+
+
+class ThroughputMonitor():
+    """
+    Watches one transfer, raising MirrorStalled from update() when the rate over the last window
+    drops below threshold bytes per second once the grace period is over.
+    """
+
+    def __init__(self,
+                 threshold: float = 0,
+                 grace: float = 5.0,
+                 window: float = 5.0):
+        self.threshold = threshold
+        self.grace = grace
+        self.window = window
+        self.started = time.monotonic()
+        self.window_started = self.started
+        self.window_bytes = 0
+        self.bytes = 0
+
+
+    def update(self, size):
+        self.bytes += size
+        if not self.threshold:
+            return
+        now = time.monotonic()
+        if now - self.started < self.grace or now - self.window_started < self.window:
+            return
+        rate = (self.bytes - self.window_bytes) / (now - self.window_started)
+        if rate < self.threshold:
+            raise MirrorStalled(f"{rate / 1024:.0f} KB/s is below the stall threshold of {self.threshold / 1024:.0f} KB/s")
+        self.window_started = now
+        self.window_bytes = self.bytes
+
+
+    def elapsed(self):
+        return time.monotonic() - self.started
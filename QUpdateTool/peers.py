@@ -0,0 +1,271 @@
+"""
+LAN peer sharing of the download cache.
+
+Every instance with peer sharing on answers multicast queries for the SHA-256 of a blob in its cache
+and serves it over a small HTTP server with Range support. A downloading instance asks the subnet first
+and fetches from a peer that answers, the result is verified against the published hash like any download.
+
+Keep a seed instance serving its cache, e.g. in a lab, with:
+    python peers.py serve [--cache_directory <dir>]
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import socket
+import struct
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from cache import DownloadCache
+
+MULTICAST_GROUP = "239.255.77.77"
+MULTICAST_PORT = 47777
+SHA256_PATH = re.compile(r"^/([0-9a-f]{64})$")
+
+
+class PeerRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def do_HEAD(self):
+        self.send_blob(body=False)
+
+
+    def do_GET(self):
+        self.send_blob(body=True)
+
+
+    def send_blob(self, body=True):
+        match = SHA256_PATH.match(self.path)
+        blob = self.server.node.cache.find_by_hash(match.group(1)) if match else None
+        if not blob:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        sha256 = match.group(1)
+        size = os.path.getsize(blob)
+        start, end = 0, size - 1
+        ranged = self.headers.get("Range", "").startswith("bytes=")
+        if ranged:
+            first, _, last = self.headers["Range"][6:].partition("-")
+            try:
+                start, end = (int(first), min(int(last) if last else size - 1, size - 1)) if first else (size - int(last), size - 1)
+            except ValueError:
+                ranged = False
+            if ranged and not 0 <= start <= end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+        self.send_response(206 if ranged else 200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{sha256}"')
+        self.send_header("Content-Disposition", f'attachment; filename="{self.server.node.filename(sha256)}"')
+        if ranged:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if not body:
+            return
+
+        try:
+            with open(blob, "rb") as file:
+                file.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    data = file.read(min(remaining, 1024 * 256))
+                    if not data:
+                        break
+                    self.wfile.write(data)
+                    remaining -= len(data)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class PeerNode():
+    """
+    Answers multicast queries for blobs in the cache and serves them over HTTP.
+    Queries are {"type": "query", "sha256": ...}, answers and announcements are {"type": "have", "sha256": ..., "url": ...}.
+    """
+
+    def __init__(self,
+                 cache: DownloadCache = None,
+                 group: str = MULTICAST_GROUP,
+                 port: int = MULTICAST_PORT,
+                 http_port: int = 0,
+                 timeout: float = 1.0):
+        self.cache = cache
+        self.group = group
+        self.port = port
+        self.http_port = http_port
+        self.timeout = timeout
+        self.node_id = uuid.uuid4().hex
+        self.http_server = None
+        self.listener = None
+        self.known = {}
+        self.lock = threading.Lock()
+
+
+    def start(self):
+        """ Start serving, returns False if the multicast socket can't be opened (e.g. no network). """
+        try:
+            self.listener = self.open_listener()
+        except OSError as e:
+            print(f"LAN peer sharing disabled: {str(e)}")
+            return False
+
+        self.http_server = ThreadingHTTPServer(("0.0.0.0", self.http_port), PeerRequestHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.node = self
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        threading.Thread(target=self.listen, daemon=True).start()
+        return True
+
+
+    def open_listener(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        ## Several instances on one machine share the port, which is also how this is tested on localhost
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        listener.bind(("", self.port))
+        membership = struct.pack("4s4s", socket.inet_aton(self.group), socket.inet_aton("0.0.0.0"))
+        listener.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        return listener
+
+
+    def create_sender(self):
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        return sender
+
+
+    def filename(self, sha256):
+        ## Called from the HTTP server threads while downloads add to and evict from the same index
+        with self.cache.lock:
+            for entry in self.cache.index["urls"].values():
+                if entry["sha256"] == sha256:
+                    return entry["filename"]
+        return sha256
+
+
+    def local_address(self, remote_address):
+        """ Address of the interface that routes to remote_address, the one the peer can reach us on. """
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            probe.connect(remote_address)
+            return probe.getsockname()[0]
+        except OSError:
+            return "127.0.0.1"
+        finally:
+            probe.close()
+
+
+    def have_message(self, sha256, address):
+        return json.dumps({"type": "have",
+                           "id": self.node_id,
+                           "sha256": sha256,
+                           "size": os.path.getsize(self.cache.blob_path(sha256)),
+                           "url": f"http://{address}:{self.http_server.server_address[1]}/{sha256}"}).encode()
+
+
+    def listen(self):
+        while True:
+            try:
+                data, address = self.listener.recvfrom(4096)
+                message = json.loads(data)
+            except (OSError, ValueError):
+                continue
+            if message.get("id") == self.node_id:
+                continue
+            if message.get("type") == "have" and message.get("url"):
+                with self.lock:
+                    self.known.setdefault(str(message.get("sha256")), {})[message["url"]] = time.monotonic()
+                continue
+            if message.get("type") != "query":
+                continue
+            sha256 = str(message.get("sha256", "")).lower()
+            if self.cache.find_by_hash(sha256):
+                try:
+                    self.listener.sendto(self.have_message(sha256, self.local_address(address)), address)
+                except OSError:
+                    pass
+
+
+    def announce(self, sha256):
+        """ Tell the subnet about a blob that just arrived, instances still waiting on a query pick it up. """
+        if not self.http_server or not self.cache.find_by_hash(sha256):
+            return
+        sender = self.create_sender()
+        try:
+            sender.sendto(self.have_message(sha256, self.local_address((self.group, self.port))), (self.group, self.port))
+        except OSError:
+            pass
+        finally:
+            sender.close()
+
+
+    def find(self, sha256):
+        """ URLs of peers holding sha256, collected for up to timeout seconds. """
+        sha256 = sha256.lower()
+        sender = self.create_sender()
+        urls = []
+        try:
+            sender.sendto(json.dumps({"type": "query", "id": self.node_id, "sha256": sha256}).encode(),
+                          (self.group, self.port))
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                sender.settimeout(max(0.01, deadline - time.monotonic()))
+                try:
+                    message = json.loads(sender.recv(4096))
+                except socket.timeout:
+                    break
+                except ValueError:
+                    continue
+                if message.get("type") == "have" and message.get("sha256") == sha256 and message.get("id") != self.node_id:
+                    urls.append(message["url"])
+                    ## The first answer is usually the closest, give the others a moment to beat it
+                    deadline = min(deadline, time.monotonic() + 0.1)
+        except OSError as e:
+            print(f"Unable to query LAN peers: {str(e)}")
+        finally:
+            sender.close()
+
+        ## Announcements heard recently count as answers too
+        with self.lock:
+            urls += [url for url, heard in self.known.get(sha256, {}).items() if time.monotonic() - heard < 300]
+        return list(dict.fromkeys(urls))
+
+
+    def linger(self, seconds):
+        """ Keep serving neighbours for a while before the process exits. """
+        if self.http_server and seconds > 0:
+            print(f"Sharing the update with LAN peers for {seconds:.0f} seconds...")
+            time.sleep(seconds)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the download cache to LAN peers")
+    parser.add_argument("command", choices=["serve"])
+    parser.add_argument("--cache_directory", type=str, default=DownloadCache.default_directory())
+    parser.add_argument("--peer_port", type=int, default=MULTICAST_PORT)
+    args = parser.parse_args()
+
+    node = PeerNode(DownloadCache(directory=args.cache_directory), port=args.peer_port)
+    if not node.start():
+        sys.exit(1)
+    print(f"Serving {args.cache_directory} to LAN peers on port {node.http_server.server_address[1]}...")
+    while True:
+        time.sleep(3600)
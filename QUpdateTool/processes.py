@@ -0,0 +1,77 @@
+import os
+import psutil
+
+
+class ProcessLocator():
+    """
+    Finds the processes of the software being updated and stops them.
+    A known PID is looked up directly, names go through an index built from a single process scan.
+    """
+
+    def __init__(self,
+                 terminate_timeout: float = 5.0,
+                 kill_timeout: float = 3.0):
+        self.terminate_timeout = terminate_timeout
+        self.kill_timeout = kill_timeout
+        self.index = None
+
+
+    @staticmethod
+    def normalize(name):
+        name = (name or "").lower()
+        return name[:-4] if name.endswith(".exe") else name
+
+
+    def build_index(self):
+        self.index = {}
+        for process in psutil.process_iter(["pid", "name"]):
+            self.index.setdefault(self.normalize(process.info["name"]), []).append(process.info["pid"])
+        return self.index
+
+
+    def find(self, pid=None, name=None):
+        """ The calling PID if it is still alive, otherwise every process matching name. """
+        if pid:
+            try:
+                return [psutil.Process(int(pid))]
+            except (psutil.NoSuchProcess, psutil.AccessDenied, ValueError):
+                pass
+
+        if not name:
+            return []
+        if self.index is None:
+            self.build_index()
+
+        processes = []
+        for match in self.index.get(self.normalize(name), []):
+            if match == os.getpid():
+                continue
+            try:
+                processes.append(psutil.Process(match))
+            except psutil.NoSuchProcess:
+                pass
+        return processes
+
+
+    def terminate(self, processes):
+        """ Ask politely, wait a bounded time, then kill whatever is left. Returns the processes still alive. """
+        for process in processes:
+            try:
+                process.terminate()
+            except psutil.NoSuchProcess:
+                pass
+            except psutil.AccessDenied:
+                print(f"Access denied closing PID {process.pid}")
+
+        gone, alive = psutil.wait_procs(processes, timeout=self.terminate_timeout)
+        if not alive:
+            return []
+
+        print(f"PID(s) {', '.join(str(process.pid) for process in alive)} did not exit, killing...")
+        for process in alive:
+            try:
+                process.kill()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        gone, alive = psutil.wait_procs(alive, timeout=self.kill_timeout)
+        return alive
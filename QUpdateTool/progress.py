@@ -0,0 +1,115 @@
+import sys
+import json
+import time
+import threading
+
+
+class ProgressReporter():
+    """
+    Collects byte counts from every download stream and pushes coalesced snapshots to subscribers.
+    Subscribers are callables taking a snapshot dict, they are called at most max_rate times a second.
+    """
+
+    def __init__(self,
+                 max_rate: float = 20,
+                 smoothing: float = 0.3):
+        self.interval = 1.0 / max_rate
+        self.smoothing = smoothing
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.start()
+
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+
+    def start(self, total=0, initial=0):
+        with self.lock:
+            self.total = total
+            self.n = initial
+            self.started = time.monotonic()
+            self.last_push = 0.0
+            self.last_push_n = initial
+            self.rate = 0.0
+            if self.subscribers:
+                self.push(self.started)
+
+
+    def publish(self, size):
+        """ Cheap enough to call per chunk, the subscribers only run when a push is due. """
+        with self.lock:
+            self.n += size
+            now = time.monotonic()
+            if now - self.last_push >= self.interval:
+                self.push(now)
+
+
+    def close(self):
+        with self.lock:
+            self.push(time.monotonic())
+        for subscriber in self.subscribers:
+            if hasattr(subscriber, "close"):
+                subscriber.close()
+
+
+    def push(self, now):
+        elapsed = now - self.last_push
+        if self.last_push and elapsed > 0:
+            current_rate = (self.n - self.last_push_n) / elapsed
+            self.rate = current_rate if not self.rate else self.smoothing * current_rate + (1 - self.smoothing) * self.rate
+        self.last_push = now
+        self.last_push_n = self.n
+
+        snapshot = self.snapshot(now)
+        for subscriber in self.subscribers:
+            subscriber(snapshot)
+
+
+    def snapshot(self, now):
+        remaining = max(self.total - self.n, 0)
+        return {"unit": "MB",
+                "n": self.n,
+                "total": self.total,
+                "rate": self.rate,
+                "elapsed": now - self.started,
+                "eta": remaining / self.rate if self.rate else None}
+
+
+class TqdmSubscriber():
+    """ Console progress bar fed from ProgressReporter snapshots. """
+
+    def __init__(self, position=None, desc=None):
+        self.position = position
+        self.desc = desc
+        self.progress_bar = None
+
+
+    def __call__(self, snapshot):
+        if self.progress_bar is None or snapshot["total"] != self.progress_bar.total or snapshot["n"] < self.progress_bar.n:
+            from tqdm import tqdm
+            self.close()
+            self.progress_bar = tqdm(total=snapshot["total"], initial=snapshot["n"], unit="B", unit_scale=True,
+                                     position=self.position, desc=self.desc)
+        else:
+            self.progress_bar.update(snapshot["n"] - self.progress_bar.n)
+
+
+    def close(self):
+        if self.progress_bar:
+            self.progress_bar.close()
+            self.progress_bar = None
+
+
+class JsonLinesSubscriber():
+    """ Machine readable progress, one JSON object per line, for deployment tooling. """
+
+    def __init__(self, stream=None, name=None):
+        self.stream = stream or sys.stdout
+        self.name = name
+
+
+    def __call__(self, snapshot):
+        event = {"event": "progress", "name": self.name, **snapshot} if self.name else {"event": "progress", **snapshot}
+        self.stream.write(json.dumps(event) + "\n")
+        self.stream.flush()
@@ -0,0 +1,182 @@
+import os
+import mmap
+import errno
+import threading
+
+
+def preallocate(fd, size):
+    """ Reserve the final size up front so a large installer is laid out in one piece instead of growing write by write. """
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            ## Some filesystems (network shares, tmpfs on older kernels) can't fallocate, a plain resize still works
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+    os.ftruncate(fd, size)
+
+
+def sync_directory(directory):
+    """ fsync a directory so a rename inside it survives a power cut, only possible on POSIX. """
+    if os.name != "posix":
+        return
+    fd = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def commit_file(part_file, final_path):
+    """ Atomically move a closed, synced .part file to its final name. """
+    os.replace(part_file, final_path)
+    sync_directory(os.path.dirname(os.path.abspath(final_path)))
+
+
+class SinkWriter():
+    """ File-like view of a sink for one stream writing sequentially from offset, e.g. one range segment. """
+
+    def __init__(self, sink, offset: int = 0):
+        self.sink = sink
+        self.offset = offset
+
+
+    def write(self, data):
+        written = self.sink.write_at(self.offset, data)
+        self.offset += written
+        return written
+
+
+class OutputSink():
+    """
+    The .part file a download is written to.
+    With a known size the file is preallocated. Every stream writes at its own offset with os.pwrite, so segments
+    never share a file position or a lock. Windows has no pwrite: there a preallocated file is written through a
+    memory map, and seek plus write under a lock is the fallback when the size is unknown or the map fails.
+    Written data is synced to disk every flush_bytes (with auto_flush off the writer is told to, see take_flush)
+    and close() fsyncs, so a file is complete on disk before it is verified and renamed into place.
+    """
+
+    flush_bytes = 1024 * 1024 * 32
+
+    def __init__(self,
+                 path: str = "",
+                 size: int = 0,
+                 resume: bool = False,
+                 flush_bytes: int = None,
+                 use_mmap: bool = None,
+                 auto_flush: bool = True):
+        self.path = path
+        self.size = int(size or 0)
+        self.flush_bytes = flush_bytes or OutputSink.flush_bytes
+        self.auto_flush = auto_flush
+        self.flush_due = False
+        self.lock = threading.Lock()
+        self.unflushed = 0
+        self.position = 0
+        self.appended = False
+        self.map = None
+        self.file = open(path, "r+b" if resume and os.path.isfile(path) else "w+b", buffering=0)
+        try:
+            if self.size:
+                preallocate(self.file.fileno(), self.size)
+        except OSError:
+            self.file.close()
+            raise
+        ## pwrite copies straight into the page cache and measured faster than faulting in the pages of a map
+        if use_mmap is None:
+            use_mmap = not hasattr(os, "pwrite")
+        if self.size and use_mmap:
+            try:
+                self.map = mmap.mmap(self.file.fileno(), self.size)
+            except (OSError, ValueError, OverflowError):
+                ## e.g. no address space for a multi GB map in a 32 bit process
+                self.map = None
+
+
+    def writer(self, offset=0):
+        return SinkWriter(self, offset)
+
+
+    def write(self, data):
+        """ Append after the previous write, the plain file interface used by single streams and patching. """
+        written = self.write_at(self.position, data)
+        self.position += written
+        self.appended = True
+        return written
+
+
+    def write_at(self, offset, data):
+        size = len(data)
+        if self.map is not None and offset + size <= self.size:
+            self.map[offset:offset + size] = data
+        else:
+            self.write_file(offset, data)
+        self.count(size)
+        return size
+
+
+    def write_file(self, offset, data):
+        view = memoryview(data)
+        if hasattr(os, "pwrite"):
+            while view:
+                written = os.pwrite(self.file.fileno(), view, offset)
+                view = view[written:]
+                offset += written
+            return
+        with self.lock:
+            self.file.seek(offset)
+            self.file.write(view)
+
+
+    def count(self, size):
+        with self.lock:
+            self.unflushed += size
+            if self.unflushed < self.flush_bytes:
+                return
+            self.unflushed = 0
+            if not self.auto_flush:
+                self.flush_due = True
+                return
+        self.flush()
+
+
+    def take_flush(self):
+        """ With auto_flush off, True once every flush_bytes: the writer then calls flush() where blocking is fine. """
+        with self.lock:
+            due, self.flush_due = self.flush_due, False
+            return due
+
+
+    def flush(self):
+        if self.map is not None:
+            self.map.flush()
+        else:
+            os.fsync(self.file.fileno())
+
+
+    def close(self):
+        """ Flush and fsync everything written, a stream that ended early leaves the file at its real length. """
+        if self.file.closed:
+            return
+        try:
+            if self.map is not None:
+                self.map.flush()
+                self.map.close()
+                self.map = None
+            if self.appended and self.position != self.size:
+                os.ftruncate(self.file.fileno(), self.position)
+            os.fsync(self.file.fileno())
+        finally:
+            self.file.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, error_type, error, traceback):
+        self.close()
@@ -0,0 +1,80 @@
+import os
+import json
+import time
+
+from cache import DownloadCache
+
+
+class StagedUpdate():
+    """
+    An update downloaded and verified ahead of time by --prefetch, waiting to be installed.
+    stage.json records the artifact (an installer, or an extracted archive directory) and what it was downloaded for,
+    a later run installs it only if it is still the update being asked for and still hashes the same.
+    """
+
+    def __init__(self,
+                 directory: str = ""):
+        self.directory = directory
+        self.record_path = os.path.join(directory, "stage.json")
+
+
+    @staticmethod
+    def default_directory(options):
+        return os.path.join(options.temp_download_directory or ".", "staged", options.software_to_update or "update")
+
+
+    def load(self):
+        try:
+            with open(self.record_path, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable staged update {self.record_path}: {str(e)}")
+            return None
+
+
+    def save(self, path, sha256, options):
+        record = {"path": os.path.abspath(path),
+                  "sha256": sha256,
+                  "download_url": options.download_url,
+                  "expected_sha256": options.expected_sha256,
+                  "install_directory": options.install_directory,
+                  "staged": time.time()}
+        temp_path = f"{self.record_path}.tmp"
+        with open(temp_path, "w") as file:
+            json.dump(record, file, indent=4)
+        os.replace(temp_path, self.record_path)
+        return record
+
+
+    def find(self, options):
+        """ The staged record if it matches options and the artifact is intact, None otherwise. """
+        record = self.load()
+        if not record:
+            return None
+
+        expected_sha256 = (options.expected_sha256 or "").strip().lower()
+        if record["download_url"] != options.download_url or (expected_sha256 and record["sha256"] != expected_sha256):
+            print("Staged update is not the one requested, discarding it...")
+            self.clear()
+            return None
+        if (record.get("install_directory") or "") != (options.install_directory or ""):
+            print("Staged update was extracted for another install directory, discarding it...")
+            self.clear()
+            return None
+
+        path = record["path"]
+        if os.path.isdir(path):
+            return record
+        if not os.path.isfile(path) or DownloadCache.hash_file(path) != record["sha256"]:
+            print("Staged update is missing or changed since it was verified, discarding it...")
+            self.clear()
+            return None
+        return record
+
+
+    def clear(self):
+        """ Forget the staged update, the artifact itself is replaced by the next prefetch. """
+        if os.path.exists(self.record_path):
+            os.remove(self.record_path)
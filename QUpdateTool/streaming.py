@@ -0,0 +1,52 @@
+import time
+
+
+class StreamEngine():
+    """ Copies a response body to a file through one reusable buffer, sizing reads to the measured throughput. """
+
+    min_chunk_size = 1024 * 64
+    max_chunk_size = 1024 * 1024 * 4
+    target_read_time = 0.25
+
+    def __init__(self,
+                 min_chunk_size: int = None,
+                 max_chunk_size: int = None):
+        self.min_chunk_size = min_chunk_size or StreamEngine.min_chunk_size
+        self.max_chunk_size = max(self.min_chunk_size, max_chunk_size or StreamEngine.max_chunk_size)
+        self.chunk_size = self.min_chunk_size
+        self.buffer = bytearray(self.max_chunk_size)
+        self.view = memoryview(self.buffer)
+
+
+    def copy(self, source, file, on_chunk=None, abort=None, read_size=None):
+        """
+        Read from source with readinto() and write the filled part of the buffer straight to file.
+        on_chunk is called with a memoryview of every chunk, it is only valid until the next read.
+        read_size, if given, caps every read (called with the adaptive size, e.g. Throttle.read_size).
+        Returns the number of bytes copied.
+        """
+        copied = 0
+        while not (abort and abort.is_set()):
+            size = read_size(self.chunk_size) if read_size else self.chunk_size
+            started = time.perf_counter()
+            count = source.readinto(self.view[:size])
+            if not count:
+                break
+            elapsed = time.perf_counter() - started
+
+            chunk = self.view[:count]
+            file.write(chunk)
+            if on_chunk:
+                on_chunk(chunk)
+            copied += count
+            self.adapt_chunk_size(count, size, elapsed)
+
+        return copied
+
+
+    def adapt_chunk_size(self, count, size, elapsed):
+        """ Grow the chunk while full reads come back fast, shrink it when a read takes too long. """
+        if count == size and elapsed < self.target_read_time / 2:
+            self.chunk_size = min(self.chunk_size * 2, self.max_chunk_size)
+        elif elapsed > self.target_read_time * 2:
+            self.chunk_size = max(self.chunk_size // 2, self.min_chunk_size)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+## The modules are flat files next to QUpdateTool.py, the same way the tool and the benchmarks import them
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,67 @@
+import os
+
+from cache import DownloadCache
+
+
+def add_file(tmp_path, cache, name="update.exe", data=None):
+    path = tmp_path / name
+    path.write_bytes(data or os.urandom(1000))
+    return cache.add(f"http://example.com/{name}", str(path), etag='"v1"')
+
+
+def test_lookup_and_materialize(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"))
+    sha256 = add_file(tmp_path, cache)
+    entry = cache.lookup("http://example.com/update.exe")
+    assert entry["sha256"] == sha256 and entry["etag"] == '"v1"'
+
+    destination = cache.materialize(sha256, str(tmp_path / "copy.exe"))
+    assert DownloadCache.hash_file(destination) == sha256
+
+
+def test_discard_drops_the_blob_and_its_urls(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"))
+    sha256 = add_file(tmp_path, cache)
+    cache.discard(sha256)
+    assert cache.lookup("http://example.com/update.exe") is None
+    assert not os.path.exists(cache.blob_path(sha256))
+    assert DownloadCache(str(tmp_path / "cache")).find_by_hash(sha256) is None
+
+
+def test_eviction_keeps_the_newest_blob(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"), max_size=1500)
+    first = add_file(tmp_path, cache, "first.exe")
+    second = add_file(tmp_path, cache, "second.exe")
+    assert cache.find_by_hash(first) is None
+    assert cache.find_by_hash(second)
+    assert cache.lookup("http://example.com/first.exe") is None
+
+
+def test_modified_cache_hit_is_downloaded_again(tmp_path):
+    from engines import create_engine
+    from benchmarks.range_server import RangeServer
+
+    served = tmp_path / "served"
+    served.mkdir()
+    data = os.urandom(1024 * 256)
+    (served / "update.exe").write_bytes(data)
+    download_location = tmp_path / "download"
+    download_location.mkdir()
+
+    server = RangeServer(str(served)).start()
+    options = {"engine": "asyncio", "api_endpoint": f"{server.url}/update.exe", "download_location": str(download_location)}
+    try:
+        engine = create_engine(cache=DownloadCache(str(tmp_path / "cache")), **options)
+        assert engine.run() == "Downloaded update successfully!"
+        assert create_engine(cache=DownloadCache(str(tmp_path / "cache")), **options).run() == "Update loaded from the local cache!"
+
+        ## Written in place, so a hardlinked blob changes with it
+        with open(engine.output_file, "r+b") as file:
+            file.write(b"tampered")
+        engine = create_engine(cache=DownloadCache(str(tmp_path / "cache")), **options)
+        assert engine.run() == "Downloaded update successfully!"
+    finally:
+        server.shutdown()
+        server.server_close()
+    with open(engine.output_file, "rb") as file:
+        assert file.read() == data
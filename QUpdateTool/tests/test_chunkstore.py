@@ -0,0 +1,70 @@
+import os
+import json
+import hashlib
+
+import pytest
+
+from chunkstore import ChunkStore, make_index
+from verify import VerificationError
+
+
+def test_add_checks_the_hash(tmp_path):
+    store = ChunkStore(str(tmp_path))
+    store.add(hashlib.sha256(b"chunk").hexdigest(), b"chunk")
+    with pytest.raises(VerificationError):
+        store.add(hashlib.sha256(b"other").hexdigest(), b"chunk")
+    assert store.has(hashlib.sha256(b"chunk").hexdigest())
+
+
+def test_flush_indexes_and_bounds_the_stored_chunks(tmp_path):
+    store = ChunkStore(str(tmp_path), max_size=2000)
+    chunks = [os.urandom(1000) for _ in range(3)]
+    for data in chunks:
+        store.add(hashlib.sha256(data).hexdigest(), data)
+    store.flush()
+
+    loaded = ChunkStore(str(tmp_path))
+    assert sum(chunk["size"] for chunk in loaded.chunks.values()) <= 2000
+    assert all(os.path.isfile(loaded.chunk_path(sha256)) for sha256 in loaded.chunks)
+    assert len(loaded.chunks) == 2
+
+
+def test_assemble_writes_every_chunk_at_its_offset(tmp_path):
+    data = os.urandom(1024 * 512)
+    (tmp_path / "update.exe").write_bytes(data)
+    index = make_index(str(tmp_path / "update.exe"))
+    store = ChunkStore(str(tmp_path / "chunks"))
+    for chunk in index["chunks"]:
+        store.add(chunk["sha256"], data[chunk["offset"]:chunk["offset"] + chunk["size"]])
+
+    part_file = str(tmp_path / "assembled.exe.part")
+    store.assemble(index["chunks"], part_file, index["size"])
+    with open(part_file, "rb") as file:
+        assert file.read() == data
+
+
+def test_failed_chunk_download_keeps_the_stored_chunks(tmp_path):
+    from engines import create_engine
+    from benchmarks.range_server import RangeServer
+
+    served = tmp_path / "served"
+    served.mkdir()
+    data = os.urandom(1024 * 1024)
+    (served / "update.exe").write_bytes(data)
+    index = make_index(str(served / "update.exe"))
+    ## The last chunk can never be stored, the ones before it are
+    index["chunks"][-1]["sha256"] = "0" * 64
+    (served / "update.json").write_text(json.dumps(index))
+
+    server = RangeServer(str(served)).start()
+    try:
+        store = ChunkStore(str(tmp_path / "chunks"))
+        engine = create_engine(engine="asyncio", api_endpoint=f"{server.url}/update.exe", download_location=str(tmp_path),
+                               chunk_store=store, chunk_index_url=f"{server.url}/update.json")
+        assert engine.run() == "Downloaded update successfully!"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    loaded = ChunkStore(str(tmp_path / "chunks"))
+    assert set(loaded.chunks) == {chunk["sha256"] for chunk in index["chunks"][:-1]}
@@ -0,0 +1,167 @@
+import io
+import os
+import struct
+
+import pytest
+
+from delta import MAGIC, OP_END, OP_COPY, OP_INSERT, COPY_FORMAT, INSERT_FORMAT, PatchError, make_patch, apply_patch
+
+
+def copy(offset, length):
+    return bytes([OP_COPY]) + struct.pack(COPY_FORMAT, offset, length)
+
+
+def insert(data):
+    return bytes([OP_INSERT]) + struct.pack(INSERT_FORMAT, len(data)) + data
+
+
+def apply(base_path, *operations, block_size=1024 * 1024):
+    output = io.BytesIO()
+    chunks = []
+    written = apply_patch(str(base_path), io.BytesIO(MAGIC + b"".join(operations) + bytes([OP_END])), output,
+                          on_chunk=chunks.append, block_size=block_size)
+    assert written == len(output.getvalue()) == sum(len(chunk) for chunk in chunks)
+    return output.getvalue()
+
+
+@pytest.fixture
+def base_path(tmp_path):
+    path = tmp_path / "base.exe"
+    path.write_bytes(bytes(range(256)) * 4)
+    return path
+
+
+def test_copy_whole_base(base_path):
+    assert apply(base_path, copy(0, 1024)) == base_path.read_bytes()
+
+
+def test_copy_first_and_last_byte(base_path):
+    base = base_path.read_bytes()
+    assert apply(base_path, copy(0, 1), copy(1023, 1)) == base[:1] + base[-1:]
+
+
+def test_copy_across_read_blocks(base_path):
+    base = base_path.read_bytes()
+    assert apply(base_path, copy(5, 1000), block_size=64) == base[5:1005]
+
+
+def test_insert_at_start_middle_and_end(base_path):
+    base = base_path.read_bytes()
+    result = apply(base_path, insert(b"head"), copy(0, 10), insert(b"middle"), copy(10, 1014), insert(b"tail"))
+    assert result == b"head" + base[:10] + b"middle" + base[10:] + b"tail"
+
+
+def test_empty_insert_and_empty_patch(base_path):
+    assert apply(base_path, insert(b"")) == b""
+    assert apply(base_path) == b""
+
+
+def test_copy_past_the_end_of_the_base(base_path):
+    with pytest.raises(PatchError):
+        apply(base_path, copy(1000, 25))
+    with pytest.raises(PatchError):
+        apply(base_path, copy(1024, 1))
+
+
+def test_truncated_and_foreign_patches(base_path):
+    with pytest.raises(PatchError):
+        apply_patch(str(base_path), io.BytesIO(MAGIC + insert(b"data")[:-1]), io.BytesIO())
+    with pytest.raises(PatchError):
+        apply_patch(str(base_path), io.BytesIO(MAGIC + copy(0, 1)), io.BytesIO())
+    with pytest.raises(PatchError):
+        apply_patch(str(base_path), io.BytesIO(b"NOTAPATCH" + bytes([OP_END])), io.BytesIO())
+    with pytest.raises(PatchError):
+        apply_patch(str(base_path), io.BytesIO(MAGIC + bytes([9])), io.BytesIO())
+
+
+def test_make_patch_round_trip(tmp_path):
+    base = os.urandom(64 * 1024)
+    new = base[:10000] + b"changed" + base[10000:40000] + os.urandom(5000) + base[50000:]
+    (tmp_path / "base.exe").write_bytes(base)
+    (tmp_path / "new.exe").write_bytes(new)
+    make_patch(str(tmp_path / "base.exe"), str(tmp_path / "new.exe"), str(tmp_path / "update.patch"), block_size=1024)
+
+    output = io.BytesIO()
+    with open(tmp_path / "update.patch", "rb") as patch:
+        apply_patch(str(tmp_path / "base.exe"), patch, output)
+    assert output.getvalue() == new
+    ## Most of the new file is copied from the base rather than carried in the patch
+    assert os.path.getsize(tmp_path / "update.patch") < len(new) // 4
+
+
+@pytest.fixture
+def release(tmp_path):
+    """ Served directory with a new release, its patch from version 1.0 and the manifest, plus the installed base. """
+    import json
+    import hashlib
+    served = tmp_path / "served"
+    served.mkdir()
+    base = os.urandom(256 * 1024)
+    new = base[:100000] + os.urandom(64 * 1024) + base[100000:]
+    (tmp_path / "base.exe").write_bytes(base)
+    (served / "update.exe").write_bytes(new)
+    make_patch(str(tmp_path / "base.exe"), str(served / "update.exe"), str(served / "update.patch"), block_size=1024)
+    (served / "delta.json").write_text(json.dumps({"from": "1.0", "patch_url": "update.patch", "filename": "update.exe",
+                                                   "base_sha256": hashlib.sha256(base).hexdigest(),
+                                                   "result_sha256": hashlib.sha256(new).hexdigest(),
+                                                   "result_size": len(new)}))
+    return served, new
+
+
+def delta_engine(tmp_path, server, reporter=None):
+    from engines import create_engine
+    download_location = tmp_path / "download"
+    download_location.mkdir(exist_ok=True)
+    return create_engine(engine="asyncio", api_endpoint=f"{server.url}/update.exe", download_location=str(download_location),
+                         current_version="1.0", delta_manifest_url=f"{server.url}/delta.json",
+                         delta_base_path=str(tmp_path / "base.exe"), reporter=reporter)
+
+
+def test_patch_transfer_reports_progress(tmp_path, release):
+    from progress import ProgressReporter
+    from benchmarks.range_server import RangeServer
+
+    served, new = release
+    snapshots = []
+    reporter = ProgressReporter()
+    reporter.subscribe(snapshots.append)
+    server = RangeServer(str(served)).start()
+    try:
+        engine = delta_engine(tmp_path, server, reporter)
+        assert engine.run() == "Downloaded update successfully! (patched from the installed version)"
+    finally:
+        server.shutdown()
+        server.server_close()
+    patch_size = os.path.getsize(served / "update.patch")
+    assert any(snapshot["total"] == patch_size and snapshot["n"] == patch_size for snapshot in snapshots)
+    with open(engine.output_file, "rb") as file:
+        assert file.read() == new
+
+
+def test_failed_patch_download_leaves_no_partial_patch(tmp_path, release):
+    from benchmarks.range_server import RangeServer, RangeRequestHandler
+
+    class TruncatingHandler(RangeRequestHandler):
+        """ Announces the whole patch but closes the connection after part of it. """
+        def do_GET(self):
+            if not self.path.endswith(".patch"):
+                return super(TruncatingHandler, self).do_GET()
+            data = (self.server.directory_path / "update.patch").read_bytes()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data[:len(data) // 2])
+            self.close_connection = True
+
+    served, new = release
+    server = RangeServer(str(served), handler=TruncatingHandler).start()
+    server.directory_path = served
+    try:
+        engine = delta_engine(tmp_path, server)
+        assert engine.run() == "Downloaded update successfully!"
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert not (tmp_path / "download" / "update.exe.patch").exists()
+    with open(engine.output_file, "rb") as file:
+        assert file.read() == new
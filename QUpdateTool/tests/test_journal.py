@@ -0,0 +1,117 @@
+from journal import DownloadJournal
+
+
+def create_journal(tmp_path, total_size=1000):
+    part_file = tmp_path / "update.exe.part"
+    part_file.write_bytes(b"")
+    journal = DownloadJournal(str(part_file))
+    journal.reset("http://example.com/update.exe", '"v1"', "", total_size)
+    return journal
+
+
+def test_missing_ranges_of_a_new_download(tmp_path):
+    journal = create_journal(tmp_path)
+    assert journal.missing_ranges() == [(0, 999)]
+    assert journal.completed_bytes() == 0
+
+
+def test_adjacent_ranges_merge(tmp_path):
+    journal = create_journal(tmp_path)
+    journal.add_range(0, 99)
+    journal.add_range(100, 199)
+    journal.add_range(500, 599)
+    assert journal.completed == [(0, 199), (500, 599)]
+    assert journal.missing_ranges() == [(200, 499), (600, 999)]
+    assert journal.completed_bytes() == 300
+
+
+def test_overlapping_and_out_of_order_ranges(tmp_path):
+    journal = create_journal(tmp_path)
+    journal.add_range(900, 999)
+    journal.add_range(0, 49)
+    journal.add_range(40, 120)
+    assert journal.missing_ranges() == [(121, 899)]
+    assert journal.completed_bytes() == 221
+
+
+def test_complete_download_has_nothing_missing(tmp_path):
+    journal = create_journal(tmp_path)
+    journal.add_range(0, 999)
+    assert journal.missing_ranges() == []
+    assert journal.completed_bytes() == 1000
+
+
+def test_save_and_load_round_trip(tmp_path):
+    journal = create_journal(tmp_path)
+    journal.add_range(0, 99)
+    journal.add_range(300, 399)
+    journal.save(force=True)
+
+    loaded = DownloadJournal(journal.part_file)
+    assert loaded.load()
+    assert loaded.matches("http://example.com/update.exe", '"v1"', "", 1000)
+    assert loaded.completed == [(0, 99), (300, 399)]
+    assert loaded.missing_ranges() == journal.missing_ranges()
+    assert loaded.completed_bytes() == 200
+
+
+def test_changed_file_does_not_match(tmp_path):
+    journal = create_journal(tmp_path)
+    journal.save(force=True)
+    loaded = DownloadJournal(journal.part_file)
+    assert loaded.load()
+    assert not loaded.matches("http://example.com/update.exe", '"v2"', "", 1000)
+    assert not loaded.matches("http://example.com/update.exe", '"v1"', "", 2000)
+    assert not loaded.matches("http://example.com/update.exe", "", "", 1000)
+
+
+def test_removed_journal_is_not_saved_again(tmp_path):
+    journal = create_journal(tmp_path)
+    journal.remove()
+    journal.add_range(0, 99)
+    journal.save(force=True)
+    assert not (tmp_path / "update.exe.part.json").exists()
+    assert not DownloadJournal(journal.part_file).load()
+
+
+def test_fallback_to_a_single_stream_discards_the_journal(tmp_path):
+    import time
+    from engines import create_engine
+    from benchmarks.range_server import RangeServer, RangeRequestHandler, generated_bytes
+
+    size = 1024 * 1024 * 16
+
+    class BrokenHandler(RangeRequestHandler):
+        """ Refuses every segment but the first, then cuts the full download short after 1 MiB. """
+        def do_GET(self):
+            if not self.server.broken:
+                return super(BrokenHandler, self).do_GET()
+            if self.headers.get("Range", "bytes=0-").startswith("bytes=0-"):
+                if "Range" in self.headers:
+                    return super(BrokenHandler, self).do_GET()
+                self.send_response(200)
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                self.wfile.write(bytes(next(generated_bytes(0, 1024 * 1024))))
+                self.close_connection = True
+                return
+            ## Give the first segment time to record some ranges in the journal
+            time.sleep(0.2)
+            self.send_error(404)
+
+    server = RangeServer(str(tmp_path), handler=BrokenHandler).start()
+    server.broken = True
+    options = {"api_endpoint": f"{server.url}/generated/{size}", "download_location": str(tmp_path),
+               "engine": "asyncio", "segments": 4}
+    try:
+        assert create_engine(**options).run().startswith("Error downloading file")
+        assert not (tmp_path / f"{size}.part.json").exists()
+
+        server.broken = False
+        engine = create_engine(**options)
+        assert engine.run() == "Downloaded update successfully!"
+    finally:
+        server.shutdown()
+        server.server_close()
+    with open(engine.output_file, "rb") as file:
+        assert file.read() == b"".join(bytes(data) for data in generated_bytes(0, size))
@@ -0,0 +1,108 @@
+import pytest
+
+import mirrors
+from mirrors import MirrorScores, MirrorStalled, ThroughputMonitor, mirror_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ time.monotonic of the mirrors module, advanced by hand. """
+    now = [1000.0]
+    monkeypatch.setattr(mirrors.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_scores_belong_to_the_host():
+    assert mirror_key("https://cdn.example.com:8443/releases/update.exe?x=1") == "https://cdn.example.com:8443"
+
+
+def test_unknown_mirrors_keep_their_order():
+    scores = MirrorScores()
+    urls = ["http://b.example.com/u.exe", "http://a.example.com/u.exe", "http://c.example.com/u.exe"]
+    assert scores.rank(urls, size=1024 * 1024) == urls
+
+
+def test_faster_mirror_ranks_first_for_large_files():
+    scores = MirrorScores()
+    slow, fast = "http://slow.example.com/u.exe", "http://fast.example.com/u.exe"
+    scores.record_probe(slow, 0.01)
+    scores.record_probe(fast, 0.05)
+    scores.record_transfer(slow, 1024 * 1024, 1.0)
+    scores.record_transfer(fast, 1024 * 1024 * 10, 1.0)
+    assert scores.rank([slow, fast], size=1024 * 1024 * 100) == [fast, slow]
+    ## Without a size only the latency counts
+    assert scores.rank([fast, slow]) == [slow, fast]
+
+
+def test_short_transfers_are_not_scored():
+    scores = MirrorScores()
+    scores.record_transfer("http://a.example.com/u.exe", 1024, 0.5)
+    scores.record_transfer("http://a.example.com/u.exe", 1024 * 1024, 0)
+    assert scores.scores == {}
+
+
+def test_samples_are_smoothed():
+    scores = MirrorScores(smoothing=0.5)
+    scores.record_probe("http://a.example.com/u.exe", 0.1)
+    scores.record_probe("http://a.example.com/u.exe", 0.3)
+    assert scores.scores["http://a.example.com"]["latency"] == pytest.approx(0.2)
+
+
+def test_failures_push_a_mirror_back_until_it_serves_again():
+    scores = MirrorScores(failure_penalty=5.0)
+    flaky, steady = "http://flaky.example.com/u.exe", "http://steady.example.com/u.exe"
+    scores.record_failure(flaky)
+    assert scores.rank([flaky, steady]) == [steady, flaky]
+    assert scores.expected_time(flaky) == pytest.approx(5.0)
+
+    scores.record_transfer(flaky, 1024 * 1024, 1.0)
+    assert scores.scores["http://flaky.example.com"]["failures"] == 0
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = tmp_path / "cache" / "mirrors.json"
+    scores = MirrorScores(path=str(path))
+    scores.record_probe("http://a.example.com/u.exe", 0.2)
+    scores.record_failure("http://b.example.com/u.exe")
+    scores.save()
+    assert MirrorScores(path=str(path)).scores == scores.scores
+
+
+def test_unreadable_scores_are_ignored(tmp_path):
+    path = tmp_path / "mirrors.json"
+    path.write_text("{not json")
+    assert MirrorScores(path=str(path)).scores == {}
+
+
+def test_monitor_without_threshold_only_counts(clock):
+    monitor = ThroughputMonitor()
+    clock[0] += 60
+    monitor.update(1)
+    assert monitor.bytes == 1
+    assert monitor.elapsed() == 60
+
+
+def test_slow_start_is_forgiven_during_the_grace_period(clock):
+    monitor = ThroughputMonitor(threshold=1024, grace=5.0, window=1.0)
+    clock[0] += 4
+    monitor.update(1)
+
+
+def test_stall_is_raised_once_a_window_is_too_slow(clock):
+    monitor = ThroughputMonitor(threshold=1024, grace=2.0, window=2.0)
+    clock[0] += 2
+    monitor.update(4096)
+    clock[0] += 1
+    ## Half a window is not judged yet
+    monitor.update(10)
+    clock[0] += 1
+    with pytest.raises(MirrorStalled):
+        monitor.update(10)
+
+
+def test_fast_windows_pass(clock):
+    monitor = ThroughputMonitor(threshold=1024, grace=1.0, window=1.0)
+    for _ in range(5):
+        clock[0] += 1
+        monitor.update(4096)
+    assert monitor.bytes == 4096 * 5
@@ -0,0 +1,58 @@
+import sys
+
+import pytest
+
+import QUpdateTool as updater
+
+
+@pytest.fixture
+def tool(monkeypatch):
+    ## The constructor runs the whole tool, only the option handling is under test here
+    monkeypatch.setattr(updater.QUpdateTool, "main", lambda self: None)
+    return updater.QUpdateTool()
+
+
+def options(tool, monkeypatch, tmp_path, config_text, *argv):
+    config_path = tmp_path / "update.ini"
+    config_path.write_text(config_text)
+    monkeypatch.setattr(sys, "argv", ["QUpdateTool.py", "--config", str(config_path), *argv])
+    args, _ = tool.parse_arguments()
+    config = tool.load_config(args.config)
+    return tool.merge_config_and_args(config, args), tool.build_jobs(config, args)
+
+
+def test_updater_section_beats_defaults(tool, monkeypatch, tmp_path):
+    merged, _ = options(tool, monkeypatch, tmp_path, "[Updater]\nnoGUI = True\nrun_after_download = False\n")
+    assert merged.noGUI is True
+    assert merged.run_after_download is False
+    assert merged.run_installer_as_admin is True
+
+
+def test_defaults_without_config_or_flags(tool, monkeypatch, tmp_path):
+    merged, jobs = options(tool, monkeypatch, tmp_path, "[Updater]\n")
+    assert merged.noGUI is False
+    assert merged.run_after_download is True
+    assert merged.download_segments == 4
+    assert jobs == []
+
+
+def test_command_line_beats_updater_section(tool, monkeypatch, tmp_path):
+    merged, _ = options(tool, monkeypatch, tmp_path, "[Updater]\nrun_after_download = False\ndownload_segments = 2\n",
+                        "--run_after_download", "--download_segments", "8")
+    assert merged.run_after_download is True
+    assert merged.download_segments == 8
+
+
+def test_product_section_precedence(tool, monkeypatch, tmp_path):
+    config_text = ("[Updater]\ndownload_segments = 2\nrun_after_download = False\nmax_bandwidth = 5M\n"
+                   "[Updater:First]\ndownload_segments = 6\nrun_after_download = True\n"
+                   "[Updater:Second]\nsoftware_to_update = Second App\n")
+    _, jobs = options(tool, monkeypatch, tmp_path, config_text)
+    first, second = jobs
+    assert (first.name, first.software_to_update, second.software_to_update) == ("First", "First", "Second App")
+    assert first.download_segments == "6" and first.run_after_download is True and first.max_bandwidth == "5M"
+    assert second.download_segments == "2" and second.run_after_download is False
+
+    _, jobs = options(tool, monkeypatch, tmp_path, config_text, "--download_segments", "8", "--no-run_after_download")
+    assert [job.download_segments for job in jobs] == [8, 8]
+    assert [job.run_after_download for job in jobs] == [False, False]
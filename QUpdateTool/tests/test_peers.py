@@ -0,0 +1,41 @@
+import os
+import threading
+
+from cache import DownloadCache
+from peers import PeerNode
+
+
+def test_filename_of_a_cached_blob(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"))
+    (tmp_path / "update.exe").write_bytes(b"installer")
+    sha256 = cache.add("http://example.com/update.exe", str(tmp_path / "update.exe"))
+    node = PeerNode(cache)
+    assert node.filename(sha256) == "update.exe"
+    assert node.filename("0" * 64) == "0" * 64
+
+
+def test_filename_while_the_cache_changes(tmp_path):
+    cache = DownloadCache(str(tmp_path / "cache"), max_size=1024 * 1024)
+    node = PeerNode(cache)
+    stop = threading.Event()
+    errors = []
+
+    def lookup():
+        while not stop.is_set():
+            try:
+                node.filename("0" * 64)
+            except RuntimeError as e:
+                errors.append(e)
+                return
+
+    reader = threading.Thread(target=lookup)
+    reader.start()
+    try:
+        for index in range(300):
+            path = tmp_path / f"update-{index}.exe"
+            path.write_bytes(os.urandom(64))
+            cache.add(f"http://example.com/update-{index}.exe", str(path))
+    finally:
+        stop.set()
+        reader.join()
+    assert not errors
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+import sink
+from sink import OutputSink, commit_file
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    """ Count the fsync calls of the sink without giving up the real one. """
+    calls = []
+    fsync = os.fsync
+    def counted(fd):
+        calls.append(fd)
+        fsync(fd)
+    monkeypatch.setattr(os, "fsync", counted)
+    return calls
+
+
+def test_known_size_is_preallocated(tmp_path):
+    path = tmp_path / "update.exe.part"
+    with OutputSink(str(path), 1024 * 1024):
+        assert os.path.getsize(path) == 1024 * 1024
+
+
+def test_streams_write_at_their_own_offsets(tmp_path):
+    path = tmp_path / "update.exe.part"
+    with OutputSink(str(path), 8) as output:
+        output.writer(4).write(b"5678")
+        output.writer(0).write(b"1234")
+    assert path.read_bytes() == b"12345678"
+
+
+def test_synced_every_flush_bytes_and_on_close(tmp_path, fsyncs):
+    output = OutputSink(str(tmp_path / "update.exe.part"), 3500, flush_bytes=1000)
+    for offset in range(0, 3500, 500):
+        output.write_at(offset, b"x" * 500)
+    assert len(fsyncs) == 3
+    output.close()
+    assert len(fsyncs) == 4
+
+
+def test_without_auto_flush_the_writer_is_told_to_flush(tmp_path, fsyncs):
+    output = OutputSink(str(tmp_path / "update.exe.part"), 2000, flush_bytes=1000, auto_flush=False)
+    output.write_at(0, b"x" * 500)
+    assert not output.take_flush()
+    output.write_at(500, b"x" * 500)
+    assert not fsyncs
+    assert output.take_flush()
+    assert not output.take_flush()
+    output.close()
+
+
+def test_mapped_sink_writes_the_same_file(tmp_path):
+    path = tmp_path / "update.exe.part"
+    with OutputSink(str(path), 8, use_mmap=True) as output:
+        assert output.map is not None
+        output.writer(4).write(b"5678")
+        output.writer(0).write(b"1234")
+    assert path.read_bytes() == b"12345678"
+
+
+def test_stream_that_ends_early_is_truncated(tmp_path):
+    path = tmp_path / "update.exe.part"
+    with OutputSink(str(path), 1000) as output:
+        output.write(b"short")
+    assert path.read_bytes() == b"short"
+
+
+def test_commit_file_replaces_and_syncs_the_directory(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(sink, "sync_directory", synced.append)
+    part = tmp_path / "update.exe.part"
+    final = tmp_path / "update.exe"
+    part.write_bytes(b"new")
+    final.write_bytes(b"old")
+    commit_file(str(part), str(final))
+    assert final.read_bytes() == b"new"
+    assert not part.exists()
+    assert synced == [str(tmp_path)]
+
+
+def test_failed_commit_keeps_the_part_file(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(sink, "sync_directory", synced.append)
+    part = tmp_path / "update.exe.part"
+    part.write_bytes(b"new")
+    final = tmp_path / "update.exe"
+    final.mkdir()
+    (final / "locked").write_bytes(b"")
+    with pytest.raises(OSError):
+        commit_file(str(part), str(final))
+    assert part.read_bytes() == b"new"
+    assert not synced
@@ -0,0 +1,124 @@
+import os
+import sys
+import argparse
+import hashlib
+
+import pytest
+
+import QUpdateTool as updater
+from staging import StagedUpdate
+
+
+def stage_options(**options):
+    return argparse.Namespace(**{"download_url": "http://example.com/update.exe", "expected_sha256": "",
+                                 "install_directory": "", **options})
+
+
+@pytest.fixture
+def staged(tmp_path):
+    """ A stage holding a verified installer, returns (stage, installer path, sha256). """
+    stage = StagedUpdate(str(tmp_path))
+    path = tmp_path / "update.exe"
+    path.write_bytes(b"installer")
+    sha256 = hashlib.sha256(b"installer").hexdigest()
+    stage.save(str(path), sha256, stage_options())
+    return stage, path, sha256
+
+
+def test_staged_update_is_found(staged):
+    stage, path, sha256 = staged
+    record = stage.find(stage_options(expected_sha256=sha256.upper()))
+    assert record["path"] == str(path) and record["sha256"] == sha256
+
+
+@pytest.mark.parametrize("options", [{"download_url": "http://example.com/update-2.exe"},
+                                     {"expected_sha256": "0" * 64},
+                                     {"install_directory": "/opt/app"}])
+def test_stale_stage_is_discarded(staged, options):
+    stage, _, _ = staged
+    assert stage.find(stage_options(**options)) is None
+    assert stage.load() is None
+
+
+def test_changed_artifact_is_discarded(staged):
+    stage, path, _ = staged
+    path.write_bytes(b"tampered!")
+    assert stage.find(stage_options()) is None
+    assert stage.load() is None
+
+
+def test_extracted_directory_is_not_hashed(tmp_path):
+    stage = StagedUpdate(str(tmp_path))
+    (tmp_path / "app.staging").mkdir()
+    stage.save(str(tmp_path / "app.staging"), "", stage_options(install_directory="/opt/app"))
+    assert stage.find(stage_options(install_directory="/opt/app"))["path"] == str(tmp_path / "app.staging")
+
+
+@pytest.fixture
+def tool(monkeypatch, tmp_path):
+    """ The tool with its options parsed from argv, the process check and the installer replaced by recorders. """
+    monkeypatch.setattr(updater.QUpdateTool, "main", lambda self: None)
+    tool = updater.QUpdateTool()
+    tool.installed = []
+    monkeypatch.setattr(tool, "start_process_check", lambda jobs=None: None)
+    monkeypatch.setattr(tool, "run_installer", lambda path, wait=False, options=None: tool.installed.append(path) or 0)
+
+    def parse(*argv):
+        (tmp_path / "update.ini").write_text("[Updater]\n")
+        monkeypatch.setattr(sys, "argv", ["QUpdateTool.py", "--config", str(tmp_path / "update.ini"),
+                                          "--software-to-update", "StagedApp", "--temp_download_directory", str(tmp_path),
+                                          "--download_engine", "asyncio", "--no-use_cache", "--progress_json", *argv])
+        args, _ = tool.parse_arguments()
+        tool.merged_args = tool.merge_config_and_args(tool.load_config(args.config), args)
+    tool.parse = parse
+    return tool
+
+
+@pytest.fixture
+def server(tmp_path):
+    from benchmarks.range_server import RangeServer
+    served = tmp_path / "served"
+    served.mkdir()
+    (served / "update.exe").write_bytes(b"installer" * 1000)
+    server = RangeServer(str(served)).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_prefetch_stages_then_apply_installs(tool, server):
+    sha256 = hashlib.sha256(b"installer" * 1000).hexdigest()
+    tool.parse("--download_url", f"{server.url}/update.exe", "--expected_sha256", sha256, "--prefetch")
+    with pytest.raises(SystemExit) as exit:
+        tool.prefetch_update()
+    assert exit.value.code == 0
+    stage = StagedUpdate(StagedUpdate.default_directory(tool.merged_args))
+    record = stage.load()
+    assert record["sha256"] == sha256 and os.path.dirname(record["path"]) == stage.directory
+    assert not tool.installed
+
+    tool.parse("--download_url", f"{server.url}/update.exe", "--expected_sha256", sha256)
+    with pytest.raises(SystemExit) as exit:
+        tool.apply_staged_update()
+    assert exit.value.code == 0
+    assert tool.installed == [record["path"]]
+    assert stage.load() is None
+
+
+def test_stale_stage_is_not_applied(tool, server):
+    tool.parse("--download_url", f"{server.url}/update.exe", "--prefetch")
+    with pytest.raises(SystemExit):
+        tool.prefetch_update()
+
+    ## A newer release was published since the prefetch
+    tool.parse("--download_url", f"{server.url}/update-2.exe", "--apply")
+    with pytest.raises(SystemExit) as exit:
+        tool.apply_staged_update()
+    assert exit.value.code == 1
+    assert not tool.installed
+
+
+def test_without_a_stage_the_normal_update_runs(tool):
+    tool.parse("--download_url", "http://127.0.0.1:9/update.exe")
+    assert tool.apply_staged_update() is None
+    assert not tool.installed
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+from throttle import Throttle
+
+
+@pytest.fixture
+def priority(monkeypatch):
+    """ The nice value of a pretend process, psutil is hidden so the os fallback is used. """
+    state = {"nice": 0}
+    def nice(increment):
+        state["nice"] += increment
+    def setpriority(which, who, value):
+        state["nice"] = value
+    monkeypatch.setitem(sys.modules, "psutil", None)
+    monkeypatch.setattr(os, "nice", nice, raising=False)
+    monkeypatch.setattr(os, "getpriority", lambda which, who: state["nice"], raising=False)
+    monkeypatch.setattr(os, "setpriority", setpriority, raising=False)
+    monkeypatch.setattr(Throttle, "adapt", lambda self, url: None)
+    return state
+
+
+def test_background_lowers_the_priority_once(priority):
+    bucket = Throttle(background=True)
+    bucket.watch("http://127.0.0.1/update.exe")
+    bucket.watch("http://127.0.0.1/update.exe")
+    assert priority["nice"] == 10
+
+
+def test_restore_priority_undoes_background_mode(priority):
+    bucket = Throttle(background=True)
+    bucket.watch("http://127.0.0.1/update.exe")
+    bucket.restore_priority()
+    assert priority["nice"] == 0
+    ## A download after the installer starts lowers it again
+    bucket.watch("http://127.0.0.1/update.exe")
+    assert priority["nice"] == 10
+
+
+def test_restore_priority_without_background_changes_nothing(priority):
+    priority["nice"] = 5
+    bucket = Throttle()
+    bucket.watch("http://127.0.0.1/update.exe")
+    bucket.restore_priority()
+    assert priority["nice"] == 5
+
+
+def test_unprivileged_restore_keeps_going(priority, monkeypatch, capsys):
+    def denied(which, who, value):
+        raise PermissionError("Operation not permitted")
+    bucket = Throttle(background=True)
+    bucket.watch("http://127.0.0.1/update.exe")
+    monkeypatch.setattr(os, "setpriority", denied, raising=False)
+    bucket.restore_priority()
+    assert "Unable to restore the process priority" in capsys.readouterr().out
@@ -0,0 +1,70 @@
+import os
+import hashlib
+
+import pytest
+
+from verify import StreamVerifier, VerificationError
+
+
+def feed(verifier, data, order, chunk_size=1000):
+    """ Send data to the verifier in chunk_size pieces, order lists the chunk numbers in arrival order. """
+    for index in order:
+        verifier.update(index * chunk_size, data[index * chunk_size:(index + 1) * chunk_size])
+
+
+@pytest.fixture
+def data():
+    return os.urandom(10000)
+
+
+def write(tmp_path, data):
+    path = tmp_path / "update.exe.part"
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_in_order_stream_needs_no_file(data):
+    verifier = StreamVerifier(hashlib.sha256(data).hexdigest(), len(data))
+    feed(verifier, data, range(10))
+    assert verifier.finalize() == hashlib.sha256(data).hexdigest()
+    assert verifier.read_back == 0
+
+
+def test_segments_ahead_are_hashed_once_the_first_catches_up(tmp_path, data):
+    verifier = StreamVerifier(hashlib.sha256(data).hexdigest(), len(data))
+    ## Two segments streaming at once: 0-4 and 5-9
+    feed(verifier, data, [0, 5, 1, 6, 2, 7, 3, 8, 4, 9])
+    assert verifier.position == len(data) and not verifier.pending
+    assert verifier.finalize(write(tmp_path, data)) == hashlib.sha256(data).hexdigest()
+    assert verifier.read_back == 0
+
+
+def test_what_does_not_fit_is_read_back(tmp_path, data):
+    verifier = StreamVerifier(hashlib.sha256(data).hexdigest(), len(data), max_buffered=2000)
+    feed(verifier, data, [5, 6, 7, 8, 9, 0, 1, 2, 3, 4])
+    assert verifier.buffered <= 2000
+    assert verifier.finalize(write(tmp_path, data)) == hashlib.sha256(data).hexdigest()
+    assert verifier.read_back == 3000
+
+
+def test_chunks_furthest_ahead_are_evicted_first(tmp_path, data):
+    verifier = StreamVerifier(hashlib.sha256(data).hexdigest(), len(data), max_buffered=2000)
+    ## Segments 0-2, 3-5 and 6-9: the last one must give way to the middle one, which is needed sooner
+    feed(verifier, data, [6, 7, 3, 4, 0, 1, 2, 5, 8, 9])
+    assert verifier.position == 6000
+    assert verifier.finalize(write(tmp_path, data)) == hashlib.sha256(data).hexdigest()
+    assert verifier.read_back == 4000
+
+
+def test_mismatch_and_reset(tmp_path, data):
+    verifier = StreamVerifier("0" * 64, len(data))
+    feed(verifier, data, [1, 0])
+    with pytest.raises(VerificationError):
+        verifier.finalize(write(tmp_path, data))
+
+    verifier = StreamVerifier(hashlib.sha256(data).hexdigest(), len(data))
+    feed(verifier, os.urandom(10000), [1, 0])
+    verifier.reset()
+    assert verifier.position == 0 and not verifier.pending
+    feed(verifier, data, range(10))
+    assert verifier.finalize() == hashlib.sha256(data).hexdigest()
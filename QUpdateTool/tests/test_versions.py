@@ -0,0 +1,45 @@
+import pytest
+
+from versions import version_key, is_newer
+
+
+@pytest.mark.parametrize("older, newer", [
+    ("1.9", "1.10"),
+    ("1.2.9", "1.2.10"),
+    ("1.10", "2.0"),
+    ("1.2", "1.2.1"),
+    ("1.2a1", "1.2b1"),
+    ("1.2b2", "1.2rc1"),
+    ("1.2rc1", "1.2"),
+    ("1.2-rc.2", "1.2"),
+    ("1.2.dev1", "1.2a1"),
+    ("1.2", "1.2.post1"),
+    ("1.2-alpha", "1.2-beta"),
+    ("1.1.post3", "1.2a1"),
+    ("v1.9.9", "v1.10.0"),
+])
+def test_ordering(older, newer):
+    assert version_key(older) < version_key(newer)
+    assert is_newer(newer, older)
+    assert not is_newer(older, newer)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("1.2", "1.2.0"),
+    ("1.2.0.0", "1.2"),
+    ("v1.2", "1.2"),
+    ("1.2+build5", "1.2"),
+    ("1.2-RC1", "1.2rc1"),
+])
+def test_equal_versions(first, second):
+    assert version_key(first) == version_key(second)
+    assert not is_newer(first, second)
+
+
+def test_sorting_a_list():
+    versions = ["1.10", "1.2rc1", "1.9", "1.2", "0.9", "1.2.post1", "1.2b3"]
+    assert sorted(versions, key=version_key) == ["0.9", "1.2b3", "1.2rc1", "1.2", "1.2.post1", "1.9", "1.10"]
+
+
+def test_unparsable_versions_do_not_raise():
+    assert version_key("nightly") < version_key("0.1")
@@ -1,71 +1,94 @@
-from PySide6.QtCore import QThread, Signal
+from PySide6.QtCore import QObject, QThread, QTimer, Signal
 
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
-import os
-from tqdm import tqdm
+import sys
+import asyncio
 import threading
 
+from engines import create_engine
+from progress import ProgressReporter, TqdmSubscriber
+
 
 class DownloadThread(QThread):
     update_progress = Signal(dict)
     finished = Signal(str)
 
-    def __init__(self, 
+    def __init__(self,
                  api_endpoint: str = "",
                  download_location: str = r"",
                  gui: bool = True,
-                 parent=None):
+                 reporter: ProgressReporter = None,
+                 parent=None,
+                 **options):
         super(DownloadThread, self).__init__(parent)
-        self.api_endpoint = api_endpoint
-        self.download_location = download_location
         self.gui = gui
-        self.output_file = ""
+        self.progress = reporter or ProgressReporter()
+        if reporter is None and not gui:
+            self.progress.subscribe(TqdmSubscriber())
+        self.progress.subscribe(self.update_progress.emit)
+
+        self.downloader = create_engine(api_endpoint=api_endpoint,
+                                        download_location=download_location,
+                                        reporter=self.progress,
+                                        **options)
+        self.download_location = download_location
+
+
+    @property
+    def output_file(self):
+        return self.downloader.output_file
 
-        DownloadThread.session = requests.Session()
-        retry_strategy = Retry(
-            total=2,
-            status_forcelist=[429, 500, 502, 503, 504],
-            backoff_factor=2
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        DownloadThread.session.mount("https://", adapter)
-        DownloadThread.session.timeout = 2
+
+    @property
+    def message(self):
+        return self.downloader.message
+
+
+    def cancel(self):
+        """ Asks the engine to stop, run() then returns on its own and finished is emitted as usual. """
+        self.downloader.cancel()
 
 
     def run(self):
-        print(f"Downloading from {self.api_endpoint}")
-        response = DownloadThread.session.get(self.api_endpoint, stream=True)
-
-        if response.status_code == 200:
-            filename = response.headers.get("content-disposition", 0).replace("inline; filename=", "")
-            total_size = int(response.headers.get("content-length", 0))
-            self.output_file = os.path.join(self.download_location, filename)
-
-            progress_bar = tqdm(total=total_size, unit="MB", unit_scale=True) if not self.gui else None
-            progress_dict = {"unit": "MB", "n": 0, "total": total_size}
-
-            with open(self.output_file, "wb") as file:
-                bytes_count = 0
-                chunk_size = 128
-                for chunk in response.iter_content(chunk_size=chunk_size):
-                    file.write(chunk)
-                    if progress_bar:
-                        threading.Thread(target=progress_bar.update, args=(len(chunk),)).start()
-                        progress_dict = progress_bar.format_dict
-                    else:
-                        progress_dict = {"unit": "MB", "n": bytes_count, "total": total_size}
-                        bytes_count += chunk_size
-                    self.update_progress.emit(progress_dict)
-                    #threading.Thread(target=progress_bar.update(len(chunk)))
-                    #self.update_progress.emit(progress_bar.format_dict)
-
-            if progress_bar:
-                progress_bar.close()
-
-            message = "Downloaded update successfully!"
-        else:
-            message = f"Error downloading file. Status code: {response.status_code}\n{response.text}" 
-
-        self.finished.emit(message)
\ No newline at end of file
+        ## A QThread isn't started through threading, pick up the --profile hook it would have installed
+        if threading.getprofile():
+            sys.setprofile(threading.getprofile())
+        self.finished.emit(self.downloader.run())
+
+
+class QtEventLoopDriver(QObject):
+    """
+    Runs an asyncio event loop in short slices from a QTimer, so the asyncio download engine
+    shares the GUI thread with Qt instead of needing a thread of its own.
+    """
+    finished = Signal(str)
+
+    def __init__(self, interval: int = 2, parent=None):
+        super(QtEventLoopDriver, self).__init__(parent)
+        self.loop = asyncio.new_event_loop()
+        self.task = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.step)
+
+
+    def run(self, coroutine):
+        self.task = self.loop.create_task(coroutine)
+        self.task.add_done_callback(self.handle_done)
+        self.timer.start()
+
+
+    def step(self):
+        ## One pass of the loop: ready callbacks plus a non-blocking poll of the sockets
+        self.loop.call_soon(self.loop.stop)
+        self.loop.run_forever()
+
+
+    def cancel(self):
+        if self.task and not self.task.done():
+            self.task.cancel()
+            self.step()
+
+
+    def handle_done(self, task):
+        self.timer.stop()
+        self.finished.emit("Update cancelled by user" if task.cancelled() else task.result())
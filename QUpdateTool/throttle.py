@@ -0,0 +1,225 @@
+import os
+import time
+import http.client
+import threading
+from urllib.parse import urlparse
+
+
+def lower_priority():
+    """
+    Drop the CPU and I/O priority of this process so interactive work comes first.
+    Returns the original (nice, ionice) for restore_priority(), None if nothing was changed.
+    """
+    try:
+        import psutil
+    except ImportError:
+        if hasattr(os, "nice"):
+            original = os.getpriority(os.PRIO_PROCESS, 0)
+            os.nice(10)
+            return original, None
+        return None
+
+    process = psutil.Process()
+    try:
+        original = process.nice(), process.ionice()
+        if hasattr(psutil, "BELOW_NORMAL_PRIORITY_CLASS"):
+            process.nice(psutil.BELOW_NORMAL_PRIORITY_CLASS)
+            process.ionice(psutil.IOPRIO_LOW)
+        else:
+            process.nice(10)
+            if hasattr(psutil, "IOPRIO_CLASS_IDLE"):
+                process.ionice(psutil.IOPRIO_CLASS_IDLE)
+        return original
+    except (psutil.Error, OSError) as e:
+        print(f"Unable to lower the process priority: {str(e)}")
+        return None
+
+
+def restore_priority(original):
+    """
+    Put back what lower_priority() changed, child processes started afterwards get the original priority.
+    Raising the nice value again needs privileges on Linux and macOS, without them it stays lowered.
+    """
+    if original is None:
+        return
+    nice, ionice = original
+    try:
+        import psutil
+    except ImportError:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, nice)
+        except OSError as e:
+            print(f"Unable to restore the process priority: {str(e)}")
+        return
+
+    process = psutil.Process()
+    try:
+        process.nice(nice)
+        if isinstance(ionice, tuple):
+            process.ionice(*ionice)
+        elif ionice is not None:
+            process.ionice(ionice)
+    except (psutil.Error, OSError) as e:
+        print(f"Unable to restore the process priority: {str(e)}")
+
+
+class RttProbe():
+    """
+    Round trip time to the download host, timed as a small HEAD request on one long-lived keep-alive connection.
+    Neither requests nor asyncio streams expose the RTT of a live connection, and a fresh TCP (and TLS) handshake
+    every interval would add connections of its own to the link being measured.
+    """
+
+    def __init__(self,
+                 url: str = "",
+                 timeout: float = 2.0):
+        self.parsed = urlparse(url)
+        self.timeout = timeout
+        self.connection = None
+
+
+    def connect(self):
+        if self.parsed.scheme == "https":
+            self.connection = http.client.HTTPSConnection(self.parsed.hostname, self.parsed.port, timeout=self.timeout)
+        else:
+            self.connection = http.client.HTTPConnection(self.parsed.hostname, self.parsed.port, timeout=self.timeout)
+        self.connection.connect()
+
+
+    def measure(self):
+        """ Seconds for one request on the open connection (a reconnect isn't timed), None if the host can't be reached. """
+        target = self.parsed.path or "/"
+        if self.parsed.query:
+            target += f"?{self.parsed.query}"
+        try:
+            if self.connection is None:
+                self.connect()
+            started = time.perf_counter()
+            self.connection.request("HEAD", target, headers={"User-Agent": "QUpdateTool"})
+            response = self.connection.getresponse()
+            response.read()
+            rtt = time.perf_counter() - started
+            if response.will_close:
+                self.close()
+            return rtt
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return None
+
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+
+class Throttle():
+    """
+    Token bucket shared by every download stream of the process, rate in bytes per second (0 is unlimited).
+    In background mode the process priority is lowered and the rate follows the RTT to the download host:
+    queueing delay above target_delay means the link is busy, so the rate backs off, otherwise it grows again.
+    """
+
+    def __init__(self,
+                 max_bandwidth: int = 0,
+                 background: bool = False,
+                 target_delay: float = 0.025,
+                 interval: float = 1.0,
+                 min_rate: int = 1024 * 32):
+        self.max_bandwidth = max_bandwidth
+        self.background = background
+        self.target_delay = target_delay
+        self.interval = interval
+        self.min_rate = min_rate
+        self.lock = threading.Lock()
+        self.consumed = 0
+        self.watcher = None
+        self.lowered = False
+        self.original_priority = None
+        self.rate = 0
+        self.tokens = 0
+        self.set_rate(max_bandwidth)
+
+
+    def set_rate(self, rate):
+        with self.lock:
+            limited = bool(self.rate)
+            self.rate = rate
+            ## A quarter second of burst keeps the transfer smooth without overshooting the cap
+            self.burst = max(rate / 4, 1024 * 64) if rate else 0
+            self.tokens = min(self.tokens, self.burst) if limited else self.burst
+            self.updated = time.monotonic()
+
+
+    def reserve(self, size):
+        """ Take size bytes from the bucket, returns the seconds to wait before reading more. """
+        with self.lock:
+            self.consumed += size
+            if not self.rate:
+                return 0
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= size
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+    def read_size(self, size):
+        """ size capped to the bucket, a limited stream that reads more than the burst at once goes out in bursts. """
+        with self.lock:
+            return min(size, int(self.burst)) if self.rate else size
+
+
+    def wait(self, size):
+        delay = self.reserve(size)
+        if delay:
+            time.sleep(delay)
+
+
+    def watch(self, url):
+        """ Start background mode against the host of url, the watcher runs once per process. """
+        if not self.background or not urlparse(url).hostname:
+            return
+        with self.lock:
+            lower = not self.lowered
+            self.lowered = True
+            start = self.watcher is None
+            if start:
+                self.watcher = threading.Thread(target=self.adapt, args=(url,), daemon=True)
+        if lower:
+            self.original_priority = lower_priority()
+        if start:
+            self.watcher.start()
+
+
+    def restore_priority(self):
+        """ Undo the lowered priority, e.g. before launching an installer that would inherit it. The next watch() lowers it again. """
+        with self.lock:
+            restore, self.lowered = self.lowered, False
+        if restore:
+            restore_priority(self.original_priority)
+
+
+    def adapt(self, url):
+        probe = RttProbe(url)
+        base_rtt = None
+        last_consumed = self.consumed
+        while True:
+            time.sleep(self.interval)
+            rtt = probe.measure()
+            throughput = (self.consumed - last_consumed) / self.interval
+            last_consumed = self.consumed
+            if rtt is None:
+                continue
+            base_rtt = rtt if base_rtt is None else min(base_rtt, rtt)
+
+            if rtt - base_rtt > self.target_delay:
+                ## Multiplicative decrease, starting from what we are actually getting when there is no cap yet
+                rate = max(self.min_rate, (self.rate or throughput) * 0.7)
+            elif self.rate:
+                rate = self.rate * 1.1 + self.min_rate
+                if self.max_bandwidth:
+                    rate = min(rate, self.max_bandwidth)
+            else:
+                continue
+            self.set_rate(int(rate))
@@ -0,0 +1,23 @@
+def to_bool(value):
+    """ Config values arrive as strings from update.ini, so "False" must not be truthy. """
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def parse_list(value):
+    """ List from a JSON list or a comma / newline separated string, as mirrors are written in update.ini. """
+    if isinstance(value, (list, tuple)):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in (value or "").replace("\n", ",").split(",") if item.strip()]
+
+
+def parse_size(value):
+    """ Byte count from a plain number or a 500K / 20M / 2G style string. """
+    if isinstance(value, (int, float)):
+        return int(value)
+    value = value.strip().upper().rstrip("B")
+    multipliers = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if value and value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(float(value))
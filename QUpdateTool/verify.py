@@ -0,0 +1,101 @@
+import os
+import hashlib
+import threading
+
+
+class VerificationError(Exception):
+    pass
+
+
+class StreamVerifier():
+    """
+    SHA-256 and size check computed over the download buffers as they are written.
+    SHA-256 only runs in file order and digests of separate segments can't be combined into the digest of the file,
+    so bytes arriving ahead of the in-order position (later segments) are kept in memory, up to max_buffered, and
+    hashed as soon as the segments before them catch up. What didn't fit, and bytes resumed from an earlier run,
+    are read back from the file in finalize(): for a large ranged download that is still a read of most of the file.
+    """
+
+    max_buffered = 1024 * 1024 * 32
+
+    def __init__(self,
+                 expected_sha256: str = "",
+                 expected_size: int = 0,
+                 max_buffered: int = None):
+        self.expected_sha256 = (expected_sha256 or "").strip().lower()
+        self.expected_size = int(expected_size or 0)
+        self.max_buffered = StreamVerifier.max_buffered if max_buffered is None else max_buffered
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        with self.lock:
+            self.digest = hashlib.sha256()
+            self.position = 0
+            self.sha256 = ""
+            self.pending = {}
+            self.buffered = 0
+            ## Everything from here on was dropped or evicted somewhere and will be read back
+            self.limit = float("inf")
+            self.read_back = 0
+
+
+    def check_size(self, total_size):
+        """ Fail fast when the server announces a different size than expected. """
+        if self.expected_size and total_size and total_size != self.expected_size:
+            raise VerificationError(f"Expected {self.expected_size} bytes but the server reports {total_size}")
+
+
+    def update(self, offset, chunk):
+        with self.lock:
+            if offset == self.position:
+                self.digest.update(chunk)
+                self.position += len(chunk)
+                ## The stream behind caught up, hash what the ones ahead of it already sent
+                while self.position in self.pending:
+                    data = self.pending.pop(self.position)
+                    self.buffered -= len(data)
+                    self.digest.update(data)
+                    self.position += len(data)
+            elif self.position < offset < self.limit:
+                self.hold(offset, chunk)
+
+
+    def hold(self, offset, chunk):
+        """ Keep an out of order chunk, making room by evicting the chunks furthest ahead, they are needed last. """
+        while self.pending and self.buffered + len(chunk) > self.max_buffered and max(self.pending) > offset:
+            furthest = max(self.pending)
+            self.buffered -= len(self.pending.pop(furthest))
+            self.limit = furthest
+        if self.buffered + len(chunk) > self.max_buffered:
+            self.limit = min(self.limit, offset)
+            return
+        ## Copied, the download reuses its buffer for the next read
+        self.pending[offset] = bytes(chunk)
+        self.buffered += len(chunk)
+
+
+    def finalize(self, file_path=None):
+        """
+        Hash whatever was not seen in order, then compare against the expected values.
+        Without a file (an archive extracted as it streamed) every byte was seen in order.
+        """
+        size = os.path.getsize(file_path) if file_path else self.position
+        with self.lock:
+            if self.position < size:
+                self.read_back = size - self.position
+                with open(file_path, "rb") as file:
+                    file.seek(self.position)
+                    for block in iter(lambda: file.read(1024 * 1024), b""):
+                        self.digest.update(block)
+                self.position = size
+            self.pending = {}
+            self.buffered = 0
+            self.sha256 = self.digest.hexdigest()
+
+        if self.expected_size and size != self.expected_size:
+            raise VerificationError(f"Expected {self.expected_size} bytes but downloaded {size}")
+        if self.expected_sha256 and self.sha256 != self.expected_sha256:
+            raise VerificationError(f"SHA-256 mismatch, expected {self.expected_sha256} but got {self.sha256}")
+        return self.sha256
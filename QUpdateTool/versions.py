@@ -0,0 +1,132 @@
+import os
+import re
+import json
+import time
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+## Pre-release tags order before the release they precede: 1.2a1 < 1.2b1 < 1.2rc1 < 1.2 < 1.2.post1
+PRE_RELEASES = {"dev": -4, "a": -3, "alpha": -3, "b": -2, "beta": -2, "c": -1, "rc": -1, "pre": -1, "preview": -1}
+POST_RELEASES = ("post", "rev", "r", "p", "patch")
+
+
+def version_key(version):
+    """
+    Sort key for version strings like 1.10.2, v2.0-rc1 or 1.2b3, numbers compare as numbers.
+    Trailing zero releases are equal (1.2 == 1.2.0) and a pre-release sorts before its release.
+    """
+    text = str(version).strip().lower().lstrip("v").split("+")[0]
+    release, _, suffix = text.partition("-")
+    match = re.match(r"^(\d+(?:\.\d+)*)(.*)$", release)
+    if not match:
+        return ((0,), ((1, 0, text),))
+
+    numbers = [int(part) for part in match.group(1).split(".")]
+    while len(numbers) > 1 and numbers[-1] == 0:
+        numbers.pop()
+
+    tags = []
+    for name, number in re.findall(r"([a-z]+)\.?(\d*)", f"{match.group(2)} {suffix}".replace("_", "")):
+        if name in PRE_RELEASES:
+            tags.append((PRE_RELEASES[name], int(number or 0), ""))
+        elif name in POST_RELEASES:
+            tags.append((1, int(number or 0), ""))
+        else:
+            tags.append((0, int(number or 0), name))
+    ## A plain release sits between its pre-releases (negative) and post-releases (positive)
+    return (tuple(numbers), tuple(tags) or ((0, 0, ""),))
+
+
+def is_newer(latest, current):
+    return version_key(latest) > version_key(current)
+
+
+class VersionCheck():
+    """
+    Fetches the small version manifest ({"version", "download_url", "sha256", "size"}) of a product.
+    The response is cached with its ETag / Last-Modified and fresh for max-age (Cache-Control) or ttl seconds,
+    so a scheduled check inside that window costs no request and a later one is usually a 304.
+    """
+
+    def __init__(self,
+                 manifest_url: str = "",
+                 cache_directory: str = "",
+                 ttl: float = 300,
+                 timeout: float = 5):
+        self.manifest_url = manifest_url
+        self.ttl = ttl
+        self.timeout = timeout
+        name = re.sub(r"[^A-Za-z0-9]+", "_", manifest_url).strip("_")[-100:]
+        self.cache_path = os.path.join(cache_directory, "versions", f"{name}.json") if cache_directory else ""
+
+
+    def load_cached(self):
+        if not self.cache_path:
+            return None
+        try:
+            with open(self.cache_path, "r") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable version cache {self.cache_path}: {str(e)}")
+            return None
+
+
+    def save_cached(self, entry):
+        if not self.cache_path:
+            return
+        temp_path = f"{self.cache_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            with open(temp_path, "w") as file:
+                json.dump(entry, file)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            print(f"Unable to save version cache {self.cache_path}: {str(e)}")
+
+
+    def expires(self, headers):
+        cache_control = (headers.get("Cache-Control") or "").lower()
+        if "no-store" in cache_control or "no-cache" in cache_control:
+            return 0
+        max_age = re.search(r"max-age=(\d+)", cache_control)
+        return time.time() + (int(max_age.group(1)) if max_age else self.ttl)
+
+
+    def fetch(self):
+        """ The manifest, from the cache while it is fresh, None if it can't be had at all. """
+        cached = self.load_cached()
+        if cached and time.time() < cached.get("expires", 0):
+            return cached["manifest"]
+
+        request = Request(self.manifest_url, headers={"User-Agent": "QUpdateTool", "Accept": "application/json"})
+        if cached and cached.get("etag"):
+            request.add_header("If-None-Match", cached["etag"])
+        if cached and cached.get("last_modified"):
+            request.add_header("If-Modified-Since", cached["last_modified"])
+
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                manifest = json.loads(response.read(1024 * 1024))
+                headers = response.headers
+        except HTTPError as e:
+            if e.code == 304 and cached:
+                cached["expires"] = self.expires(e.headers)
+                self.save_cached(cached)
+                return cached["manifest"]
+            print(f"Version check failed: {str(e)}")
+            return cached["manifest"] if cached else None
+        except (URLError, OSError, ValueError) as e:
+            ## An unreachable server shouldn't block an update, a stale answer is better than none
+            print(f"Version check failed: {str(e)}")
+            return cached["manifest"] if cached else None
+
+        if not isinstance(manifest, dict) or not manifest.get("version"):
+            print("Version manifest has no version")
+            return None
+        self.save_cached({"manifest": manifest,
+                          "etag": headers.get("ETag", ""),
+                          "last_modified": headers.get("Last-Modified", ""),
+                          "expires": self.expires(headers)})
+        return manifest